@@ -0,0 +1,108 @@
+"""Local stand-in for the AIMLAPI chat completions endpoint.
+
+Lets the backend be load-tested offline:
+
+    uvicorn aimlapi_stub:app --port 8100
+    AIMLAPI_BASE_URL=http://localhost:8100/v1 AIMLAPI_KEY=stub uvicorn main:app
+
+STUB_LATENCY_MS and STUB_FAILURE_RATE control the simulated provider behaviour.
+With "stream": true the answer is sent as SSE chunks, the first one after STUB_LATENCY_MS
+and the rest every STUB_TOKEN_INTERVAL_MS.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_LATENCY_MS = float(os.getenv('STUB_LATENCY_MS', 800))
+STUB_LATENCY_JITTER_MS = float(os.getenv('STUB_LATENCY_JITTER_MS', 200))
+STUB_FAILURE_RATE = float(os.getenv('STUB_FAILURE_RATE', 0.0))
+STUB_TOKEN_INTERVAL_MS = float(os.getenv('STUB_TOKEN_INTERVAL_MS', 20))
+
+app = FastAPI(title="AIMLAPI Stub")
+
+VISION_ANSWER = {
+    "condition": "Mild Conjunctivitis",
+    "severity": "mild",
+    "analysis": "Slight redness of the palpebral conjunctiva with no discharge visible.",
+    "recommendations": "Use lubricating eye drops and avoid rubbing the eyes.",
+    "medical_advice": "See an eye specialist if redness or pain increases.",
+    "risk_level": "low",
+    "follow_up": "3 days"
+}
+
+TEXT_ANSWER = (
+    "This is a stub answer from the local AIMLAPI simulator. "
+    "Always consult a healthcare professional for proper diagnosis and treatment."
+)
+
+def is_vision_request(messages) -> bool:
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return True
+    return False
+
+def stream_chunks(completion_id: str, model: str, content: str):
+    """Split an answer into chat.completion.chunk SSE events, one word per chunk"""
+    async def event_stream():
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(STUB_TOKEN_INTERVAL_MS / 1000)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": word if i == 0 else f" {word}"},
+                    "finish_reason": "stop" if i == len(words) - 1 else None
+                }]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    messages = payload.get("messages", [])
+
+    latency = max(0.0, STUB_LATENCY_MS + random.uniform(-STUB_LATENCY_JITTER_MS, STUB_LATENCY_JITTER_MS))
+    await asyncio.sleep(latency / 1000)
+
+    if random.random() < STUB_FAILURE_RATE:
+        return JSONResponse(status_code=503, content={"error": {"message": "Simulated upstream failure"}})
+
+    content = json.dumps(VISION_ANSWER) if is_vision_request(messages) else TEXT_ANSWER
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if payload.get("stream"):
+        return stream_chunks(completion_id, payload.get("model", "gpt-4o"), content)
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "gpt-4o"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv('STUB_PORT', 8100)))
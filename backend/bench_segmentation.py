@@ -0,0 +1,111 @@
+"""Microbenchmark for create_segmentation_visualization.
+
+Compares the single-pass renderer in main.py against the previous
+per-mask implementation on a synthetic phone-sized photo:
+
+    python backend/bench_segmentation.py --width 4000 --height 3000 --masks 6
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from main import CLASS_COLORS, CLASS_NAMES, create_segmentation_visualization
+
+class FakeTensor:
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+class FakeMasks:
+    def __init__(self, data):
+        self.data = FakeTensor(data)
+
+class FakeBoxes:
+    def __init__(self, cls, conf):
+        self.cls = FakeTensor(cls)
+        self.conf = FakeTensor(conf)
+
+class FakeResults:
+    def __init__(self, masks, classes, confidences):
+        self.masks = FakeMasks(masks)
+        self.boxes = FakeBoxes(classes, confidences)
+
+def make_results(num_masks: int, mask_size=(480, 640), seed: int = 0):
+    rng = np.random.default_rng(seed)
+    mask_height, mask_width = mask_size
+    masks = np.zeros((num_masks, mask_height, mask_width), dtype=np.float32)
+    for i in range(num_masks):
+        center = (int(rng.integers(50, mask_width - 50)), int(rng.integers(50, mask_height - 50)))
+        axes = (int(rng.integers(30, 150)), int(rng.integers(20, 80)))
+        cv2.ellipse(masks[i], center, axes, 0, 0, 360, 1.0, -1)
+    classes = rng.integers(0, len(CLASS_NAMES), num_masks).astype(np.float32)
+    confidences = rng.uniform(0.4, 0.95, num_masks).astype(np.float32)
+    return FakeResults(masks, classes, confidences)
+
+def legacy_visualization(image, results):
+    """Previous renderer: one full-frame overlay and blend per mask"""
+    annotated_image = image.copy()
+    detection_info = []
+    masks = results.masks.data.cpu().numpy()
+    classes = results.boxes.cls.cpu().numpy().astype(int)
+    confidences = results.boxes.conf.cpu().numpy()
+
+    for mask, cls_idx, conf in zip(masks, classes, confidences):
+        color = CLASS_COLORS[cls_idx]
+        mask = (mask > 0.5).astype(np.uint8)
+        mask_resized = cv2.resize(mask, (annotated_image.shape[1], annotated_image.shape[0]),
+                                  interpolation=cv2.INTER_NEAREST)
+        colored_mask = np.zeros_like(annotated_image, dtype=np.uint8)
+        for c in range(3):
+            colored_mask[:, :, c] = mask_resized * color[c]
+        annotated_image = cv2.addWeighted(annotated_image, 1.0, colored_mask, 0.6, 0)
+        cv2.moments(mask_resized)
+        detection_info.append({
+            "class": CLASS_NAMES[cls_idx],
+            "confidence": float(conf),
+            "area": int(np.sum(mask_resized))
+        })
+    return annotated_image, detection_info
+
+def time_renderer(renderer, image, results, repeat: int) -> float:
+    renderer(image, results)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        renderer(image, results)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark segmentation overlay rendering")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--masks", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    image = np.random.default_rng(1).integers(0, 255, (args.height, args.width, 3), dtype=np.uint8)
+    results = make_results(args.masks)
+
+    legacy_ms = time_renderer(legacy_visualization, image, results, args.repeat)
+    current_ms = time_renderer(create_segmentation_visualization, image, results, args.repeat)
+
+    _, legacy_info = legacy_visualization(image, results)
+    _, current_info = create_segmentation_visualization(image, results)
+    max_area_error = max(
+        abs(a["area"] - b["area"]) / max(a["area"], 1) for a, b in zip(legacy_info, current_info)
+    ) if legacy_info else 0.0
+
+    print(f"Image: {args.width}x{args.height}, masks: {args.masks}, repeat: {args.repeat}")
+    print(f"Per-mask renderer:    {legacy_ms:8.1f} ms")
+    print(f"Single-pass renderer: {current_ms:8.1f} ms")
+    print(f"Speedup:              {legacy_ms / current_ms:8.2f}x")
+    print(f"Max relative area difference: {max_area_error:.2%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure cold-start cost of the backend.
+
+Reports the wall time of `import main`, the slowest modules it imports
+(from `python -X importtime`), what each lazily imported heavy dependency
+costs on first use, and optionally the model warm-up time:
+
+    python backend/bench_startup.py --top 15 --warmup
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(BACKEND_DIR)
+
+# Dependencies main.py imports lazily, in the order the first request needs them
+LAZY_MODULES = ["cv2", "ultralytics", "torch", "langgraph.graph", "openai", "httpx", "matplotlib.backends.backend_agg"]
+
+def run_python(code: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    """Run code in a fresh interpreter from the project root, like `python backend/main.py`"""
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", f"import sys; sys.path.insert(0, {BACKEND_DIR!r}); {code}"]
+    return subprocess.run(command, cwd=PROJECT_ROOT, capture_output=True, text=True)
+
+def parse_importtime(stderr: str):
+    """Return (module, self_us, cumulative_us, depth) for every line of -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+def timed(code: str) -> float:
+    """Wall time in ms of a snippet in a fresh interpreter"""
+    result = run_python(
+        "import time; _start = time.perf_counter(); "
+        f"{code}; "
+        "print(f'__elapsed__ {(time.perf_counter() - _start) * 1000:.1f}')"
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("__elapsed__"):
+            return float(line.split()[1])
+    raise RuntimeError(f"Failed to run {code!r}:\n{result.stderr}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend startup time")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to list")
+    parser.add_argument("--warmup", action="store_true", help="Also time model loading and warm-up inference")
+    args = parser.parse_args()
+
+    print(f"import main: {timed('import main'):.0f} ms")
+
+    entries = parse_importtime(run_python("import main", importtime=True).stderr)
+    # Top-level packages only (depth 1 is directly under `import main`'s own tree)
+    packages = {}
+    for name, _, cumulative_us, depth in entries:
+        if depth <= 1:
+            root = name.split(".")[0]
+            packages[root] = max(packages.get(root, 0), cumulative_us)
+
+    print("\nSlowest imports pulled in by main (cumulative):")
+    for name, cumulative_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<28}{cumulative_us / 1000:8.1f} ms")
+
+    print("\nLazy dependencies (cost paid on first use, or by the startup warm-up):")
+    for module in LAZY_MODULES:
+        try:
+            print(f"  {module:<28}{timed(f'import {module}'):8.1f} ms")
+        except RuntimeError:
+            print(f"  {module:<28}{'not installed':>11}")
+
+    if args.warmup:
+        print(f"\nModel load + warm-up inference: {timed('import main; main.warm_up_model()'):.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Compare inference backends against the PyTorch checkpoint.
+
+Runs every backend on the images in backend/uploads and reports per-class
+mask IoU and confidence drift relative to torch:
+
+    python backend/check_backend_parity.py --backend onnxruntime openvino --limit 50
+
+Exits with status 1 if any backend falls below --min-iou or above --max-conf-drift.
+"""
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from main import CLASS_NAMES, INFERENCE_IMGSZ, UPLOAD_DIR, INFERENCE_BACKENDS, load_inference_model
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def load_images(image_dir: str, limit: int = None):
+    """Decode the images in a directory, skipping files OpenCV cannot read"""
+    images = []
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            images.append((name, image))
+        if limit and len(images) >= limit:
+            break
+    return images
+
+def extract_detections(result):
+    """Class, confidence and boolean mask for every detection in a YOLO result"""
+    if result.masks is None:
+        return []
+    masks = result.masks.data.cpu().numpy() > 0.5
+    classes = result.boxes.cls.cpu().numpy().astype(int)
+    confidences = result.boxes.conf.cpu().numpy()
+    return [
+        {"class": int(cls_idx), "confidence": float(conf), "mask": mask}
+        for mask, cls_idx, conf in zip(masks, classes, confidences)
+    ]
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    if a.shape != b.shape:
+        b = cv2.resize(b.astype(np.uint8), (a.shape[1], a.shape[0]), interpolation=cv2.INTER_NEAREST) > 0
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+def match_detections(reference, candidate):
+    """Greedily pair each reference detection with the best same-class candidate mask"""
+    matches, missed = [], []
+    available = list(candidate)
+    for ref in sorted(reference, key=lambda d: -d["confidence"]):
+        best, best_iou = None, 0.0
+        for cand in available:
+            if cand["class"] != ref["class"]:
+                continue
+            iou = mask_iou(ref["mask"], cand["mask"])
+            if iou > best_iou:
+                best, best_iou = cand, iou
+        if best is None:
+            missed.append(ref)
+            continue
+        available.remove(best)
+        matches.append((ref, best, best_iou))
+    return matches, missed, available
+
+def compare_models(reference_model, candidate_model, images, imgsz: int = INFERENCE_IMGSZ):
+    """Per-class mask IoU and confidence drift of candidate_model against reference_model"""
+    stats = {name: {"ious": [], "drifts": [], "missed": 0, "extra": 0} for name in CLASS_NAMES}
+
+    for _, image in images:
+        reference = extract_detections(reference_model(image, imgsz=imgsz, verbose=False)[0])
+        candidate = extract_detections(candidate_model(image, imgsz=imgsz, verbose=False)[0])
+        matches, missed, extra = match_detections(reference, candidate)
+
+        for ref, cand, iou in matches:
+            class_stats = stats[CLASS_NAMES[ref["class"]]]
+            class_stats["ious"].append(iou)
+            class_stats["drifts"].append(abs(ref["confidence"] - cand["confidence"]))
+        for det in missed:
+            stats[CLASS_NAMES[det["class"]]]["missed"] += 1
+            stats[CLASS_NAMES[det["class"]]]["ious"].append(0.0)
+        for det in extra:
+            stats[CLASS_NAMES[det["class"]]]["extra"] += 1
+
+    report = {}
+    for name, class_stats in stats.items():
+        report[name] = {
+            "mean_iou": float(np.mean(class_stats["ious"])) if class_stats["ious"] else None,
+            "max_conf_drift": float(np.max(class_stats["drifts"])) if class_stats["drifts"] else None,
+            "mean_conf_drift": float(np.mean(class_stats["drifts"])) if class_stats["drifts"] else None,
+            "matched": len(class_stats["drifts"]),
+            "missed": class_stats["missed"],
+            "extra": class_stats["extra"]
+        }
+    return report
+
+def report_passes(report, min_iou: float, max_conf_drift: float) -> bool:
+    for class_report in report.values():
+        if class_report["mean_iou"] is not None and class_report["mean_iou"] < min_iou:
+            return False
+        if class_report["mean_conf_drift"] is not None and class_report["mean_conf_drift"] > max_conf_drift:
+            return False
+    return True
+
+def print_report(title: str, report):
+    print(f"\n{title}")
+    print(f"{'class':<22}{'mean IoU':>10}{'mean drift':>12}{'max drift':>11}{'matched':>9}{'missed':>8}{'extra':>7}")
+    for name, r in report.items():
+        fmt = lambda value: f"{value:.3f}" if value is not None else "-"
+        print(f"{name:<22}{fmt(r['mean_iou']):>10}{fmt(r['mean_conf_drift']):>12}{fmt(r['max_conf_drift']):>11}"
+              f"{r['matched']:>9}{r['missed']:>8}{r['extra']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check inference backend parity against torch")
+    parser.add_argument("--backend", nargs="+", default=["onnxruntime", "openvino"],
+                        choices=[name for name in INFERENCE_BACKENDS if name != "torch"])
+    parser.add_argument("--images", default=UPLOAD_DIR)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--min-iou", type=float, default=0.9)
+    parser.add_argument("--max-conf-drift", type=float, default=0.05)
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.limit)
+    if not images:
+        print(f"No images found in {args.images}")
+        sys.exit(1)
+
+    reference_model = load_inference_model("torch")
+    all_passed = True
+    for backend in args.backend:
+        report = compare_models(reference_model, load_inference_model(backend), images)
+        passed = report_passes(report, args.min_iou, args.max_conf_drift)
+        all_passed = all_passed and passed
+        print_report(f"{backend} vs torch on {len(images)} images: {'PASS' if passed else 'FAIL'}", report)
+
+    sys.exit(0 if all_passed else 1)
+
+if __name__ == "__main__":
+    main()
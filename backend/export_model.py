@@ -0,0 +1,24 @@
+"""Export the conjunctiva segmentation model for the CPU inference backends.
+
+The converted artifacts are cached in MODEL_EXPORT_DIR and picked up by
+main.py when INFERENCE_BACKEND is set:
+
+    python backend/export_model.py --backend onnxruntime openvino
+"""
+import argparse
+
+from main import INFERENCE_BACKENDS, export_model
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the YOLO model for CPU inference backends")
+    parser.add_argument("--backend", nargs="+", default=["onnxruntime"],
+                        choices=[name for name, export_format in INFERENCE_BACKENDS.items() if export_format])
+    parser.add_argument("--force", action="store_true", help="Re-export even if a cached artifact exists")
+    args = parser.parse_args()
+
+    for backend in args.backend:
+        path = export_model(backend, force=args.force)
+        print(f"✅ {backend}: {path}")
+
+if __name__ == "__main__":
+    main()
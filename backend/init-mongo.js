@@ -11,6 +11,12 @@ db.createCollection('analyses');
 db.createCollection('appointments');
 db.createCollection('questions');
 db.createCollection('admins');
+db.createCollection('analysis_queue');
+db.createCollection('outbox');
+db.createCollection('notifications');
+db.createCollection('comparisons');
+db.createCollection('progress_series');
+db.createCollection('user_stats');
 
 // Create indexes for better performance
 db.users.createIndex({ "email": 1 }, { unique: true });
@@ -19,6 +25,16 @@ db.doctors.createIndex({ "status": 1 });
 db.analyses.createIndex({ "user_id": 1, "timestamp": -1 });
 db.appointments.createIndex({ "doctor_id": 1, "preferred_date": 1 });
 db.appointments.createIndex({ "user_id": 1 });
+db.questions.createIndex({ "question_key": 1, "timestamp": -1 }, { sparse: true });
+db.analysis_queue.createIndex({ "status": 1, "available_at": 1 });
+db.analysis_queue.createIndex({ "status": 1, "lease_expires_at": 1 });
+db.analysis_queue.createIndex({ "dedup_key": 1 }, { unique: true, partialFilterExpression: { "active": true } });
+db.analysis_queue.createIndex({ "user_id": 1, "created_at": -1 });
+db.outbox.createIndex({ "status": 1, "available_at": 1 });
+db.outbox.createIndex({ "status": 1, "lease_expires_at": 1 });
+db.outbox.createIndex({ "sent_at": 1 }, { expireAfterSeconds: 604800 });  // keep sent emails for a week
+db.notifications.createIndex({ "digest_id": 1, "recipient": 1, "created_at": 1 });
+db.notifications.createIndex({ "digested_at": 1 }, { expireAfterSeconds: 2592000 });  // keep digested notifications for 30 days
 
 // Optional: Create a default admin user (uncomment if needed)
 /*
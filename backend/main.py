@@ -1,40 +1,51 @@
 import socket
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, status
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Header, status
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
-import cv2
 import numpy as np
 import base64
 import io
 from PIL import Image
 import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Annotated
 import asyncio
+import queue
+import threading
+import time
+import random
+import hashlib
+import zlib
+import re
+import unicodedata
+import math
+import shutil
+from html import escape as escape_html
+from string import Template
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 from pydantic import BaseModel, EmailStr, Field
 import json
 import bcrypt
 import jwt
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+import aiofiles
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
-import matplotlib.pyplot as plt
 from io import BytesIO
-
-# LangGraph imports
-from langgraph.graph import StateGraph, END
 from typing_extensions import TypedDict
 
-# YOLO import
-from ultralytics import YOLO
-
-# OpenAI with AIMLAPI
-from openai import OpenAI
+# Heavy dependencies (cv2, ultralytics/torch, matplotlib, langgraph, openai) are
+# imported where they are first used so workers start quickly; the startup
+# event warms them up before traffic arrives.
 
 # Environment variables
 from dotenv import load_dotenv
@@ -60,17 +71,132 @@ DOCTOR_DOCUMENTS_DIR = os.path.abspath('backend/uploads/doctor_documents')
 
 # API Keys
 AIMLAPI_KEY = os.getenv('AIMLAPI_KEY')
+AIMLAPI_BASE_URL = os.getenv('AIMLAPI_BASE_URL', 'https://api.aimlapi.com/v1')
 MONGODB_URL = os.getenv('MONGODB_URL', 'mongodb://localhost:27017')
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_DAYS = 30
 
+# Inference backend configuration (torch / onnxruntime / openvino)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch').lower()
+INFERENCE_IMGSZ = int(os.getenv('INFERENCE_IMGSZ', 640))
+MODEL_EXPORT_DIR = os.getenv('MODEL_EXPORT_DIR', 'backend/model_exports')
+# Accuracy gate the INT8 model must pass against FP32 before it is served
+QUANTIZED_MIN_IOU = float(os.getenv('QUANTIZED_MIN_IOU', 0.85))
+QUANTIZED_MAX_CONF_DRIFT = float(os.getenv('QUANTIZED_MAX_CONF_DRIFT', 0.05))
+QUANTIZED_MIN_MATCHED = int(os.getenv('QUANTIZED_MIN_MATCHED', 5))  # matched detections needed per class
+QUANTIZED_MAX_MISSED_RATE = float(os.getenv('QUANTIZED_MAX_MISSED_RATE', 0.05))
+QUANTIZED_MAX_EXTRA_RATE = float(os.getenv('QUANTIZED_MAX_EXTRA_RATE', 0.05))
+
+# Load and run a dummy inference during startup
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', 'true').lower() == 'true'
+
+# Inference batching configuration
+INFERENCE_BATCH_SIZE = int(os.getenv('INFERENCE_BATCH_SIZE', 8))
+INFERENCE_BATCH_WINDOW_MS = float(os.getenv('INFERENCE_BATCH_WINDOW_MS', 10))
+
+# LLM client configuration
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', 60))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 20))
+# Circuit breaker: open after this many consecutive failed (or slower than LLM_BREAKER_SLOW_SECONDS)
+# calls, answer from the local fallback while open, then let one probe call through after the reset time
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv('LLM_BREAKER_SLOW_SECONDS', 20))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))
+
+# Analysis result cache configuration
+MODEL_VERSION = os.getenv('MODEL_VERSION', f"{os.path.basename(YOLO_MODEL_PATH)}:{INFERENCE_BACKEND}")
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', 256))
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', 24 * 3600))
+
+# /ask-question answer cache, keyed on the normalized question. With QUESTION_CACHE_PERSIST
+# a miss falls back to recent answers stored in db.questions before calling GPT-4o.
+QUESTION_CACHE_SIZE = int(os.getenv('QUESTION_CACHE_SIZE', 1024))
+QUESTION_CACHE_TTL_SECONDS = int(os.getenv('QUESTION_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+QUESTION_CACHE_PERSIST = os.getenv('QUESTION_CACHE_PERSIST', 'true').lower() == 'true'
+
+# Curated FAQ retrieval: questions scoring at least FAQ_MATCH_THRESHOLD (cosine similarity) against
+# a vetted entry in FAQ_PATH are answered without an LLM call; entries scoring at least
+# FAQ_CONTEXT_THRESHOLD are given to GPT-4o as reference answers. An empty FAQ_PATH disables it.
+# Shipped next to main.py, so it is found in the Docker image (/app) as well as from the repo root
+FAQ_PATH = os.getenv('FAQ_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faq.json'))
+FAQ_MATCH_THRESHOLD = float(os.getenv('FAQ_MATCH_THRESHOLD', 0.8))
+FAQ_CONTEXT_THRESHOLD = float(os.getenv('FAQ_CONTEXT_THRESHOLD', 0.3))
+FAQ_CONTEXT_PASSAGES = int(os.getenv('FAQ_CONTEXT_PASSAGES', 3))
+
+# GPT-4o vision payload preparation
+VISION_CROP_MARGIN = float(os.getenv('VISION_CROP_MARGIN', 0.15))
+VISION_MAX_EDGE = int(os.getenv('VISION_MAX_EDGE', 768))
+VISION_JPEG_QUALITY = int(os.getenv('VISION_JPEG_QUALITY', 85))
+
+# Time budget for an analysis; clients can ask for less with the X-Request-Timeout header (seconds).
+# When it runs out before GPT-4o answers, the YOLO results are returned and saved with partial=true.
+ANALYSIS_DEADLINE_SECONDS = float(os.getenv('ANALYSIS_DEADLINE_SECONDS', 30))
+DEADLINE_RESERVE_SECONDS = 0.5  # kept back for saving the result after the LLM is cut off
+
+# Background analysis jobs (POST /analyze-image?job=true)
+ANALYSIS_JOB_TTL_SECONDS = int(os.getenv('ANALYSIS_JOB_TTL_SECONDS', 3600))
+
+# Analysis execution: "inline" runs the pipeline in the API process, "mongo" enqueues it
+# in MongoDB for `python backend/worker.py` processes to consume
+ANALYSIS_QUEUE = os.getenv('ANALYSIS_QUEUE', 'inline').lower()
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 60))
+JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', 15))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_BASE_DELAY = float(os.getenv('JOB_RETRY_BASE_DELAY', 5))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+JOB_WAIT_SECONDS = int(os.getenv('JOB_WAIT_SECONDS', 120))  # synchronous requests wait at most this long (and within their deadline)
+
+# Detection pipeline execution (thread or process pool)
+DETECTION_EXECUTOR = os.getenv('DETECTION_EXECUTOR', 'thread').lower()
+DETECTION_WORKERS = int(os.getenv('DETECTION_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+DETECTION_QUEUE_SIZE = int(os.getenv('DETECTION_QUEUE_SIZE', 16))
+
+# Admission control: concurrency and wait-queue limits for the other pipeline stages (callers
+# beyond the queue get 503 + Retry-After) and per-user token buckets (429 + Retry-After)
+LLM_QUEUE_SIZE = int(os.getenv('LLM_QUEUE_SIZE', 32))
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', 2))
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', 16))
+ANALYZE_RATE_PER_MINUTE = float(os.getenv('ANALYZE_RATE_PER_MINUTE', 10))  # 0 disables the quota
+ANALYZE_BURST = int(os.getenv('ANALYZE_BURST', 5))
+QUESTION_RATE_PER_MINUTE = float(os.getenv('QUESTION_RATE_PER_MINUTE', 30))
+QUESTION_BURST = int(os.getenv('QUESTION_BURST', 10))
+
 # Email Configuration
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
 EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 
+# Outbound email worker: SMTP_MAX_CONCURRENCY sender threads, each keeping an authenticated
+# connection open for reuse (closed after SMTP_IDLE_SECONDS without mail). Emails beyond
+# SMTP_QUEUE_SIZE are dropped; on shutdown queued emails get SMTP_DRAIN_SECONDS to go out.
+SMTP_MAX_CONCURRENCY = int(os.getenv('SMTP_MAX_CONCURRENCY', 2))
+SMTP_QUEUE_SIZE = int(os.getenv('SMTP_QUEUE_SIZE', 100))
+SMTP_TIMEOUT_SECONDS = float(os.getenv('SMTP_TIMEOUT_SECONDS', 15))
+SMTP_IDLE_SECONDS = float(os.getenv('SMTP_IDLE_SECONDS', 60))
+SMTP_DRAIN_SECONDS = float(os.getenv('SMTP_DRAIN_SECONDS', 30))
+
+# Durable email outbox (db.outbox): handlers write emails there and a drainer in each API process
+# claims them in batches, retrying failures with exponential backoff until OUTBOX_MAX_ATTEMPTS
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 2))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv('OUTBOX_RETRY_BASE_DELAY', 30))
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', 120))
+
+# Notification digests: doctor/admin notifications are held in db.notifications and sent as one
+# summary email per recipient once the oldest has waited DIGEST_WINDOW_SECONDS (0 sends each one
+# right away). Event types in DIGEST_URGENT_EVENTS always go out immediately.
+DIGEST_WINDOW_SECONDS = int(os.getenv('DIGEST_WINDOW_SECONDS', 900))
+DIGEST_URGENT_EVENTS = {event.strip() for event in os.getenv('DIGEST_URGENT_EVENTS', 'doctor_decision').split(',') if event.strip()}
+DIGEST_CHECK_INTERVAL = float(os.getenv('DIGEST_CHECK_INTERVAL', 30))
+DIGEST_MAX_ITEMS = int(os.getenv('DIGEST_MAX_ITEMS', 200))
+ADMIN_NOTIFY_EMAIL = os.getenv('ADMIN_NOTIFY_EMAIL')  # receives new doctor application notifications
+
 # Create directories
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -89,30 +215,318 @@ CLASS_COLORS = [
     (0, 100, 0),    # Dark green for forniceal_palpebral
     (139, 0, 139)   # Dark magenta for palpebral
 ]
-
-# Initialize models
-try:
-    yolo_model = YOLO(YOLO_MODEL_PATH)
-    print("YOLO model loaded successfully")
-except Exception as e:
-    print(f"Warning: Could not load YOLO model: {e}")
-    yolo_model = None
-
-# Initialize OpenAI with AIMLAPI
-if AIMLAPI_KEY:
-    ai_client = OpenAI(
-        base_url="https://api.aimlapi.com/v1",
-        api_key=AIMLAPI_KEY,
+# Class-index lookup table for mask compositing, pre-multiplied by the 0.6 overlay
+# alpha; index 0 is background
+SEGMENTATION_LUT = np.zeros((1, 256, 3), dtype=np.uint8)
+SEGMENTATION_LUT[0, 1:len(CLASS_COLORS) + 1] = np.round(np.array(CLASS_COLORS) * 0.6)
+
+# Ultralytics export format for each inference backend
+INFERENCE_BACKENDS = {
+    "torch": None,
+    "onnxruntime": "onnx",
+    "onnxruntime_int8": None,  # built by quantize_model.py, not exported
+    "openvino": "openvino",
+}
+
+def exported_model_path(backend: str) -> str:
+    """Location of the cached exported model for an inference backend"""
+    if backend == "torch":
+        return YOLO_MODEL_PATH
+    model_name = os.path.splitext(os.path.basename(YOLO_MODEL_PATH))[0]
+    if backend == "onnxruntime":
+        return os.path.join(MODEL_EXPORT_DIR, f"{model_name}_{INFERENCE_IMGSZ}.onnx")
+    if backend == "onnxruntime_int8":
+        return os.path.join(MODEL_EXPORT_DIR, f"{model_name}_{INFERENCE_IMGSZ}_int8.onnx")
+    if backend == "openvino":
+        return os.path.join(MODEL_EXPORT_DIR, f"{model_name}_{INFERENCE_IMGSZ}_openvino_model")
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+def export_model(backend: str, force: bool = False) -> str:
+    """Convert the PyTorch checkpoint for a backend once and cache the artifact"""
+    target_path = exported_model_path(backend)
+    if backend == "torch" or (os.path.exists(target_path) and not force):
+        return target_path
+    if backend == "onnxruntime_int8":
+        raise FileNotFoundError(f"{target_path} not found, build it with quantize_model.py")
+
+    from ultralytics import YOLO
+
+    print(f"Exporting {YOLO_MODEL_PATH} for {backend}...")
+    os.makedirs(MODEL_EXPORT_DIR, exist_ok=True)
+    # Dynamic input shapes so the micro-batcher can send more than one image
+    exported_path = YOLO(YOLO_MODEL_PATH).export(
+        format=INFERENCE_BACKENDS[backend],
+        imgsz=INFERENCE_IMGSZ,
+        dynamic=True
     )
-    print("AIMLAPI client initialized successfully")
-else:
+    if os.path.isdir(target_path):
+        shutil.rmtree(target_path)
+    elif os.path.exists(target_path):
+        os.remove(target_path)
+    shutil.move(str(exported_path), target_path)
+    print(f"Exported model saved to {target_path}")
+    return target_path
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def quantization_report_path(model_path: str) -> str:
+    return f"{model_path}.report.json"
+
+def quantized_model_accepted(model_path: str) -> bool:
+    """Check the INT8 model's stored accuracy report against the configured thresholds"""
+    report_path = quantization_report_path(model_path)
+    if not os.path.exists(report_path):
+        print(f"Warning: No accuracy report for {model_path}, run quantize_model.py")
+        return False
+
+    with open(report_path) as f:
+        report = json.load(f)
+
+    if report.get("model_sha256") != file_sha256(model_path):
+        print(f"Warning: Accuracy report does not match {model_path}, re-run quantize_model.py")
+        return False
+
+    failures = quantization_gate_failures(report.get("per_class", {}))
+    for failure in failures:
+        print(f"Warning: INT8 {failure}")
+    return not failures
+
+def quantization_gate_failures(per_class: Dict[str, Any], min_iou: float = QUANTIZED_MIN_IOU,
+                               max_conf_drift: float = QUANTIZED_MAX_CONF_DRIFT,
+                               min_matched: int = QUANTIZED_MIN_MATCHED,
+                               max_missed_rate: float = QUANTIZED_MAX_MISSED_RATE,
+                               max_extra_rate: float = QUANTIZED_MAX_EXTRA_RATE) -> List[str]:
+    """Reasons a per-class INT8 vs FP32 report fails the accuracy gate (empty if it passes)
+
+    A class without enough matched detections fails too: an evaluation set that never
+    exercises a class says nothing about its accuracy.
+    """
+    failures = []
+    for class_name in CLASS_NAMES:
+        class_report = per_class.get(class_name) or {}
+        matched = class_report.get("matched") or 0
+        missed = class_report.get("missed") or 0
+        extra = class_report.get("extra") or 0
+        mean_iou = class_report.get("mean_iou")
+        conf_drift = class_report.get("mean_conf_drift")
+        if matched < min_matched or mean_iou is None or conf_drift is None:
+            failures.append(f"{class_name} has {matched} matched detections, need {min_matched}")
+            continue
+        if mean_iou < min_iou:
+            failures.append(f"{class_name} mask IoU {mean_iou:.3f} below {min_iou}")
+        if conf_drift > max_conf_drift:
+            failures.append(f"{class_name} confidence drift {conf_drift:.3f} above {max_conf_drift}")
+        missed_rate = missed / (matched + missed)
+        if missed_rate > max_missed_rate:
+            failures.append(f"{class_name} missed rate {missed_rate:.3f} above {max_missed_rate}")
+        extra_rate = extra / (matched + extra)
+        if extra_rate > max_extra_rate:
+            failures.append(f"{class_name} extra detection rate {extra_rate:.3f} above {max_extra_rate}")
+    return failures
+
+def load_inference_model(backend: str = INFERENCE_BACKEND):
+    """Load the segmentation model for the configured inference backend"""
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    from ultralytics import YOLO
+
+    model_path = export_model(backend)
+    if backend == "onnxruntime_int8" and not quantized_model_accepted(model_path):
+        raise ValueError("INT8 model did not pass the accuracy gate")
+    return YOLO(model_path, task="segment")
+
+# Models are loaded on first use (or by the startup warm-up)
+yolo_model = None
+yolo_model_attempted = False
+yolo_model_lock = threading.Lock()
+active_inference_backend = INFERENCE_BACKEND
+
+def get_yolo_model():
+    """Return the segmentation model, loading it on first call"""
+    global yolo_model, yolo_model_attempted, active_inference_backend
+    if yolo_model_attempted:
+        return yolo_model
+
+    with yolo_model_lock:
+        if yolo_model_attempted:
+            return yolo_model
+        try:
+            yolo_model = load_inference_model(INFERENCE_BACKEND)
+            print(f"YOLO model loaded successfully ({INFERENCE_BACKEND})")
+        except Exception as e:
+            print(f"Warning: Could not load YOLO model with {INFERENCE_BACKEND} backend: {e}")
+            if INFERENCE_BACKEND != "torch":
+                try:
+                    yolo_model = load_inference_model("torch")
+                    active_inference_backend = "torch"
+                    print("YOLO model loaded successfully (torch fallback)")
+                except Exception as e:
+                    print(f"Warning: Could not load YOLO model: {e}")
+        yolo_model_attempted = True
+    return yolo_model
+
+class InferenceBatcher:
+    """Collect concurrent YOLO requests and run them as one batched forward pass"""
+
+    def __init__(self, predict_fn, max_batch_size: int = 8, window_ms: float = 10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="yolo-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, image) -> Future:
+        """Queue an image for inference and return a future for its result"""
+        future = Future()
+        if self.max_batch_size == 1:
+            # Batching disabled, run inline
+            try:
+                future.set_result(self.predict_fn([image])[0])
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self._ensure_started()
+        self._queue.put((image, future))
+        return future
+
+    def predict(self, image):
+        """Blocking helper that waits for the batched result of a single image"""
+        return self.submit(image).result()
+
+    def _collect_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+            # Ultralytics letterboxes a mixed-shape batch to a padded square; same-shape
+            # groups keep the minimal padding a single image gets
+            groups = {}
+            for image, future in batch:
+                groups.setdefault(image.shape, []).append((image, future))
+            for group in groups.values():
+                self._predict_group(group)
+
+    def _predict_group(self, group):
+        images = [image for image, _ in group]
+        futures = [future for _, future in group]
+        try:
+            results = self.predict_fn(images)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stop(self):
+        """Stop the batching thread after pending images are processed"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+yolo_batcher = InferenceBatcher(
+    lambda images: get_yolo_model()(images, imgsz=INFERENCE_IMGSZ, verbose=False),
+    max_batch_size=INFERENCE_BATCH_SIZE,
+    window_ms=INFERENCE_BATCH_WINDOW_MS
+)
+
+def warm_up_model():
+    """Load the model and run one dummy inference so the first request is not slow"""
+    import cv2  # noqa: F401 - imported here so the first request does not pay for it
+
+    model = get_yolo_model()
+    if model is None:
+        return
+    start = time.perf_counter()
+    model(np.zeros((INFERENCE_IMGSZ, INFERENCE_IMGSZ, 3), dtype=np.uint8), imgsz=INFERENCE_IMGSZ, verbose=False)
+    print(f"YOLO warm-up inference took {(time.perf_counter() - start) * 1000:.0f} ms")
+
+# Initialize OpenAI with AIMLAPI on first use
+ai_client = None
+
+def get_ai_client():
+    """Return the shared AsyncOpenAI client for AIMLAPI, or None if no key is configured"""
+    global ai_client
+    if ai_client is None and AIMLAPI_KEY:
+        import httpx
+        from openai import AsyncOpenAI
+
+        # Shared keep-alive pool; retries are handled in create_chat_completion
+        ai_client = AsyncOpenAI(
+            base_url=AIMLAPI_BASE_URL,
+            api_key=AIMLAPI_KEY,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE),
+                timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0)
+            )
+        )
+        print("AIMLAPI client initialized successfully")
+    return ai_client
+
+if not AIMLAPI_KEY:
     print("Warning: AIMLAPI_KEY not found in environment variables")
-    ai_client = None
 
 # MongoDB setup
 mongodb_client = None
 db = None
 
+# Indexes the queues and caches depend on, as (collection, keys, options).
+# init-mongo.js only runs on a fresh container, so they are (re)created at startup.
+DB_INDEXES = [
+    ("analysis_queue", [("dedup_key", 1)], {"unique": True, "partialFilterExpression": {"active": True}}),
+    ("analysis_queue", [("status", 1), ("available_at", 1)], {}),
+    ("analysis_queue", [("status", 1), ("lease_expires_at", 1)], {}),
+    ("analysis_queue", [("user_id", 1), ("created_at", -1)], {}),
+    ("outbox", [("status", 1), ("available_at", 1)], {}),
+    ("outbox", [("status", 1), ("lease_expires_at", 1)], {}),
+    ("outbox", [("sent_at", 1)], {"expireAfterSeconds": 7 * 24 * 3600}),  # keep sent emails for a week
+    ("questions", [("question_key", 1), ("timestamp", -1)], {"sparse": True}),
+    ("notifications", [("digest_id", 1), ("recipient", 1), ("created_at", 1)], {}),
+    ("notifications", [("digested_at", 1)], {"expireAfterSeconds": 30 * 24 * 3600}),  # keep digested ones for 30 days
+]
+
+async def ensure_indexes():
+    """Create missing indexes; create_index is a no-op for ones that already exist"""
+    for collection, keys, options in DB_INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e:
+            print(f"⚠️  Failed to create index {keys} on {collection}: {e}")
+
 @app.on_event("startup")
 async def startup_db_client():
     global mongodb_client, db
@@ -126,11 +540,178 @@ async def startup_db_client():
         print(f"Failed to connect to MongoDB: {e}")
         mongodb_client = None
         db = None
+        return
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def warm_up():
+    """Build the agent and LLM client and warm up the model before serving traffic"""
+    get_agent()
+    get_ai_client()
+    get_faq_index()
+    # With the Mongo queue, inference runs in the worker processes instead
+    if MODEL_WARMUP and ANALYSIS_QUEUE != "mongo":
+        await warm_up_inference()
+
+@app.on_event("startup")
+async def start_outbox_drainer():
+    """Deliver queued emails from the outbox and flush notification digests while the API is up"""
+    global outbox_task, outbox_stop, digest_task
+    if db is None:
+        return
+    outbox_stop = asyncio.Event()
+    if DIGEST_WINDOW_SECONDS > 0:
+        digest_task = asyncio.create_task(run_digests(outbox_stop))
+    if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
+        # Emails stay in the outbox until a process with SMTP credentials picks them up
+        return
+    outbox_task = asyncio.create_task(drain_outbox(outbox_stop))
+
+async def warm_up_inference():
+    """Load and warm up the model (or the detection process pool) ahead of the first analysis"""
+    if DETECTION_EXECUTOR == "process":
+        # Pool workers load and warm their own model copy via the initializer
+        get_detection_executor()
+    else:
+        await asyncio.get_running_loop().run_in_executor(None, warm_up_model)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if outbox_stop is not None:
+        # Finish the batch in flight; anything unsent stays in the outbox for the next start
+        outbox_stop.set()
+        tasks = [task for task in (outbox_task, digest_task) if task is not None]
+        if tasks:
+            await asyncio.wait(tasks, timeout=SMTP_DRAIN_SECONDS)
+    await drain_emails(SMTP_DRAIN_SECONDS)
     if mongodb_client:
         mongodb_client.close()
+    yolo_batcher.stop()
+    if ai_client:
+        await ai_client.close()
+    if detection_executor is not None:
+        detection_executor.shutdown(wait=False, cancel_futures=True)
+    render_executor.shutdown(wait=False, cancel_futures=True)
+
+# Admission control
+class StageOverloaded(Exception):
+    """Raised when a pipeline stage already has its maximum number of waiting callers"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"{stage} stage is overloaded")
+        self.stage = stage
+        self.retry_after = retry_after
+
+class StageLimiter:
+    """Concurrency limit for one pipeline stage with a bounded wait queue"""
+
+    def __init__(self, name: str, limit: int, queue_size: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.avg_seconds = 1.0  # moving average of time spent in the stage, for Retry-After
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @property
+    def saturated(self) -> bool:
+        return self.active >= self.limit and self.waiting >= self.queue_size
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a slot frees up for a new caller"""
+        return max(1, math.ceil(self.avg_seconds * (self.waiting + 1) / self.limit))
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.saturated:
+            self.rejected += 1
+            raise StageOverloaded(self.name, self.retry_after())
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "rejected": self.rejected
+        }
+
+inference_limiter = StageLimiter("inference", DETECTION_WORKERS, DETECTION_QUEUE_SIZE)
+llm_limiter = StageLimiter("llm", LLM_MAX_CONCURRENCY, LLM_QUEUE_SIZE)
+render_limiter = StageLimiter("render", RENDER_WORKERS, RENDER_QUEUE_SIZE)
+
+render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+
+def admit(*limiters: StageLimiter):
+    """Turn a request away up front if a stage it needs is already saturated"""
+    for limiter in limiters:
+        if limiter.saturated:
+            limiter.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please try again shortly",
+                headers={"Retry-After": str(limiter.retry_after())}
+            )
+
+class TokenBucketLimiter:
+    """Per-user token buckets; kept in process memory, so limits apply per API worker"""
+
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, last refill time)
+
+    def acquire(self, key: str) -> float:
+        """Take a token; returns 0 if allowed, otherwise the seconds until one is available"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+analyze_quota = TokenBucketLimiter(ANALYZE_RATE_PER_MINUTE, ANALYZE_BURST)
+question_quota = TokenBucketLimiter(QUESTION_RATE_PER_MINUTE, QUESTION_BURST)
+
+def enforce_quota(quota: TokenBucketLimiter, user_id: str):
+    wait = quota.acquire(user_id)
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, please slow down",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+def overloaded_exception(e: StageOverloaded) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please try again shortly",
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
 # Security
 security = HTTPBearer()
@@ -196,13 +777,29 @@ class ImageAnalysisRequest(BaseModel):
     symptoms: Optional[str] = None
     additional_info: Optional[str] = None
 
+def merge_timings(left: Optional[Dict[str, float]], right: Optional[Dict[str, float]]) -> Dict[str, float]:
+    """Reducer that lets parallel nodes each report their own timing"""
+    return {**(left or {}), **(right or {})}
+
 class AgentState(TypedDict):
     messages: List[Dict[str, Any]]
+    user: Optional[Dict[str, Any]]  # uploading user, for persistence and the results email
+    analysis_id: Optional[str]
     image_path: Optional[str]
+    image: Optional[Any]  # decoded BGR ndarray shared by every pipeline stage
+    image_bytes: Optional[bytes]  # original upload bytes
     user_description: Optional[str]
+    detections: Optional[List[Dict[str, Any]]]
+    segmentation_overlay: Optional[Dict[str, Any]]  # class map and label anchors for render_overlay
     yolo_results: Optional[Dict[str, Any]]
     gpt_analysis: Optional[str]
+    vision_payload: Optional[Dict[str, Any]]  # byte/token savings of the GPT image payload
+    comparison_path: Optional[str]
+    timings: Annotated[Dict[str, float], merge_timings]  # wall time in ms per node
+    deadline: Optional[float]  # epoch seconds by which the analysis must be returned
+    partial: bool  # GPT-4o was cut off by the deadline
     recommendations: Optional[str]
+    faq_passages: Optional[List[Dict[str, Any]]]  # curated FAQ entries given to GPT-4o as context
     next_action: Optional[str]
 
 # Helper Functions
@@ -252,11 +849,239 @@ async def get_current_doctor(credentials: HTTPAuthorizationCredentials = Depends
         raise HTTPException(status_code=404, detail="Doctor not found")
     return doctor
 
-async def send_email(to_email: str, subject: str, body: str, html: bool = False):
-    """Send email using SMTP with multiple fallback options"""
+SMTP_PROVIDERS = [
+    {"host": "smtp.gmail.com", "port": 465, "use_ssl": True, "name": "Gmail SSL"},
+    {"host": "smtp.gmail.com", "port": 587, "use_ssl": False, "name": "Gmail TLS"},
+    # Outlook/Hotmail TLS (if using outlook/hotmail email)
+    {"host": "smtp-mail.outlook.com", "port": 587, "use_ssl": False, "name": "Outlook TLS"},
+]
+
+def connect_smtp(config: Dict[str, Any]) -> smtplib.SMTP:
+    """Open and authenticate a connection to one SMTP provider"""
+    if config['use_ssl']:
+        # SSL connection (port 465)
+        server = smtplib.SMTP_SSL(config['host'], config['port'], timeout=SMTP_TIMEOUT_SECONDS)
+    else:
+        # TLS connection (port 587)
+        server = smtplib.SMTP(config['host'], config['port'], timeout=SMTP_TIMEOUT_SECONDS)
+    try:
+        server.set_debuglevel(0)
+        if not config['use_ssl']:
+            server.ehlo()
+            server.starttls()
+            server.ehlo()
+        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+    except Exception:
+        close_smtp(server)
+        raise
+    return server
+
+def close_smtp(server: Optional[smtplib.SMTP]):
+    if server is None:
+        return
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+class EmailWorker:
+    """Sender threads that deliver queued emails over persistent SMTP connections
+
+    Each thread keeps its authenticated connection open between messages and reconnects when the
+    server drops it. Providers are tried starting with the one that last worked.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 100, idle_seconds: float = 60):
+        self.workers = max(1, workers)
+        self.idle_seconds = idle_seconds
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.preferred = 0  # index in SMTP_PROVIDERS of the provider that last worked
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"smtp-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, msg: MIMEMultipart, to_email: str) -> Optional[Future]:
+        """Queue an email; returns a future for the failure reason (None once delivered), or None if the queue is full"""
+        if self._stopping:
+            return None
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((msg, to_email, future))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        return future
+
+    def _run(self):
+        server, provider = None, None
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_seconds)
+            except queue.Empty:
+                # Providers drop idle sessions anyway; reconnect on the next email
+                close_smtp(server)
+                server, provider = None, None
+                continue
+            if item is None:
+                break
+            msg, to_email, future = item
+            try:
+                server, provider, error = self._deliver(server, provider, msg, to_email)
+            except Exception as e:
+                print(f"❌ Email to {to_email} failed: {type(e).__name__}: {e}")
+                close_smtp(server)
+                server, provider, error = None, None, f"{type(e).__name__}: {e}"
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+            future.set_result(error)
+        close_smtp(server)
+
+    def _deliver(self, server, provider, msg: MIMEMultipart, to_email: str):
+        """Send over the open connection, reconnecting (preferred provider first) if it is gone
+
+        Returns the connection, its provider and the failure reason (None once delivered).
+        """
+        if server is not None:
+            try:
+                server.send_message(msg)
+                return server, provider, None
+            except smtplib.SMTPRecipientsRefused as e:
+                print(f"❌ Email to {to_email} rejected by {SMTP_PROVIDERS[provider]['name']}: {e}")
+                return server, provider, f"Recipient refused by {SMTP_PROVIDERS[provider]['name']}: {e}"
+            except (smtplib.SMTPException, OSError):
+                close_smtp(server)
+                server, provider = None, None
+
+        start = self.preferred
+        errors = []
+        for offset in range(len(SMTP_PROVIDERS)):
+            index = (start + offset) % len(SMTP_PROVIDERS)
+            config = SMTP_PROVIDERS[index]
+            try:
+                print(f"🔄 Connecting to {config['name']} ({config['host']}:{config['port']})...")
+                server = connect_smtp(config)
+            except smtplib.SMTPAuthenticationError as e:
+                print(f"❌ {config['name']}: Authentication failed")
+                print(f"   Error: {e}")
+                if "gmail" in config['host'].lower():
+                    print("   📌 For Gmail, use App Password: https://myaccount.google.com/apppasswords")
+                errors.append(f"{config['name']}: authentication failed")
+                continue
+            except socket.timeout:
+                print(f"❌ {config['name']}: Connection timeout")
+                errors.append(f"{config['name']}: connection timeout")
+                continue
+            except socket.gaierror as e:
+                print(f"❌ {config['name']}: DNS resolution failed - {e}")
+                errors.append(f"{config['name']}: DNS resolution failed")
+                continue
+            except ConnectionRefusedError:
+                print(f"❌ {config['name']}: Connection refused")
+                errors.append(f"{config['name']}: connection refused")
+                continue
+            except Exception as e:
+                print(f"❌ {config['name']}: {type(e).__name__}: {e}")
+                errors.append(f"{config['name']}: {type(e).__name__}: {e}")
+                continue
+
+            self.preferred = index
+            try:
+                server.send_message(msg)
+                print(f"✅ Email sent successfully to {to_email} via {config['name']}")
+                return server, index, None
+            except smtplib.SMTPRecipientsRefused as e:
+                print(f"❌ Email to {to_email} rejected by {config['name']}: {e}")
+                return server, index, f"Recipient refused by {config['name']}: {e}"
+            except Exception as e:
+                print(f"❌ {config['name']}: {type(e).__name__}: {e}")
+                errors.append(f"{config['name']}: {type(e).__name__}: {e}")
+                close_smtp(server)
+                server = None
+
+        # All attempts failed
+        print("\n❌ All email sending attempts failed!")
+        print("\n🔧 TROUBLESHOOTING STEPS:")
+        print("1. Check Windows Firewall:")
+        print("   - Search 'Windows Defender Firewall' → 'Allow an app'")
+        print("   - Allow Python through both Private and Public networks")
+        print("\n2. Disable Antivirus temporarily to test")
+        print("\n3. For Gmail:")
+        print("   - Enable 2-Step Verification")
+        print("   - Create App Password at: https://myaccount.google.com/apppasswords")
+        print("   - Use the 16-character app password in .env")
+        print("\n4. Check if your ISP blocks SMTP ports (try mobile hotspot to test)")
+        print("\n5. Try running as administrator")
+        print("\n6. Test connection manually:")
+        print(f"   telnet {SMTP_SERVER} {SMTP_PORT}")
+        return None, None, "All SMTP providers failed: " + "; ".join(errors)
+
+    def stop(self, timeout: float = 30):
+        """Stop accepting emails, let the threads drain the queue, then close their connections"""
+        self._stopping = True
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            remaining = deadline - time.monotonic()
+            try:
+                self._queue.put(None, timeout=max(0.0, remaining))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        if not self._queue.empty():
+            print(f"⚠️  Shutting down with {self._queue.qsize()} email(s) still queued")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len([thread for thread in self._threads if thread.is_alive()]),
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "preferred_provider": SMTP_PROVIDERS[self.preferred]["name"]
+        }
+
+email_worker = EmailWorker(SMTP_MAX_CONCURRENCY, SMTP_QUEUE_SIZE, SMTP_IDLE_SECONDS)
+email_tasks = set()
+
+def send_in_background(coro):
+    """Fire off an email coroutine, keeping a reference so shutdown can wait for it"""
+    task = asyncio.create_task(coro)
+    email_tasks.add(task)
+    task.add_done_callback(email_tasks.discard)
+    return task
+
+async def drain_emails(timeout: float):
+    """Wait for emails being composed or queued, then stop the sender threads"""
+    deadline = time.monotonic() + timeout
+    if email_tasks:
+        print(f"📧 Waiting for {len(email_tasks)} pending email(s)...")
+        await asyncio.wait(list(email_tasks), timeout=timeout)
+    await asyncio.get_running_loop().run_in_executor(
+        None, email_worker.stop, max(0.0, deadline - time.monotonic())
+    )
+
+class EmailQueueFull(Exception):
+    """Raised when the local SMTP worker cannot take an email (queue full or shutting down)"""
+
+async def deliver_email(to_email: str, subject: str, body: str, html: bool = False) -> Optional[str]:
+    """Queue an email for the background SMTP worker and wait for it; returns the failure reason, None once delivered"""
     if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
         print("⚠️  Email credentials not configured. Set EMAIL_ADDRESS and EMAIL_PASSWORD in .env")
-        return False
+        return "Email credentials not configured"
 
     # Prepare message
     msg = MIMEMultipart('alternative')
@@ -269,84 +1094,253 @@ async def send_email(to_email: str, subject: str, body: str, html: bool = False)
     else:
         msg.attach(MIMEText(body, 'plain'))
 
-    # Define multiple SMTP configurations to try
-    smtp_configs = [
-        {"host": "smtp.gmail.com", "port": 465, "use_ssl": True, "name": "Gmail SSL"},
-        # Gmail TLS (port 587)
-        {"host": "smtp.gmail.com", "port": 587, "use_ssl": False, "name": "Gmail TLS"},
-        # Gmail SSL (port 465)
-        
-        # Outlook/Hotmail TLS (if using outlook/hotmail email)
-        {"host": "smtp-mail.outlook.com", "port": 587, "use_ssl": False, "name": "Outlook TLS"},
-    ]
+    future = email_worker.submit(msg, to_email)
+    if future is None:
+        raise EmailQueueFull()
+    return await asyncio.wrap_future(future)
 
-    # Try each configuration
-    for config in smtp_configs:
-        try:
-            print(f"🔄 Trying {config['name']} ({config['host']}:{config['port']})...")
-            
-            if config['use_ssl']:
-                # SSL connection (port 465)
-                with smtplib.SMTP_SSL(config['host'], config['port'], timeout=15) as server:
-                    server.set_debuglevel(0)
-                    server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                    server.send_message(msg)
-                    print(f"✅ Email sent successfully to {to_email} via {config['name']}")
-                    return True
-            else:
-                # TLS connection (port 587)
-                with smtplib.SMTP(config['host'], config['port'], timeout=15) as server:
-                    server.set_debuglevel(0)
-                    server.ehlo()
-                    server.starttls()
-                    server.ehlo()
-                    server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                    server.send_message(msg)
-                    print(f"✅ Email sent successfully to {to_email} via {config['name']}")
-                    return True
-
-        except smtplib.SMTPAuthenticationError as e:
-            print(f"❌ {config['name']}: Authentication failed")
-            print(f"   Error: {e}")
-            if "gmail" in config['host'].lower():
-                print("   📌 For Gmail, use App Password: https://myaccount.google.com/apppasswords")
-            continue
+async def send_email(to_email: str, subject: str, body: str, html: bool = False) -> bool:
+    """Send an email through the background SMTP worker; True once delivered"""
+    try:
+        return await deliver_email(to_email, subject, body, html=html) is None
+    except EmailQueueFull:
+        print(f"⚠️  Email queue is full or shutting down, dropping email to {to_email}")
+        return False
 
-        except socket.timeout:
-            print(f"❌ {config['name']}: Connection timeout")
-            continue
+async def enqueue_email(to_email: str, subject: str, body: str, html: bool = False, key: Optional[str] = None):
+    """Write an email to the durable outbox for the drainer to deliver
 
-        except socket.gaierror as e:
-            print(f"❌ {config['name']}: DNS resolution failed - {e}")
+    The key makes the write idempotent: a retried request queues its email only once.
+    Without MongoDB the email is handed to the SMTP worker directly.
+    """
+    if db is None:
+        send_in_background(send_email(to_email, subject, body, html=html))
+        return
+    now = datetime.utcnow()
+    try:
+        await db.outbox.insert_one({
+            "_id": key or str(uuid.uuid4()),
+            "to": to_email,
+            "subject": subject,
+            "body": body,
+            "html": html,
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now,
+            "created_at": now
+        })
+    except DuplicateKeyError:
+        pass
+
+outbox_stats = {"batches": 0, "sent": 0, "retried": 0, "dead": 0, "deferred": 0, "last_batch_ms": None}
+outbox_task = None
+outbox_stop = None
+
+async def claim_outbox_batch(owner: str) -> List[Dict[str, Any]]:
+    """Lease up to OUTBOX_BATCH_SIZE due emails, including ones whose previous sender died"""
+    batch = []
+    while len(batch) < OUTBOX_BATCH_SIZE:
+        now = datetime.utcnow()
+        doc = await db.outbox.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "available_at": {"$lte": now}},
+                {"status": "sending", "lease_expires_at": {"$lt": now}}
+            ]},
+            {
+                "$set": {
+                    "status": "sending",
+                    "lease_owner": owner,
+                    "lease_expires_at": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            break
+        batch.append(doc)
+    return batch
+
+async def deliver_outbox_batch(batch: List[Dict[str, Any]], owner: str):
+    """Send a claimed batch through the SMTP worker's open connections and record the outcomes"""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        deliver_email(doc["to"], doc["subject"], doc["body"], html=doc.get("html", False)) for doc in batch
+    ), return_exceptions=True)
+
+    now = datetime.utcnow()
+    updates = []
+    for doc, error in zip(batch, results):
+        if isinstance(error, EmailQueueFull):
+            # Nothing was sent: hand the email back without using up one of its attempts
+            outbox_stats["deferred"] += 1
+            update = {"$set": {"status": "pending", "available_at": now + timedelta(seconds=OUTBOX_POLL_INTERVAL)},
+                      "$inc": {"attempts": -1},
+                      "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+            updates.append(UpdateOne({"_id": doc["_id"], "lease_owner": owner}, update))
             continue
-
-        except ConnectionRefusedError:
-            print(f"❌ {config['name']}: Connection refused")
+        if isinstance(error, Exception):
+            error = f"{type(error).__name__}: {error}"
+
+        if error is None:
+            outbox_stats["sent"] += 1
+            update = {"$set": {"status": "sent", "sent_at": now}, "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+        elif doc["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            outbox_stats["dead"] += 1
+            print(f"❌ Giving up on email {doc['_id']} to {doc['to']} after {doc['attempts']} attempts: {error}")
+            update = {"$set": {"status": "dead", "last_error": error, "failed_at": now},
+                      "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+        else:
+            outbox_stats["retried"] += 1
+            delay = OUTBOX_RETRY_BASE_DELAY * 2 ** (doc["attempts"] - 1) * random.uniform(0.5, 1.5)
+            update = {"$set": {"status": "pending", "available_at": now + timedelta(seconds=delay), "last_error": error},
+                      "$unset": {"lease_owner": "", "lease_expires_at": ""}}
+        updates.append(UpdateOne({"_id": doc["_id"], "lease_owner": owner}, update))
+    await db.outbox.bulk_write(updates, ordered=False)
+
+    outbox_stats["batches"] += 1
+    outbox_stats["last_batch_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+async def drain_outbox(stop: asyncio.Event):
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    while not stop.is_set():
+        try:
+            batch = await claim_outbox_batch(owner)
+            if batch:
+                await deliver_outbox_batch(batch, owner)
+                continue
+        except Exception as e:
+            print(f"Outbox drain failed: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+# Digest templates are compiled once; values are HTML-escaped before substitution
+DIGEST_EMAIL_TEMPLATE = Template("""
+<html>
+    <body style="font-family: Arial, sans-serif;">
+        <h2>Your Eye Health AI Summary 📬</h2>
+        <p>Dear $recipient_name,</p>
+        <p>Here is what happened since our last update:</p>
+        $sections
+        <p>Please check your dashboard for more details.</p>
+        <p>Best regards,<br>Eye Health AI Team</p>
+    </body>
+</html>
+""")
+DIGEST_SECTION_TEMPLATE = Template("""
+        <div style="background-color: #f0f0f0; padding: 20px; margin: 20px 0; border-radius: 8px;">
+            <h3>$title ($count)</h3>
+            <ul>$rows</ul>
+        </div>""")
+DIGEST_EVENTS = {
+    "appointment_booked": {
+        "title": "New Appointments",
+        "row": Template("<li>$patient_name on $date at $time (ID $appointment_id, $status)</li>")
+    },
+    "doctor_application": {
+        "title": "New Doctor Applications",
+        "row": Template("<li>Dr. $full_name, $specialty ($email)</li>")
+    },
+    "doctor_decision": {
+        "title": "Account Updates",
+        "row": Template("<li>Your doctor account application was $decision.</li>")
+    },
+}
+
+digest_stats = {"digests": 0, "notifications": 0}
+digest_task = None
+
+async def queue_notification(recipient: str, recipient_name: str, event: str, data: Dict[str, Any],
+                             key: Optional[str], subject: str, body: str):
+    """Hold a doctor/admin notification for the recipient's next digest
+
+    subject and body are the standalone email, used for urgent events or when digests are off.
+    """
+    if db is None or DIGEST_WINDOW_SECONDS <= 0 or event in DIGEST_URGENT_EVENTS:
+        await enqueue_email(recipient, subject, body, html=True, key=key)
+        return
+    try:
+        await db.notifications.insert_one({
+            "_id": key or str(uuid.uuid4()),
+            "recipient": recipient,
+            "recipient_name": recipient_name,
+            "event": event,
+            "data": data,
+            "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        pass
+
+def render_digest(recipient_name: str, notifications: List[Dict[str, Any]]) -> str:
+    sections = []
+    for event, spec in DIGEST_EVENTS.items():
+        rows = [
+            spec["row"].safe_substitute({name: escape_html(str(value)) for name, value in n["data"].items()})
+            for n in notifications if n["event"] == event
+        ]
+        if rows:
+            sections.append(DIGEST_SECTION_TEMPLATE.substitute(title=spec["title"], count=len(rows), rows="".join(rows)))
+    return DIGEST_EMAIL_TEMPLATE.substitute(recipient_name=escape_html(recipient_name), sections="".join(sections))
+
+async def flush_digests():
+    """Turn every recipient's pending notifications into one outbox email once their window is up"""
+    cutoff = datetime.utcnow() - timedelta(seconds=DIGEST_WINDOW_SECONDS)
+    due = await db.notifications.aggregate([
+        {"$match": {"digest_id": None}},
+        {"$group": {"_id": "$recipient", "oldest": {"$min": "$created_at"}}},
+        {"$match": {"oldest": {"$lte": cutoff}}}
+    ]).to_list(None)
+
+    for recipient in due:
+        notifications = await db.notifications.find(
+            {"recipient": recipient["_id"], "digest_id": None}
+        ).sort("created_at", 1).to_list(DIGEST_MAX_ITEMS)
+        if not notifications:
             continue
+        # Keyed on the oldest notification, so a retry after a crash (or a second API process
+        # flushing at the same time) queues the same digest only once
+        digest_id = f"digest:{notifications[0]['_id']}"
+        count = len(notifications)
+        await enqueue_email(
+            recipient["_id"],
+            f"Eye Health AI: {count} new notification{'s' if count != 1 else ''}",
+            render_digest(notifications[-1]["recipient_name"], notifications),
+            html=True,
+            key=digest_id
+        )
+        await db.notifications.update_many(
+            {"_id": {"$in": [n["_id"] for n in notifications]}},
+            {"$set": {"digest_id": digest_id, "digested_at": datetime.utcnow()}}
+        )
+        digest_stats["digests"] += 1
+        digest_stats["notifications"] += count
 
+async def run_digests(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            await flush_digests()
         except Exception as e:
-            print(f"❌ {config['name']}: {type(e).__name__}: {e}")
-            continue
+            print(f"Digest flush failed: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=DIGEST_CHECK_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
 
-    # All attempts failed
-    print("\n❌ All email sending attempts failed!")
-    print("\n🔧 TROUBLESHOOTING STEPS:")
-    print("1. Check Windows Firewall:")
-    print("   - Search 'Windows Defender Firewall' → 'Allow an app'")
-    print("   - Allow Python through both Private and Public networks")
-    print("\n2. Disable Antivirus temporarily to test")
-    print("\n3. For Gmail:")
-    print("   - Enable 2-Step Verification")
-    print("   - Create App Password at: https://myaccount.google.com/apppasswords")
-    print("   - Use the 16-character app password in .env")
-    print("\n4. Check if your ISP blocks SMTP ports (try mobile hotspot to test)")
-    print("\n5. Try running as administrator")
-    print("\n6. Test connection manually:")
-    print(f"   telnet {SMTP_SERVER} {SMTP_PORT}")
-    
-    return False
-
-async def send_welcome_email(email: str, full_name: str):
+async def outbox_health() -> Optional[Dict[str, Any]]:
+    if db is None:
+        return None
+    return {
+        **outbox_stats,
+        "queued": await db.outbox.count_documents({"status": {"$in": ["pending", "sending"]}}),
+        "dead_letters": await db.outbox.count_documents({"status": "dead"}),
+        "draining": outbox_task is not None and not outbox_task.done(),
+        "digests": {**digest_stats, "pending": await db.notifications.count_documents({"digest_id": None})}
+    }
+
+async def send_welcome_email(email: str, full_name: str, key: Optional[str] = None):
     """Send welcome email to new user"""
     subject = "Welcome to VisionCare AI!"
     body = f"""
@@ -380,9 +1374,9 @@ async def send_welcome_email(email: str, full_name: str):
         </body>
     </html>
     """
-    await send_email(email, subject, body, html=True)
+    await enqueue_email(email, subject, body, html=True, key=key)
 
-async def send_doctor_welcome_email(email: str, full_name: str):
+async def send_doctor_welcome_email(email: str, full_name: str, key: Optional[str] = None):
     """Send welcome email to new doctor (account under review)"""
     subject = "Your Doctor Account is Under Review - VisionCare AI"
     body = f"""
@@ -410,9 +1404,9 @@ async def send_doctor_welcome_email(email: str, full_name: str):
         </body>
     </html>
     """
-    await send_email(email, subject, body, html=True)
+    await enqueue_email(email, subject, body, html=True, key=key)
 
-async def send_doctor_approval_email(email: str, full_name: str):
+async def send_doctor_approval_email(email: str, full_name: str, key: Optional[str] = None):
     """Send approval notification to doctor"""
     subject = "Your Doctor Account Has Been Approved! ✅"
     body = f"""
@@ -441,9 +1435,9 @@ async def send_doctor_approval_email(email: str, full_name: str):
         </body>
     </html>
     """
-    await send_email(email, subject, body, html=True)
+    await queue_notification(email, f"Dr. {full_name}", "doctor_decision", {"decision": "approved"}, key, subject, body)
 
-async def send_doctor_rejection_email(email: str, full_name: str, notes: Optional[str] = None):
+async def send_doctor_rejection_email(email: str, full_name: str, notes: Optional[str] = None, key: Optional[str] = None):
     """Send rejection notification to doctor"""
     subject = "Doctor Account Application Update"
     body = f"""
@@ -473,9 +1467,28 @@ async def send_doctor_rejection_email(email: str, full_name: str, notes: Optiona
         </body>
     </html>
     """
-    await send_email(email, subject, body, html=True)
+    await queue_notification(email, f"Dr. {full_name}", "doctor_decision", {"decision": "not approved"}, key, subject, body)
+
+async def send_doctor_application_notification(doctor_id: str, full_name: str, specialty: str, email: str):
+    """Tell the administrators a doctor application is waiting for review"""
+    subject = "New Doctor Application - Eye Health AI"
+    body = f"""
+    <html>
+        <body style="font-family: Arial, sans-serif;">
+            <h2>New Doctor Application 🩺</h2>
+            <p>Dr. {escape_html(full_name)} ({escape_html(specialty)}, {escape_html(email)}) has applied for a doctor account.</p>
+            <p>Please review their documents in the admin dashboard.</p>
+            <p>Best regards,<br>Eye Health AI Team</p>
+        </body>
+    </html>
+    """
+    await queue_notification(
+        ADMIN_NOTIFY_EMAIL, "Administrator", "doctor_application",
+        {"full_name": full_name, "specialty": specialty, "email": email},
+        key=f"doctor-application:{doctor_id}", subject=subject, body=body
+    )
 
-async def send_analysis_result_email(email: str, full_name: str, analysis: Dict, file_id: str):
+async def send_analysis_result_email(email: str, full_name: str, analysis: Dict, file_id: str, key: Optional[str] = None):
     """Send analysis results via email"""
     subject = "Your VisionCare AI Analysis Results"
     
@@ -515,87 +1528,245 @@ async def send_analysis_result_email(email: str, full_name: str, analysis: Dict,
         </body>
     </html>
     """
-    await send_email(email, subject, body, html=True)
+    await enqueue_email(email, subject, body, html=True, key=key)
+
+def letterbox_region(mask_shape, image_shape):
+    """(top, bottom, left, right) of the image inside a letterboxed mask, as ultralytics' scale_image crops it"""
+    mask_height, mask_width = mask_shape[:2]
+    height, width = image_shape[:2]
+    gain = min(mask_height / height, mask_width / width)
+    pad_x = (mask_width - width * gain) / 2
+    pad_y = (mask_height - height * gain) / 2
+    top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+    bottom, right = mask_height - int(round(pad_y + 0.1)), mask_width - int(round(pad_x + 0.1))
+    return top, bottom, left, right
+
+def extract_segmentation(image_shape, results):
+    """Detection info and compact overlay data (low-resolution class map and label anchors) from a YOLO result"""
+    import cv2
 
-def create_segmentation_visualization(image, results):
-    """Create segmentation visualization with dark colors and labels"""
-    annotated_image = image.copy()
     detection_info = []
+    overlay = {"class_map": None, "labels": []}
     
     if hasattr(results, 'masks') and results.masks is not None:
-        masks = results.masks.data.cpu().numpy()
+        masks = results.masks.data.cpu().numpy() > 0.5
         classes = results.boxes.cls.cpu().numpy().astype(int)
         confidences = results.boxes.conf.cpu().numpy()
         
-        for mask, cls_idx, conf in zip(masks, classes, confidences):
+        # Masks are in the letterboxed input's coordinates; drop the padding first
+        top, bottom, left, right = letterbox_region(masks.shape[1:], image_shape)
+        masks = masks[:, top:bottom, left:right]
+        
+        height, width = image_shape[:2]
+        mask_height, mask_width = masks.shape[1:]
+        scale_x = width / mask_width
+        scale_y = height / mask_height
+        
+        # Paint every mask into one low-resolution class-index map; the renderer colors
+        # it with a single palette lookup, upscales once and blends in one pass
+        class_map = np.zeros((mask_height, mask_width), dtype=np.uint8)
+        for mask, cls_idx in zip(masks, classes):
             if cls_idx < len(CLASS_COLORS):
-                color = CLASS_COLORS[cls_idx]
-                mask = (mask > 0.5).astype(np.uint8)
-                mask_resized = cv2.resize(mask, (annotated_image.shape[1], annotated_image.shape[0]), 
-                                        interpolation=cv2.INTER_NEAREST)
-                
-                colored_mask = np.zeros_like(annotated_image, dtype=np.uint8)
-                for c in range(3):
-                    colored_mask[:, :, c] = mask_resized * color[c]
-                
-                annotated_image = cv2.addWeighted(annotated_image, 1.0, colored_mask, 0.6, 0)
-                
-                moments = cv2.moments(mask_resized)
-                if moments["m00"] != 0:
-                    cx = int(moments["m10"] / moments["m00"])
-                    cy = int(moments["m01"] / moments["m00"])
-                    label = f"{CLASS_NAMES[cls_idx]} ({conf:.2f})"
-                    
-                    offset_x, offset_y = 60, -40
-                    label_x = min(cx + offset_x, annotated_image.shape[1] - 10)
-                    label_y = max(cy + offset_y, 20)
-                    
-                    cv2.arrowedLine(annotated_image, (label_x, label_y), (cx, cy), color, 2, tipLength=0.2)
-                    
-                    font_scale = 0.6
-                    font_thickness = 2
-                    text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)[0]
-                    highlight_color = (255, 255, 200)
-                    padding_x, padding_y = 5, 8
-                    
-                    cv2.rectangle(annotated_image,
-                                (label_x - padding_x, label_y - text_size[1] - padding_y),
-                                (label_x + text_size[0] + padding_x, label_y + padding_y),
-                                highlight_color, -1)
-                    
-                    cv2.putText(annotated_image, label, (label_x, label_y),
-                              cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), font_thickness, cv2.LINE_AA)
-                
-                detection_info.append({
-                    "class": CLASS_NAMES[cls_idx],
-                    "confidence": float(conf),
-                    "area": int(np.sum(mask_resized))
-                })
+                class_map[mask] = cls_idx + 1
+        overlay["class_map"] = class_map
+        
+        for mask, cls_idx, conf in zip(masks, classes, confidences):
+            if cls_idx >= len(CLASS_COLORS):
+                continue
+            
+            # Area, centroid and box come from the low-resolution mask, scaled to the image
+            mask = mask.astype(np.uint8)
+            moments = cv2.moments(mask, binaryImage=True)
+            if moments["m00"] != 0:
+                cx = int(moments["m10"] / moments["m00"] * scale_x)
+                cy = int(moments["m01"] / moments["m00"] * scale_y)
+                overlay["labels"].append((cx, cy, int(cls_idx), float(conf)))
+            
+            box_x, box_y, box_w, box_h = cv2.boundingRect(mask)
+            detection_info.append({
+                "class": CLASS_NAMES[cls_idx],
+                "confidence": float(conf),
+                "area": int(round(moments["m00"] * scale_x * scale_y)),
+                "bbox": [
+                    int(box_x * scale_x),
+                    int(box_y * scale_y),
+                    min(width, int(np.ceil((box_x + box_w) * scale_x))),
+                    min(height, int(np.ceil((box_y + box_h) * scale_y)))
+                ]
+            })
     
-    return annotated_image, detection_info
+    return detection_info, overlay
 
-def process_yolo_detection(image_path: str):
-    """Process image with YOLO model"""
-    if not yolo_model:
-        return None, []
+def render_segmentation_overlay(image, overlay):
+    """Blend the class map over the image and draw a label arrow for every detection"""
+    import cv2
+
+    annotated_image = image.copy()
+    if overlay["class_map"] is None:
+        return annotated_image
+    
+    height, width = annotated_image.shape[:2]
+    class_map = overlay["class_map"]
+    colored = cv2.LUT(cv2.merge([class_map, class_map, class_map]), SEGMENTATION_LUT)
+    colored = cv2.resize(colored, (width, height), interpolation=cv2.INTER_NEAREST)
+    annotated_image = cv2.add(annotated_image, colored)
+    
+    for cx, cy, cls_idx, conf in overlay["labels"]:
+        color = CLASS_COLORS[cls_idx]
+        label = f"{CLASS_NAMES[cls_idx]} ({conf:.2f})"
+        
+        offset_x, offset_y = 60, -40
+        label_x = min(cx + offset_x, width - 10)
+        label_y = max(cy + offset_y, 20)
+        
+        cv2.arrowedLine(annotated_image, (label_x, label_y), (cx, cy), color, 2, tipLength=0.2)
+        
+        font_scale = 0.6
+        font_thickness = 2
+        text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)[0]
+        highlight_color = (255, 255, 200)
+        padding_x, padding_y = 5, 8
+        
+        cv2.rectangle(annotated_image,
+                    (label_x - padding_x, label_y - text_size[1] - padding_y),
+                    (label_x + text_size[0] + padding_x, label_y + padding_y),
+                    highlight_color, -1)
+        
+        cv2.putText(annotated_image, label, (label_x, label_y),
+                  cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), font_thickness, cv2.LINE_AA)
+    
+    return annotated_image
+
+def create_segmentation_visualization(image, results):
+    """Create segmentation visualization with dark colors and labels"""
+    detection_info, overlay = extract_segmentation(image.shape, results)
+    return render_segmentation_overlay(image, overlay), detection_info
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+def apply_exif_orientation(image, orientation: int):
+    """Rotate/flip a decoded image so it is upright for the given EXIF orientation"""
+    import cv2
+
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.rotate(cv2.transpose(image), cv2.ROTATE_180)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+def decode_image(content: bytes):
+    """Decode upload bytes in memory once and apply the EXIF orientation"""
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        return None
+
+    try:
+        # Only parses the header, the pixels are not decoded a second time
+        orientation = Image.open(io.BytesIO(content)).getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        orientation = 1
+    return apply_exif_orientation(image, orientation)
+
+def upload_path(file_id: str, filename: str) -> str:
+    return os.path.join(UPLOAD_DIR, f"{file_id}{os.path.splitext(filename)[1]}")
+
+async def save_upload(file_path: str, content: bytes):
+    """Persist upload bytes without blocking the event loop"""
+    async with aiofiles.open(file_path, "wb") as f:
+        await f.write(content)
+
+def run_segmentation(image_path: str, image=None):
+    """YOLO inference only; returns (detections, overlay data) or ([], None) if it could not run"""
+    import cv2
+
+    if not get_yolo_model():
+        return [], None
     
     try:
-        image = cv2.imread(image_path)
+        if image is None:
+            image = cv2.imread(image_path)
         if image is None:
             raise ValueError("Could not read image")
         
-        results = yolo_model(image, verbose=False)
-        annotated_image, detection_info = create_segmentation_visualization(image, results[0])
+        results = yolo_batcher.predict(image)
+        return extract_segmentation(image.shape, results)
+    
+    except Exception as e:
+        print(f"YOLO detection error: {e}")
+        return [], None
+
+def save_detection_overlay(image_path: str, image, overlay) -> Optional[str]:
+    """Render the segmentation overlay and write it to OUTPUT_DIR"""
+    import cv2
+
+    if overlay is None:
+        return None
+    
+    try:
+        if image is None:
+            image = cv2.imread(image_path)
+        annotated_image = render_segmentation_overlay(image, overlay)
         
         output_filename = f"detected_{os.path.basename(image_path)}"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         cv2.imwrite(output_path, annotated_image)
         
-        return output_path, detection_info
+        return output_path
     
     except Exception as e:
-        print(f"YOLO detection error: {e}")
-        return None, []
+        print(f"Overlay rendering error: {e}")
+        return None
+
+def process_yolo_detection(image_path: str, image=None):
+    """Process image with YOLO model"""
+    detection_info, overlay = run_segmentation(image_path, image)
+    return save_detection_overlay(image_path, image, overlay), detection_info
+
+detection_executor = None
+
+def init_detection_process():
+    """Pool process initializer: each call hands a process one image, which it runs unbatched
+
+    Micro-batching only happens in thread mode; a process that waited for more images
+    would only add the batch window to every call.
+    """
+    yolo_batcher.max_batch_size = 1
+    if MODEL_WARMUP:
+        warm_up_model()
+
+def get_detection_executor():
+    """Create the detection pool on first use"""
+    global detection_executor
+    if detection_executor is None:
+        if DETECTION_EXECUTOR == "process":
+            detection_executor = ProcessPoolExecutor(max_workers=DETECTION_WORKERS, initializer=init_detection_process)
+        else:
+            detection_executor = ThreadPoolExecutor(max_workers=DETECTION_WORKERS, thread_name_prefix="detection")
+        print(f"Detection pool started ({DETECTION_EXECUTOR}, {DETECTION_WORKERS} workers)")
+    return detection_executor
+
+async def run_detection(image_path: str, image=None):
+    """Run YOLO inference in the detection pool; returns (detections, overlay data)"""
+    async with inference_limiter.slot():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_detection_executor(), run_segmentation, image_path, image)
+
+async def run_render(fn, *args):
+    """Run OpenCV rendering in the bounded render pool"""
+    async with render_limiter.slot():
+        return await asyncio.get_running_loop().run_in_executor(render_executor, fn, *args)
 
 def encode_image_to_base64(image_path: str) -> str:
     """Encode image to base64"""
@@ -606,9 +1777,288 @@ def encode_image_to_base64(image_path: str) -> str:
         print(f"Error encoding image: {e}")
         return ""
 
-async def analyze_with_gpt_vision(image_path: str, detection_results: List[Dict], user_description: str = None) -> Dict[str, Any]:
+class CircuitOpen(Exception):
+    """Raised instead of calling AIMLAPI while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    def __init__(self, failure_threshold: int, slow_call_seconds: float, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.rejected = 0
+
+    def short_circuit(self) -> bool:
+        """True if allow() would certainly refuse; checked before queueing for an LLM slot"""
+        if self.state == "open" and time.monotonic() - self.opened_at < self.reset_seconds:
+            self.rejected += 1
+            return True
+        if self.state == "half_open" and self.probe_in_flight:
+            self.rejected += 1
+            return True
+        return False
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self, elapsed: float):
+        if elapsed >= self.slow_call_seconds:
+            # Answering, but too slowly to be worth waiting for
+            self.record_failure()
+            return
+        if self.state != "closed":
+            print("✅ LLM circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            print(f"⚠️  LLM circuit opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """The call was abandoned (e.g. cut off by a deadline) without telling us anything"""
+        self.probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures, "rejected": self.rejected}
+
+llm_breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_SLOW_SECONDS, LLM_BREAKER_RESET_SECONDS)
+
+async def create_chat_completion(timeout: float = None, **kwargs):
+    """Call AIMLAPI chat completions through the llm stage limit, with per-call timeout, jittered
+    retries and a circuit breaker (raises CircuitOpen without calling out while it is open)"""
+    client = get_ai_client()
+    if not client:
+        raise RuntimeError("AIMLAPI client not configured")
+    # Fail fast while the circuit is open instead of waiting for a slot just to be refused
+    if llm_breaker.short_circuit():
+        raise CircuitOpen("AIMLAPI circuit breaker is open")
+
+    async with llm_limiter.slot():
+        if not llm_breaker.allow():
+            raise CircuitOpen("AIMLAPI circuit breaker is open")
+
+        start = time.monotonic()
+        try:
+            response = await call_with_retries(client, timeout, **kwargs)
+        except asyncio.CancelledError:
+            if time.monotonic() - start >= llm_breaker.slow_call_seconds:
+                llm_breaker.record_failure()
+            else:
+                llm_breaker.release()
+            raise
+        except llm_transient_errors():
+            llm_breaker.record_failure()
+            raise
+        except Exception:
+            # Request errors (bad payload, auth) say nothing about provider health
+            llm_breaker.release()
+            raise
+        llm_breaker.record_success(time.monotonic() - start)
+        return response
+
+async def stream_chat_completion(timeout: float = None, **kwargs):
+    """Yield chat completion content deltas as AIMLAPI streams them, under the same stage limit and
+    circuit breaker as create_chat_completion (the breaker judges the time to first token)"""
+    client = get_ai_client()
+    if not client:
+        raise RuntimeError("AIMLAPI client not configured")
+    if llm_breaker.short_circuit():
+        raise CircuitOpen("AIMLAPI circuit breaker is open")
+
+    async with llm_limiter.slot():
+        if not llm_breaker.allow():
+            raise CircuitOpen("AIMLAPI circuit breaker is open")
+
+        start = time.monotonic()
+        first_token_after = None
+        stream = None
+        try:
+            stream = await call_with_retries(client, timeout, stream=True, **kwargs)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if first_token_after is None:
+                        first_token_after = time.monotonic() - start
+                    yield delta
+        except (asyncio.CancelledError, GeneratorExit):
+            if first_token_after is None and time.monotonic() - start >= llm_breaker.slow_call_seconds:
+                llm_breaker.record_failure()
+            else:
+                llm_breaker.release()
+            raise
+        except llm_transient_errors():
+            llm_breaker.record_failure()
+            raise
+        except Exception:
+            llm_breaker.release()
+            raise
+        finally:
+            if stream is not None:
+                await stream.close()
+        llm_breaker.record_success(first_token_after if first_token_after is not None else time.monotonic() - start)
+
+def llm_transient_errors():
+    """Provider-side errors worth retrying and counting against the circuit breaker"""
+    import openai
+
+    return (
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+async def call_with_retries(client, timeout: float = None, **kwargs):
+    """Chat completion with per-call timeout and full-jitter retries"""
+    retryable_errors = llm_transient_errors()
+
+    timeout = timeout or LLM_TIMEOUT_SECONDS
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return await client.chat.completions.create(timeout=timeout, **kwargs)
+        except retryable_errors as e:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            # Full jitter exponential backoff
+            delay = random.uniform(0, LLM_RETRY_BASE_DELAY * (2 ** attempt))
+            print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+# Bump whenever the vision prompt changes so cached analyses are not reused
+VISION_PROMPT_VERSION = "vision-v2"
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """GPT-4o high-detail image token cost: 170 per 512px tile plus 85 base"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = int(np.ceil(width / 512)) * int(np.ceil(height / 512))
+    return 170 * tiles + 85
+
+def sniff_image_mime(content: bytes) -> str:
+    if content.startswith(b"\x89PNG"):
+        return "image/png"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if content.startswith(b"GIF8"):
+        return "image/gif"
+    return "image/jpeg"
+
+def prepare_vision_payload(image, image_bytes: Optional[bytes], detections: List[Dict]):
+    """Crop to the detected conjunctiva, downsize and re-encode the image sent to GPT-4o
+
+    Returns (payload_bytes, mime_type, stats).
+    """
+    import cv2
+
+    if image is None:
+        return image_bytes, sniff_image_mime(image_bytes or b""), None
+
+    height, width = image.shape[:2]
+    boxes = [d["bbox"] for d in detections if d.get("bbox")]
+    if boxes:
+        # Union of the mask boxes plus a margin so GPT still sees surrounding context
+        x1 = min(b[0] for b in boxes)
+        y1 = min(b[1] for b in boxes)
+        x2 = max(b[2] for b in boxes)
+        y2 = max(b[3] for b in boxes)
+        margin_x = int((x2 - x1) * VISION_CROP_MARGIN)
+        margin_y = int((y2 - y1) * VISION_CROP_MARGIN)
+        x1, y1 = max(0, x1 - margin_x), max(0, y1 - margin_y)
+        x2, y2 = min(width, x2 + margin_x), min(height, y2 + margin_y)
+    else:
+        x1, y1, x2, y2 = 0, 0, width, height
+
+    payload_image = image[y1:y2, x1:x2]
+    scale = VISION_MAX_EDGE / max(payload_image.shape[:2])
+    if scale < 1:
+        payload_image = cv2.resize(payload_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    ok, encoded = cv2.imencode(".jpg", payload_image, [cv2.IMWRITE_JPEG_QUALITY, VISION_JPEG_QUALITY])
+    original_bytes = len(image_bytes) if image_bytes else None
+    if not ok or (original_bytes and encoded.nbytes >= original_bytes and not boxes):
+        return image_bytes, sniff_image_mime(image_bytes or b""), None
+
+    stats = {
+        "crop": [x1, y1, x2, y2],
+        "payload_size": [payload_image.shape[1], payload_image.shape[0]],
+        "original_bytes": original_bytes,
+        "payload_bytes": int(encoded.nbytes),
+        "original_tokens": estimate_image_tokens(width, height),
+        "payload_tokens": estimate_image_tokens(payload_image.shape[1], payload_image.shape[0])
+    }
+    return encoded.tobytes(), "image/jpeg", stats
+
+FALLBACK_MIN_CONFIDENCE = 0.5
+# Share of the detected conjunctiva area taken up by palpebral regions above which the
+# fallback flags possible swelling/inflammation
+FALLBACK_PALPEBRAL_SHARE = 0.6
+
+def local_fallback_analysis(detection_results: List[Dict], reason: str) -> Dict[str, Any]:
+    """Rule-based preliminary assessment from YOLO class areas and confidences, used when GPT-4o is unavailable"""
+    confident = [d for d in detection_results if d["confidence"] >= FALLBACK_MIN_CONFIDENCE]
+    note = f"This is a preliminary automated assessment based only on the segmentation model ({reason})."
+    
+    if not confident:
+        return {
+            "condition": "Inconclusive",
+            "severity": "unknown",
+            "analysis": f"The conjunctiva could not be identified clearly in this photo. {note}",
+            "recommendations": "Retake the photo in good light with the lower eyelid gently pulled down",
+            "medical_advice": "Consult an eye specialist if you have redness, discharge, pain or vision changes",
+            "risk_level": "medium",
+            "follow_up": "1 day",
+            "source": "local_fallback"
+        }
+    
+    areas = {}
+    for d in confident:
+        areas[d["class"]] = areas.get(d["class"], 0) + d.get("area", 0)
+    total_area = sum(areas.values()) or 1
+    palpebral_share = (areas.get("palpebral", 0) + areas.get("forniceal_palpebral", 0)) / total_area
+    confidence = sum(d["confidence"] * d.get("area", 0) for d in confident) / total_area
+    regions = ", ".join(f"{name} {area / total_area:.0%}" for name, area in sorted(areas.items()))
+    
+    if palpebral_share >= FALLBACK_PALPEBRAL_SHARE:
+        condition, severity, risk_level, follow_up = "Possible Inflammation", "moderate", "medium", "3 days"
+    else:
+        condition, severity, risk_level, follow_up = "No Obvious Abnormality", "mild", "low", "1 week"
+    
+    return {
+        "condition": condition,
+        "severity": severity,
+        "analysis": f"Detected conjunctiva regions: {regions} (mean confidence {confidence:.2f}). {note}",
+        "recommendations": "Keep the eye clean, avoid rubbing it and repeat the analysis later for a full AI review",
+        "medical_advice": "Consult an eye specialist if symptoms persist or worsen",
+        "risk_level": risk_level,
+        "follow_up": follow_up,
+        "source": "local_fallback"
+    }
+
+async def analyze_with_gpt_vision(image_path: str, detection_results: List[Dict], user_description: str = None,
+                                  image_bytes: Optional[bytes] = None, image_mime: str = "image/jpeg") -> Dict[str, Any]:
     """Analyze image with GPT-4o Vision via AIMLAPI"""
-    if not ai_client:
+    if not get_ai_client():
         return {
             "analysis": "AI analysis not available",
             "recommendations": "Please consult an eye specialist",
@@ -617,7 +2067,10 @@ async def analyze_with_gpt_vision(image_path: str, detection_results: List[Dict]
         }
     
     try:
-        base64_image = encode_image_to_base64(image_path)
+        if image_bytes:
+            base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        else:
+            base64_image = encode_image_to_base64(image_path)
         if not base64_image:
             raise ValueError("Could not encode image")
         
@@ -645,7 +2098,7 @@ Provide a comprehensive analysis in the following JSON format:
 
 Focus on conjunctiva health, inflammation signs, and provide actionable advice."""
 
-        response = ai_client.chat.completions.create(
+        response = await create_chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -654,7 +2107,7 @@ Focus on conjunctiva health, inflammation signs, and provide actionable advice."
                         {"type": "text", "text": prompt},
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                            "image_url": {"url": f"data:{image_mime};base64,{base64_image}"}
                         }
                     ]
                 }
@@ -681,6 +2134,14 @@ Focus on conjunctiva health, inflammation signs, and provide actionable advice."
         
         return result
     
+    except CircuitOpen:
+        # Provider is degraded: answer in milliseconds instead of waiting for timeouts
+        return local_fallback_analysis(detection_results, "the AI service is temporarily unavailable")
+    except StageOverloaded:
+        return local_fallback_analysis(detection_results, "the AI service is busy")
+    except llm_transient_errors() as e:
+        print(f"GPT Vision analysis error: {e}")
+        return local_fallback_analysis(detection_results, "the AI service did not respond")
     except Exception as e:
         print(f"GPT Vision analysis error: {e}")
         return {
@@ -693,149 +2154,647 @@ Focus on conjunctiva health, inflammation signs, and provide actionable advice."
             "follow_up": "ASAP"
         }
 
-async def create_comparison_image(user_id: str, current_image_path: str) -> Optional[str]:
-    """Create comparison between current and previous images"""
+def comparison_image_path(previous_id: str, current_id: str) -> str:
+    """Deterministic location of the comparison for an (earlier, later) analysis pair"""
+    return os.path.join(COMPARISON_DIR, f"comparison_{previous_id}_{current_id}.jpg")
+
+def compose_comparison_image(output_path: str, current_image_path: str, current_img, previous_path: str,
+                             previous_timestamp: datetime, current_timestamp: datetime) -> Optional[str]:
+    """Write a side-by-side previous/current image to output_path"""
+    import cv2
+
+    if current_img is None:
+        current_img = cv2.imread(current_image_path)
+    previous_img = cv2.imread(previous_path)
+    
+    if current_img is None or previous_img is None:
+        return None
+    
+    # Resize images to same size
+    height = max(current_img.shape[0], previous_img.shape[0])
+    width = max(current_img.shape[1], previous_img.shape[1])
+    
+    current_resized = cv2.resize(current_img, (width, height))
+    previous_resized = cv2.resize(previous_img, (width, height))
+    
+    # Create comparison image side by side
+    comparison = np.hstack([previous_resized, current_resized])
+    
+    # Add labels
+    cv2.putText(comparison, "Previous", (10, 30), 
+               cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    cv2.putText(comparison, "Current", (width + 10, 30), 
+               cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    
+    # Add dates
+    prev_date = previous_timestamp.strftime("%Y-%m-%d")
+    curr_date = current_timestamp.strftime("%Y-%m-%d")
+    
+    cv2.putText(comparison, prev_date, (10, height - 10), 
+               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    cv2.putText(comparison, curr_date, (width + 10, height - 10), 
+               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    
+    # Write to a temporary file first so readers never see a half-written image
+    ok, encoded = cv2.imencode(".jpg", comparison)
+    if not ok:
+        return None
+    temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(temp_path, output_path)
+    
+    return output_path
+
+comparison_stats = {"hits": 0, "renders": 0}
+comparisons_in_flight: Dict[str, asyncio.Task] = {}  # pair key -> task rendering it
+
+async def render_comparison(user_id: str, previous: Dict[str, Any], current: Dict[str, Any], current_img=None) -> Optional[str]:
+    path = await run_render(
+        compose_comparison_image,
+        comparison_image_path(previous["_id"], current["_id"]),
+        current["image_path"], current_img, previous["image_path"], previous["timestamp"], current["timestamp"]
+    )
+    if path:
+        comparison_stats["renders"] += 1
+        await db.comparisons.replace_one(
+            {"_id": f"{previous['_id']}:{current['_id']}"},
+            {
+                "user_id": user_id,
+                "previous_id": previous["_id"],
+                "current_id": current["_id"],
+                "path": path,
+                "created_at": datetime.utcnow()
+            },
+            upsert=True
+        )
+    return path
+
+async def get_comparison_image(user_id: str, previous: Dict[str, Any], current: Dict[str, Any], current_img=None) -> Optional[str]:
+    """Return the comparison for an analysis pair, rendering it only the first time it is asked for"""
+    pair_key = f"{previous['_id']}:{current['_id']}"
+    indexed = await db.comparisons.find_one({"_id": pair_key, "user_id": user_id}, {"path": 1})
+    if indexed and os.path.exists(indexed["path"]):
+        comparison_stats["hits"] += 1
+        return indexed["path"]
+
+    task = comparisons_in_flight.get(pair_key)
+    if task is None:
+        task = asyncio.create_task(render_comparison(user_id, previous, current, current_img))
+        comparisons_in_flight[pair_key] = task
+        task.add_done_callback(lambda _: comparisons_in_flight.pop(pair_key, None))
+    return await asyncio.shield(task)
+
+async def create_comparison_image(user_id: str, current_analysis_id: str, current_image_path: str,
+                                  current_img=None) -> Optional[str]:
+    """Create comparison between a new analysis and the user's previous one
+
+    The previous image is the latest other analysis, so the comparison can be built
+    while the current analysis is still being saved.
+    """
     try:
-        # Get previous analyses for this user
-        previous_analyses = await db.analyses.find(
-            {"user_id": user_id}
-        ).sort("timestamp", -1).limit(2).to_list(length=2)
-        
-        if len(previous_analyses) < 2:
+        previous = await db.analyses.find_one(
+            {"user_id": user_id, "_id": {"$ne": current_analysis_id}},
+            {"image_path": 1, "timestamp": 1},
+            sort=[("timestamp", -1)]
+        )
+        if previous is None:
             return None  # Need at least 2 images to compare
         
-        current_img = cv2.imread(current_image_path)
-        previous_path = previous_analyses[1]['image_path']
-        previous_img = cv2.imread(previous_path)
-        
-        if current_img is None or previous_img is None:
-            return None
-        
-        # Resize images to same size
-        height = max(current_img.shape[0], previous_img.shape[0])
-        width = max(current_img.shape[1], previous_img.shape[1])
-        
-        current_resized = cv2.resize(current_img, (width, height))
-        previous_resized = cv2.resize(previous_img, (width, height))
-        
-        # Create comparison image side by side
-        comparison = np.hstack([previous_resized, current_resized])
-        
-        # Add labels
-        cv2.putText(comparison, "Previous", (10, 30), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        cv2.putText(comparison, "Current", (width + 10, 30), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
-        # Add dates
-        prev_date = previous_analyses[1]['timestamp'].strftime("%Y-%m-%d")
-        curr_date = datetime.now().strftime("%Y-%m-%d")
-        
-        cv2.putText(comparison, prev_date, (10, height - 10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        cv2.putText(comparison, curr_date, (width + 10, height - 10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-        
-        # Save comparison image
-        comparison_filename = f"comparison_{user_id}_{uuid.uuid4()}.jpg"
-        comparison_path = os.path.join(COMPARISON_DIR, comparison_filename)
-        cv2.imwrite(comparison_path, comparison)
-        
-        return comparison_path
+        current = {"_id": current_analysis_id, "image_path": current_image_path, "timestamp": datetime.utcnow()}
+        return await get_comparison_image(user_id, previous, current, current_img)
     
     except Exception as e:
         print(f"Error creating comparison: {e}")
         return None
 
-async def generate_progress_chart(user_id: str) -> Optional[str]:
-    """Generate progress chart for user"""
-    try:
-        analyses = await db.analyses.find(
-            {"user_id": user_id}
-        ).sort("timestamp", 1).to_list(length=100)
-        
-        if len(analyses) < 2:
-            return None
-        
-        # Extract data
-        dates = [a['timestamp'].strftime("%m/%d") for a in analyses]
-        severity_map = {"normal": 0, "mild": 1, "moderate": 2, "severe": 3, "unknown": 1.5}
-        severities = [severity_map.get(a.get('severity', 'unknown').lower(), 1.5) 
-                     for a in analyses]
-        
-        # Create chart
-        plt.figure(figsize=(10, 6))
-        plt.plot(dates, severities, marker='o', linewidth=2, markersize=8)
-        plt.xlabel('Date', fontsize=12)
-        plt.ylabel('Severity Level', fontsize=12)
-        plt.title('Eye Health Progress Over Time', fontsize=14, fontweight='bold')
-        plt.yticks([0, 1, 2, 3], ['Normal', 'Mild', 'Moderate', 'Severe'])
-        plt.grid(True, alpha=0.3)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        
-        # Save chart
-        chart_filename = f"progress_{user_id}_{uuid.uuid4()}.png"
-        chart_path = os.path.join(COMPARISON_DIR, chart_filename)
-        plt.savefig(chart_path, dpi=150, bbox_inches='tight')
-        plt.close()
-        
-        return chart_path
-    
-    except Exception as e:
-        print(f"Error generating progress chart: {e}")
+# Per-user severity series, appended to whenever an analysis is saved
+PROGRESS_MAX_POINTS = 100
+SEVERITY_LEVELS = {"normal": 0, "mild": 1, "moderate": 2, "severe": 3}
+
+progress_stats = {"hits": 0, "renders": 0}
+progress_charts_in_flight: Dict[str, asyncio.Task] = {}  # chart path -> task rendering it
+
+def progress_point(analysis_id: str, timestamp: datetime, severity: Optional[str]) -> Dict[str, Any]:
+    severity = (severity or "Unknown").lower()
+    return {
+        "analysis_id": analysis_id,
+        "timestamp": timestamp,
+        "severity": severity,
+        "level": SEVERITY_LEVELS.get(severity, 1.5)
+    }
+
+async def record_progress_point(user_id: str, analysis_id: str, timestamp: datetime, severity: Optional[str]):
+    """Add an analysis to the user's progress series, or update it if a retried job saved it before"""
+    point = progress_point(analysis_id, timestamp, severity)
+    now = datetime.utcnow()
+    result = await db.progress_series.update_one(
+        {"_id": user_id, "points.analysis_id": analysis_id},
+        {"$set": {"points.$": point, "updated_at": now}, "$inc": {"version": 1}}
+    )
+    if result.matched_count:
+        return
+    result = await db.progress_series.update_one(
+        {"_id": user_id, "points.analysis_id": {"$ne": analysis_id}},
+        {
+            "$push": {"points": {"$each": [point], "$sort": {"timestamp": 1}, "$slice": -PROGRESS_MAX_POINTS}},
+            "$set": {"updated_at": now},
+            "$inc": {"version": 1}
+        }
+    )
+    if not result.matched_count:
+        # No series yet: build it from the analyses, which already include this one
+        await get_progress_series(user_id)
+
+async def get_progress_series(user_id: str) -> Dict[str, Any]:
+    """Return the user's progress series, building it from past analyses the first time"""
+    series = await db.progress_series.find_one({"_id": user_id})
+    if series is not None:
+        return series
+
+    analyses = await db.analyses.find(
+        {"user_id": user_id}, {"timestamp": 1, "severity": 1}
+    ).sort("timestamp", -1).to_list(length=PROGRESS_MAX_POINTS)
+    series = {
+        "points": [progress_point(a["_id"], a["timestamp"], a.get("severity")) for a in reversed(analyses)],
+        "version": 1,
+        "updated_at": datetime.utcnow()
+    }
+    # $setOnInsert leaves a series alone if an analysis was recorded in the meantime
+    return await db.progress_series.find_one_and_update(
+        {"_id": user_id},
+        {"$setOnInsert": series},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+def render_progress_chart(output_path: str, points: List[Dict[str, Any]]) -> str:
+    """Draw the severity series with matplotlib's object-oriented API (safe in worker threads)"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    positions = range(len(points))
+    ax.plot(positions, [p["level"] for p in points], marker='o', linewidth=2, markersize=8)
+    ax.set_xlabel('Date', fontsize=12)
+    ax.set_ylabel('Severity Level', fontsize=12)
+    ax.set_title('Eye Health Progress Over Time', fontsize=14, fontweight='bold')
+    ax.set_yticks([0, 1, 2, 3], ['Normal', 'Mild', 'Moderate', 'Severe'])
+    ax.set_xticks(positions, [p["timestamp"].strftime("%m/%d") for p in points], rotation=45)
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+
+    temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    fig.savefig(temp_path, format="png", dpi=150, bbox_inches='tight')
+    os.replace(temp_path, output_path)
+    return output_path
+
+def progress_chart_path(user_id: str, version: int) -> str:
+    return os.path.join(COMPARISON_DIR, f"progress_{user_id}_v{version}.png")
+
+def remove_stale_progress_charts(user_id: str, version: int):
+    """Remove charts older than the previous version
+
+    The previous version is kept so a request that was just handed its path can still
+    stream it, and a slow render of an old version never removes a newer chart.
+    """
+    prefix = f"progress_{user_id}_v"
+    for name in os.listdir(COMPARISON_DIR):
+        if not (name.startswith(prefix) and name.endswith(".png")):
+            continue
+        try:
+            stale = int(name[len(prefix):-len(".png")]) < version - 1
+        except ValueError:
+            continue
+        if stale:
+            try:
+                os.remove(os.path.join(COMPARISON_DIR, name))
+            except OSError:
+                pass
+
+async def render_progress_version(user_id: str, version: int, chart_path: str, points: List[Dict[str, Any]]) -> str:
+    await run_render(render_progress_chart, chart_path, points)
+    progress_stats["renders"] += 1
+    await run_render(remove_stale_progress_charts, user_id, version)
+    return chart_path
+
+async def generate_progress_chart(user_id: str) -> Optional[str]:
+    """Progress chart for the current version of the user's series, rendered only when it changed"""
+    series = await get_progress_series(user_id)
+    if len(series["points"]) < 2:
+        return None
+
+    chart_path = progress_chart_path(user_id, series["version"])
+    if os.path.exists(chart_path):
+        progress_stats["hits"] += 1
+        return chart_path
+
+    task = progress_charts_in_flight.get(chart_path)
+    if task is None:
+        task = asyncio.create_task(render_progress_version(user_id, series["version"], chart_path, series["points"]))
+        progress_charts_in_flight[chart_path] = task
+        task.add_done_callback(lambda _: progress_charts_in_flight.pop(chart_path, None))
+    return await asyncio.shield(task)
+
+# Materialized dashboard statistics, updated in the same path that saves an analysis
+def condition_field(condition: str) -> str:
+    """Model-generated condition names can contain '.' or '$', so counts are keyed by a hash"""
+    return hashlib.sha1(condition.encode("utf-8")).hexdigest()[:16]
+
+def stats_increments(severity: Optional[str], condition: Optional[str], amount: int) -> Dict[str, int]:
+    increments = {}
+    severity = (severity or "unknown").lower()
+    if severity in SEVERITY_LEVELS:
+        increments[f"severity_counts.{severity}"] = amount
+    increments[f"conditions.{condition_field(condition or 'Unknown')}.count"] = amount
+    return increments
+
+def severity_trend(previous_severity: Optional[str], current_severity: Optional[str]) -> str:
+    if previous_severity is None:
+        return "insufficient_data"
+    current_level = SEVERITY_LEVELS.get((current_severity or "mild").lower(), 1)
+    previous_level = SEVERITY_LEVELS.get(previous_severity.lower(), 1)
+    if current_level < previous_level:
+        return "improving"
+    if current_level > previous_level:
+        return "worsening"
+    return "stable"
+
+def follow_up_date(timestamp: datetime, follow_up: Optional[str]) -> Optional[datetime]:
+    """Turn a follow-up like '3 days' or '1 week' into a date; ASAP-style answers mean today"""
+    text = (follow_up or "").lower()
+    match = re.search(r"(\d+)\s*(day|week|month)", text)
+    if match:
+        days = {"day": 1, "week": 7, "month": 30}[match.group(2)] * int(match.group(1))
+        return timestamp + timedelta(days=days)
+    if re.search(r"asap|immediate|today|urgent", text):
+        return timestamp
+    return None
+
+def analysis_summary(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    follow_up = analysis.get("follow_up", "3 days")
+    return {
+        "id": analysis["_id"],
+        "timestamp": analysis["timestamp"],
+        "condition": analysis.get("condition", "Unknown"),
+        "severity": analysis.get("severity", "Unknown"),
+        "risk_level": analysis.get("risk_level", "medium"),
+        "follow_up": follow_up,
+        "next_checkup_date": follow_up_date(analysis["timestamp"], follow_up)
+    }
+
+async def update_user_stats(analysis_doc: Dict[str, Any], replaced: Optional[Dict[str, Any]]):
+    """Fold a saved analysis into the user's stats; a retried save first takes its earlier attempt out"""
+    user_id = analysis_doc["user_id"]
+    summary = analysis_summary(analysis_doc)
+    increments = {"total_analyses": 0 if replaced else 1}
+    if replaced:
+        for field, amount in stats_increments(replaced.get("severity"), replaced.get("condition"), -1).items():
+            increments[field] = increments.get(field, 0) + amount
+    for field, amount in stats_increments(summary["severity"], summary["condition"], 1).items():
+        increments[field] = increments.get(field, 0) + amount
+
+    result = await db.user_stats.update_one(
+        {"_id": user_id},
+        {
+            "$inc": increments,
+            "$set": {
+                f"conditions.{condition_field(summary['condition'])}.name": summary["condition"],
+                "updated_at": datetime.utcnow()
+            }
+        }
+    )
+    if not result.matched_count:
+        # No stats yet: build them from the analyses, which already include this one
+        await get_user_stats(user_id)
+        return
+    await place_in_trend(user_id, summary)
+
+async def place_in_trend(user_id: str, summary: Dict[str, Any]):
+    """Make the analysis the latest or the one before it, going by timestamp, so saves that
+    finish out of order never move the dashboard back to an older analysis"""
+    timestamp = summary["timestamp"]
+    before = await db.user_stats.find_one_and_update(
+        {"_id": user_id, "$or": [
+            {"latest": None},
+            {"latest.id": summary["id"]},
+            {"latest.timestamp": {"$lte": timestamp}}
+        ]},
+        {"$set": {"latest": summary}},
+        projection={"latest": 1, "previous_severity": 1, "previous_timestamp": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is not None:
+        previous_latest = before.get("latest") or {}
+        if previous_latest.get("id") == summary["id"]:
+            previous_severity, previous_timestamp = before.get("previous_severity"), before.get("previous_timestamp")
+        else:
+            previous_severity, previous_timestamp = previous_latest.get("severity"), previous_latest.get("timestamp")
+        await db.user_stats.update_one(
+            {"_id": user_id, "latest.id": summary["id"]},
+            {"$set": {
+                "previous_severity": previous_severity,
+                "previous_timestamp": previous_timestamp,
+                "trend": severity_trend(previous_severity, summary["severity"])
+            }}
+        )
+        return
+
+    # Older than the latest analysis, but it may still be the one the latest is compared with
+    after = await db.user_stats.find_one_and_update(
+        {"_id": user_id, "latest.timestamp": {"$gt": timestamp}, "$or": [
+            {"previous_timestamp": None},
+            {"previous_timestamp": {"$lte": timestamp}}
+        ]},
+        {"$set": {"previous_severity": summary["severity"], "previous_timestamp": timestamp}},
+        projection={"latest": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if after is not None:
+        await db.user_stats.update_one(
+            {"_id": user_id, "latest.id": after["latest"]["id"], "previous_timestamp": timestamp},
+            {"$set": {"trend": severity_trend(summary["severity"], after["latest"]["severity"])}}
+        )
+
+async def get_user_stats(user_id: str) -> Dict[str, Any]:
+    """Return the user's dashboard stats, building them from past analyses the first time"""
+    stats = await db.user_stats.find_one({"_id": user_id})
+    if stats is not None:
+        return stats
+
+    analyses = await db.analyses.find(
+        {"user_id": user_id},
+        {"timestamp": 1, "condition": 1, "severity": 1, "risk_level": 1, "follow_up": 1}
+    ).sort("timestamp", 1).to_list(length=None)
+
+    severity_counts = {severity: 0 for severity in SEVERITY_LEVELS}
+    conditions = {}
+    for analysis in analyses:
+        severity = analysis.get("severity", "unknown").lower()
+        if severity in severity_counts:
+            severity_counts[severity] += 1
+        condition = analysis.get("condition", "Unknown")
+        entry = conditions.setdefault(condition_field(condition), {"name": condition, "count": 0})
+        entry["count"] += 1
+
+    previous_severity = analyses[-2].get("severity", "mild") if len(analyses) >= 2 else None
+    previous_timestamp = analyses[-2]["timestamp"] if len(analyses) >= 2 else None
+    latest = analysis_summary(analyses[-1]) if analyses else None
+    stats = {
+        "total_analyses": len(analyses),
+        "severity_counts": severity_counts,
+        "conditions": conditions,
+        "latest": latest,
+        "previous_severity": previous_severity,
+        "previous_timestamp": previous_timestamp,
+        "trend": severity_trend(previous_severity, latest["severity"]) if latest else "insufficient_data",
+        "updated_at": datetime.utcnow()
+    }
+    # $setOnInsert leaves stats alone if an analysis was recorded in the meantime
+    return await db.user_stats.find_one_and_update(
+        {"_id": user_id},
+        {"$setOnInsert": stats},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+class TTLCache:
+    """Small in-process LRU cache with per-entry TTL and hit/miss counters"""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+analysis_cache = TTLCache(ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL_SECONDS)
+
+def analysis_cache_key(user_id: str, content: bytes, user_description: Optional[str]) -> str:
+    """Content-addressed key for an upload, tied to the model and prompt versions
+
+    Scoped to the user: a cached analysis points at that user's stored image and overlay.
+    """
+    digest = hashlib.sha256(content)
+    digest.update(f"|{user_id}|{MODEL_VERSION}|{VISION_PROMPT_VERSION}|{user_description or ''}".encode('utf-8'))
+    return digest.hexdigest()
+
+def get_cached_analysis(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Return a cached analysis if its stored files are still on disk"""
+    cached = analysis_cache.get(cache_key)
+    if not cached:
+        return None
+    detection_path = cached["yolo_results"].get("detection_path")
+    if not os.path.exists(cached["image_path"]) or (detection_path and not os.path.exists(detection_path)):
+        analysis_cache.invalidate(cache_key)
+        return None
+    return cached
+
+async def save_analysis(user_id: str, file_id: str, file_path: str, user_description: Optional[str],
+                        yolo_results: Dict[str, Any], gpt_analysis: Dict[str, Any],
+                        vision_payload: Optional[Dict[str, Any]], partial: bool = False):
+    """Save analysis to database"""
+    analysis_doc = {
+        "_id": file_id,
+        "user_id": user_id,
+        "image_path": file_path,
+        "detection_path": yolo_results.get("detection_path"),
+        "user_description": user_description,
+        "detections": yolo_results.get("detections", []),
+        "condition": gpt_analysis.get("condition", "Unknown"),
+        "severity": gpt_analysis.get("severity", "Unknown"),
+        "analysis": gpt_analysis.get("analysis", ""),
+        "recommendations": gpt_analysis.get("recommendations", ""),
+        "medical_advice": gpt_analysis.get("medical_advice", ""),
+        "risk_level": gpt_analysis.get("risk_level", "medium"),
+        "follow_up": gpt_analysis.get("follow_up", "3 days"),
+        "vision_payload": vision_payload,
+        "partial": partial,
+        "timestamp": datetime.utcnow()
+    }
+    # Upsert so a retried queue job does not trip over its own earlier attempt
+    replaced = await db.analyses.find_one_and_replace(
+        {"_id": file_id}, analysis_doc, projection={"severity": 1, "condition": 1}, upsert=True
+    )
+    await update_user_stats(analysis_doc, replaced)
+    await record_progress_point(user_id, file_id, analysis_doc["timestamp"], analysis_doc["severity"])
+
+def request_deadline(timeout_header: Optional[str] = None) -> float:
+    """Epoch deadline for an analysis: the configured budget, or less if the client asks for it"""
+    budget = ANALYSIS_DEADLINE_SECONDS
+    if timeout_header:
+        try:
+            requested = float(timeout_header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+        if requested > 0:
+            budget = min(budget, requested)
+    return time.time() + budget
+
+def remaining_budget(deadline: Optional[float], reserve: float = 0.0) -> Optional[float]:
+    """Seconds left before the deadline (None if there is no deadline)"""
+    if deadline is None:
         return None
+    return max(0.0, deadline - time.time() - reserve)
 
 # LangGraph nodes
-def process_image_node(state: AgentState):
-    """Process uploaded image with YOLO"""
-    image_path = state.get("image_path")
-    if not image_path:
-        return {"next_action": "question_answer"}
-    
-    detection_path, detection_results = process_yolo_detection(image_path)
-    
+#
+# Image analysis runs as four supersteps:
+#   process_image (YOLO inference)
+#   -> render_overlay | gpt_analysis (payload + GPT-4o) | compare
+#   -> persist
+#   -> notify
+# The overlay and comparison run alongside the LLM call, so the critical path is
+# inference + LLM + one database write + one outbox insert. Notify waits for persist
+# so no email goes out for an analysis that failed to save.
+def timed_node(name: str, node):
+    """Wrap a node so its update reports the node's wall time in timings[name]"""
+    async def run(state: AgentState):
+        start = time.perf_counter()
+        update = await node(state) or {}
+        return {**update, "timings": {name: round((time.perf_counter() - start) * 1000, 1)}}
+    return run
+
+async def process_image_node(state: AgentState):
+    """Run YOLO segmentation on the uploaded image"""
+    detections, overlay = await run_detection(state["image_path"], state.get("image"))
+    return {"detections": detections, "segmentation_overlay": overlay}
+
+async def render_overlay_node(state: AgentState):
+    """Render and save the detection overlay"""
+    try:
+        detection_path = await run_render(
+            save_detection_overlay, state["image_path"], state.get("image"), state.get("segmentation_overlay")
+        )
+    except StageOverloaded:
+        print("Render stage is overloaded, skipping the detection overlay")
+        detection_path = None
     return {
         "yolo_results": {
             "detection_path": detection_path,
-            "detections": detection_results
-        },
-        "next_action": "gpt_analysis"
+            "detections": state.get("detections") or []
+        }
     }
 
 async def gpt_analysis_node(state: AgentState):
     """Analyze image with GPT-4o Vision"""
-    image_path = state.get("image_path")
-    yolo_results = state.get("yolo_results", {})
-    user_description = state.get("user_description")
-    
-    if not image_path:
-        return {"next_action": "question_answer"}
-    
-    gpt_results = await analyze_with_gpt_vision(
-        image_path, 
-        yolo_results.get("detections", []),
-        user_description
+    detections = state.get("detections") or []
+    payload_bytes, payload_mime, payload_stats = await asyncio.get_running_loop().run_in_executor(
+        None, prepare_vision_payload, state.get("image"), state.get("image_bytes"), detections
     )
+    if payload_stats:
+        print(f"Vision payload: {payload_stats['original_bytes']} -> {payload_stats['payload_bytes']} bytes, "
+              f"~{payload_stats['original_tokens']} -> {payload_stats['payload_tokens']} image tokens")
+    
+    # Cancel the LLM call rather than miss the deadline
+    budget = remaining_budget(state.get("deadline"), DEADLINE_RESERVE_SECONDS)
+    try:
+        gpt_results = await asyncio.wait_for(analyze_with_gpt_vision(
+            state["image_path"],
+            detections,
+            state.get("user_description"),
+            payload_bytes,
+            payload_mime
+        ), timeout=budget)
+    except asyncio.TimeoutError:
+        print(f"GPT Vision analysis cut off by the request deadline ({budget:.1f}s left)")
+        return {
+            "gpt_analysis": local_fallback_analysis(detections, "the AI analysis did not finish in time"),
+            "vision_payload": payload_stats,
+            "partial": True
+        }
     
     return {
         "gpt_analysis": gpt_results,
-        "next_action": "complete"
+        "vision_payload": payload_stats
     }
 
-async def question_answer_node(state: AgentState):
-    """Handle text-based questions about eyes"""
-    messages = state.get("messages", [])
-    if not messages or not ai_client:
-        return {"next_action": "complete"}
-    
-    last_message = messages[-1].get("content", "")
-    
+async def compare_node(state: AgentState):
+    """Build the comparison with the user's previous image"""
     try:
-        prompt = f"""You are an AI ophthalmology assistant specializing in eye health and conjunctiva conditions.
+        comparison_path = await asyncio.wait_for(create_comparison_image(
+            state["user"]["_id"], state["analysis_id"], state["image_path"], state.get("image")
+        ), timeout=remaining_budget(state.get("deadline"), DEADLINE_RESERVE_SECONDS))
+    except asyncio.TimeoutError:
+        comparison_path = None
+    return {"comparison_path": comparison_path}
+
+async def persist_node(state: AgentState):
+    """Save the analysis once the overlay and GPT analysis are ready"""
+    await save_analysis(
+        state["user"]["_id"],
+        state["analysis_id"],
+        state["image_path"],
+        state.get("user_description"),
+        state.get("yolo_results") or {},
+        state.get("gpt_analysis") or {},
+        state.get("vision_payload"),
+        state.get("partial", False)
+    )
+    return {}
+
+async def notify_node(state: AgentState):
+    """Queue the results email in the outbox"""
+    await send_analysis_result_email(
+        state["user"]["email"],
+        state["user"]["full_name"],
+        state.get("gpt_analysis") or {},
+        state["analysis_id"],
+        key=f"analysis-result:{state['analysis_id']}"
+    )
+    return {}
+
+QUESTION_UNAVAILABLE_ANSWER = "I apologize, but I'm unable to process your question at the moment. Please consult an eye care professional."
 
-User Question: {last_message}
+def question_prompt(question: str, passages: Optional[List[Dict[str, Any]]] = None) -> str:
+    reference = ""
+    if passages:
+        reference = "\nReference answers from our vetted eye-health FAQ (use them where relevant and do not contradict them):\n"
+        reference += "\n".join(f"Q: {entry['questions'][0]}\nA: {entry['answer']}" for entry in passages) + "\n"
+    return f"""You are an AI ophthalmology assistant specializing in eye health and conjunctiva conditions.
 
+User Question: {question}
+{reference}
 Provide helpful, accurate information about:
 - Eye health and conjunctiva conditions
 - Symptoms and their potential causes
@@ -844,9 +2803,18 @@ Provide helpful, accurate information about:
 
 Always remind users to consult healthcare professionals for proper diagnosis and treatment."""
 
-        response = ai_client.chat.completions.create(
+async def question_answer_node(state: AgentState):
+    """Handle text-based questions about eyes"""
+    messages = state.get("messages", [])
+    if not messages or not get_ai_client():
+        return {"next_action": "complete"}
+    
+    last_message = messages[-1].get("content", "")
+    
+    try:
+        response = await create_chat_completion(
             model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
+            messages=[{"role": "user", "content": question_prompt(last_message, state.get("faq_passages"))}],
             max_tokens=1000
         )
         
@@ -858,30 +2826,60 @@ Always remind users to consult healthcare professionals for proper diagnosis and
     except Exception as e:
         return {
             "gpt_analysis": {
-                "analysis": "I apologize, but I'm unable to process your question at the moment. Please consult an eye care professional."
+                "analysis": QUESTION_UNAVAILABLE_ANSWER,
+                "error": str(e)
             },
             "next_action": "complete"
         }
 
 def route_next_action(state: AgentState):
     """Route to next action based on state"""
+    from langgraph.graph import END
+
     next_action = state.get("next_action", "complete")
     if next_action == "complete":
         return END
     return next_action
 
-# Create LangGraph workflow
-workflow = StateGraph(AgentState)
-workflow.add_node("process_image", process_image_node)
-workflow.add_node("gpt_analysis", gpt_analysis_node)
-workflow.add_node("question_answer", question_answer_node)
-
-workflow.add_conditional_edges("process_image", route_next_action)
-workflow.add_conditional_edges("gpt_analysis", route_next_action)
-workflow.add_conditional_edges("question_answer", route_next_action)
-
-workflow.set_entry_point("process_image")
-agent = workflow.compile()
+def route_entry(state: AgentState):
+    """Uploads go through the image pipeline, everything else is a question"""
+    if state.get("image_path") and state.get("user"):
+        return "process_image"
+    return "question_answer"
+
+agent = None
+
+def get_agent():
+    """Build and compile the LangGraph workflow on first use"""
+    global agent
+    if agent is None:
+        from langgraph.graph import StateGraph, START, END
+
+        # Create LangGraph workflow
+        workflow = StateGraph(AgentState)
+        for name, node in [
+            ("process_image", process_image_node),
+            ("render_overlay", render_overlay_node),
+            ("gpt_analysis", gpt_analysis_node),
+            ("compare", compare_node),
+            ("persist", persist_node),
+            ("notify", notify_node),
+            ("question_answer", question_answer_node)
+        ]:
+            workflow.add_node(name, timed_node(name, node))
+
+        workflow.add_conditional_edges(START, route_entry, ["process_image", "question_answer"])
+        workflow.add_edge("process_image", "render_overlay")
+        workflow.add_edge("process_image", "gpt_analysis")
+        workflow.add_edge("process_image", "compare")
+        workflow.add_edge(["render_overlay", "gpt_analysis"], "persist")
+        workflow.add_edge("persist", "notify")
+        for name in ("compare", "notify"):
+            workflow.add_edge(name, END)
+        workflow.add_conditional_edges("question_answer", route_next_action)
+
+        agent = workflow.compile()
+    return agent
 
 # API Routes
 
@@ -929,7 +2927,7 @@ async def signup(user: UserSignup):
     await db.users.insert_one(user_doc)
     
     # Send welcome email
-    asyncio.create_task(send_welcome_email(user.email, user.full_name))
+    await send_welcome_email(user.email, user.full_name, key=f"welcome:{user_id}")
     
     # Create access token
     token = create_access_token(user_id, user.email)
@@ -988,28 +2986,364 @@ async def get_profile(current_user = Depends(get_current_user)):
         }
     }
 
+def analysis_detection_event(yolo_results: Dict[str, Any]) -> Dict[str, Any]:
+    """Payload of the stage event that carries the YOLO overlay"""
+    detection_path = yolo_results.get("detection_path")
+    return {
+        "detection_path": detection_path,
+        "detection_url": f"/detection_results/{os.path.basename(detection_path)}" if detection_path else None,
+        "detections": yolo_results.get("detections", [])
+    }
+
+async def run_analysis(
+    current_user: Dict[str, Any],
+    file_id: str,
+    content: bytes,
+    filename: str,
+    combined_description: Optional[str],
+    cache_key: str,
+    publish=None,
+    upload_saved: bool = False,
+    deadline: Optional[float] = None
+) -> Dict[str, Any]:
+    """Run the full analysis pipeline for one upload, reporting stage events to publish(event, data)
+
+    With a deadline (epoch seconds) the GPT-4o call is cancelled when time runs out and
+    the YOLO results are saved and returned with partial=True.
+    """
+    publish = publish or (lambda event, data: None)
+    
+    # Re-uploads of the same photo reuse the stored detections and GPT analysis
+    cached = get_cached_analysis(cache_key)
+    
+    if cached:
+        file_path = cached["image_path"]
+        yolo_results = cached["yolo_results"]
+        gpt_analysis = cached["gpt_analysis"]
+        publish("detection", analysis_detection_event(yolo_results))
+        publish("gpt_analysis", gpt_analysis)
+        
+        start = time.perf_counter()
+        _, comparison_path = await asyncio.gather(
+            save_analysis(current_user["_id"], file_id, file_path, combined_description, yolo_results, gpt_analysis, None),
+            create_comparison_image(current_user["_id"], file_id, file_path)
+        )
+        publish("saved", {"analysis_id": file_id})
+        publish("comparison", {"comparison_available": comparison_path is not None})
+        await send_analysis_result_email(
+            current_user["email"],
+            current_user["full_name"],
+            gpt_analysis,
+            file_id,
+            key=f"analysis-result:{file_id}"
+        )
+        timings = {"persist_and_compare": round((time.perf_counter() - start) * 1000, 1)}
+        partial = False
+    else:
+        # Decode once in memory; every stage shares this ndarray
+        image = await asyncio.get_running_loop().run_in_executor(None, decode_image, content)
+        if image is None:
+            raise HTTPException(status_code=400, detail="Could not decode image")
+        
+        # Save uploaded file in the background while the pipeline runs (queued jobs stored it on enqueue)
+        file_path = upload_path(file_id, filename)
+        save_task = None if upload_saved else asyncio.create_task(save_upload(file_path, content))
+        
+        # Process with LangGraph agent; it also saves the analysis, builds the comparison and sends the email
+        initial_state = {
+            "messages": [],
+            "user": current_user,
+            "analysis_id": file_id,
+            "image_path": file_path,
+            "image": image,
+            "image_bytes": content,
+            "user_description": combined_description,
+            "yolo_results": None,
+            "gpt_analysis": None,
+            "comparison_path": None,
+            "timings": {},
+            "deadline": deadline,
+            "partial": False
+        }
+        
+        # Stream node updates so each stage is published as soon as it finishes
+        result = dict(initial_state)
+        try:
+            async for update in get_agent().astream(initial_state, stream_mode="updates"):
+                for node_name, node_update in update.items():
+                    node_update = node_update or {}
+                    result.update({key: value for key, value in node_update.items() if key != "timings"})
+                    result["timings"] = merge_timings(result["timings"], node_update.get("timings"))
+                    if node_name == "render_overlay":
+                        publish("detection", analysis_detection_event(result.get("yolo_results") or {}))
+                    elif node_name == "gpt_analysis":
+                        publish("gpt_analysis", result.get("gpt_analysis") or {})
+                    elif node_name == "persist":
+                        publish("saved", {"analysis_id": file_id})
+                    elif node_name == "compare":
+                        publish("comparison", {"comparison_available": result.get("comparison_path") is not None})
+        finally:
+            if save_task:
+                await save_task
+        
+        yolo_results = result.get("yolo_results") or {}
+        gpt_analysis = result.get("gpt_analysis") or {}
+        comparison_path = result.get("comparison_path")
+        timings = result["timings"]
+        partial = result.get("partial", False)
+        if (yolo_results.get("detection_path") and gpt_analysis.get("condition") != "Analysis Error"
+                and gpt_analysis.get("source") != "local_fallback" and not partial):
+            analysis_cache.set(cache_key, {
+                "image_path": file_path,
+                "yolo_results": yolo_results,
+                "gpt_analysis": gpt_analysis
+            })
+    
+    print(f"Analysis {file_id} stage timings (ms): {timings}")
+    
+    return {
+        "status": "success",
+        "analysis_id": file_id,
+        "yolo_detection": yolo_results,
+        "gpt_analysis": gpt_analysis,
+        "user_description": combined_description,
+        "comparison_available": comparison_path is not None,
+        "cached": cached is not None,
+        "partial": partial,
+        "timings": timings,
+        "message": "AI analysis timed out; segmentation results have been saved." if partial
+            else "Analysis complete! Results have been sent to your email."
+    }
+
+class AnalysisJob:
+    """In-memory analysis job with a replayable list of stage events"""
+
+    TERMINAL_EVENTS = ("complete", "error")
+
+    def __init__(self, job_id: str, user_id: str, dedup_key: str):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.dedup_key = dedup_key
+        self.status = "queued"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        self._subscribers = []
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def publish(self, event: str, data: Any):
+        entry = {"event": event, "data": data, "timestamp": datetime.utcnow().isoformat()}
+        self.events.append(entry)
+        if event == "complete":
+            self.status, self.result, self.finished_at = "completed", data, datetime.utcnow()
+        elif event == "error":
+            self.status, self.error, self.finished_at = "failed", data, datetime.utcnow()
+        elif self.status == "queued":
+            self.status = "running"
+        for subscriber in self._subscribers:
+            subscriber.put_nowait(entry)
+
+    async def stream(self, keepalive_seconds: float = 15):
+        """Yield past events, then live ones until the job finishes; None means keep-alive"""
+        subscriber = asyncio.Queue()
+        self._subscribers.append(subscriber)
+        try:
+            for entry in list(self.events):
+                yield entry
+            if self.done:
+                return
+            while True:
+                try:
+                    entry = await asyncio.wait_for(subscriber.get(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield entry
+                if entry["event"] in self.TERMINAL_EVENTS:
+                    return
+        finally:
+            self._subscribers.remove(subscriber)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "stages": [entry["event"] for entry in self.events],
+            "result": self.result,
+            "error": self.error
+        }
+
+analysis_jobs: Dict[str, AnalysisJob] = {}
+active_analysis_jobs: Dict[str, str] = {}  # dedup key -> job id of a running job
+analysis_job_tasks = set()
+
+def prune_analysis_jobs():
+    """Forget finished jobs older than ANALYSIS_JOB_TTL_SECONDS"""
+    cutoff = datetime.utcnow() - timedelta(seconds=ANALYSIS_JOB_TTL_SECONDS)
+    for job_id in [job_id for job_id, job in analysis_jobs.items() if job.done and job.finished_at < cutoff]:
+        del analysis_jobs[job_id]
+
+async def run_analysis_job(job: AnalysisJob, current_user: Dict[str, Any], content: bytes, filename: str,
+                           combined_description: Optional[str], cache_key: str, deadline: Optional[float] = None):
+    try:
+        job.publish("started", {"job_id": job.job_id})
+        result = await run_analysis(
+            current_user, job.job_id, content, filename, combined_description, cache_key, job.publish,
+            deadline=deadline
+        )
+        job.publish("complete", result)
+    except HTTPException as e:
+        job.publish("error", {"status_code": e.status_code, "detail": e.detail})
+    except StageOverloaded as e:
+        job.publish("error", {"status_code": 503, "detail": "Server is busy, please try again shortly",
+                              "retry_after": e.retry_after})
+    except Exception as e:
+        job.publish("error", {"status_code": 500, "detail": f"Analysis failed: {str(e)}"})
+    finally:
+        active_analysis_jobs.pop(job.dedup_key, None)
+
+# Durable analysis queue (ANALYSIS_QUEUE=mongo), consumed by backend/worker.py.
+# Jobs in db.analysis_queue move queued -> running (leased, renewed by heartbeats) -> completed.
+# Failures are re-queued with backoff until max_attempts, then dead-lettered as "dead";
+# client errors such as an undecodable image go straight to "failed".
+QUEUE_TERMINAL_STATUSES = ("completed", "failed", "dead")
+
+def queued_job_to_dict(job_doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job_doc["_id"],
+        "status": job_doc["status"],
+        "attempts": job_doc.get("attempts", 0),
+        "created_at": job_doc["created_at"].isoformat(),
+        "finished_at": job_doc["finished_at"].isoformat() if job_doc.get("finished_at") else None,
+        "stages": [entry["event"] for entry in job_doc.get("events", [])],
+        "result": job_doc.get("result"),
+        "error": job_doc.get("error")
+    }
+
+async def enqueue_analysis(current_user: Dict[str, Any], file_id: str, content: bytes, filename: str,
+                           combined_description: Optional[str], cache_key: str,
+                           deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Store the upload and queue its analysis; returns the job document (the running one for duplicate uploads)"""
+    dedup_key = f"{current_user['_id']}:{cache_key}"
+    existing = await db.analysis_queue.find_one({"dedup_key": dedup_key, "active": True}, {"events": 0})
+    if existing:
+        return existing
+    
+    # The upload must be on shared storage before a worker can see the job
+    file_path = upload_path(file_id, filename)
+    await save_upload(file_path, content)
+    
+    now = datetime.utcnow()
+    job_doc = {
+        "_id": file_id,
+        "user_id": current_user["_id"],
+        "dedup_key": dedup_key,
+        "active": True,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": JOB_MAX_ATTEMPTS,
+        "available_at": now,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "payload": {
+            "image_path": file_path,
+            "filename": filename,
+            "user_description": combined_description,
+            "cache_key": cache_key,
+            "deadline": deadline
+        },
+        "events": [],
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None
+    }
+    try:
+        await db.analysis_queue.insert_one(job_doc)
+    except DuplicateKeyError:
+        # An identical upload was queued concurrently
+        os.remove(file_path)
+        existing = await db.analysis_queue.find_one({"dedup_key": dedup_key, "active": True}, {"events": 0})
+        if existing:
+            return existing
+        raise
+    return job_doc
+
+async def wait_for_queued_job(job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """Poll until a worker finishes the job; None if it is still pending after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job_doc = await db.analysis_queue.find_one({"_id": job_id}, {"events": 0})
+        if job_doc is None or job_doc["status"] in QUEUE_TERMINAL_STATUSES:
+            return job_doc
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+    return None
+
+async def stream_queued_job(job_id: str, keepalive_seconds: float = 15):
+    """Yield the stage events workers append to a queued job; None means keep-alive"""
+    seen = 0
+    idle = 0.0
+    while True:
+        job_doc = await db.analysis_queue.find_one({"_id": job_id}, {"status": 1, "events": {"$slice": [seen, 1000]}})
+        if job_doc is None:
+            return
+        for entry in job_doc.get("events", []):
+            seen += 1
+            idle = 0.0
+            yield entry
+        if job_doc["status"] in QUEUE_TERMINAL_STATUSES:
+            return
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+        idle += JOB_POLL_INTERVAL
+        if idle >= keepalive_seconds:
+            idle = 0.0
+            yield None
+
+def job_accepted_response(job_id: str) -> JSONResponse:
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "job_id": job_id,
+        "events_url": f"/analysis-jobs/{job_id}/events",
+        "status_url": f"/analysis-jobs/{job_id}"
+    })
+
 @app.post("/analyze-image")
 async def analyze_image(
     file: UploadFile = File(...),
     description: Optional[str] = Form(None),
     symptoms: Optional[str] = Form(None),
     additional_info: Optional[str] = Form(None),
+    job: bool = False,
+    x_request_timeout: Optional[str] = Header(None),
     current_user = Depends(get_current_user)
 ):
-    """Analyze uploaded eye image with authentication"""
+    """Analyze uploaded eye image with authentication
+
+    With ?job=true the upload is accepted with 202 and progress is streamed from
+    /analysis-jobs/{job_id}/events. Synchronous requests (and jobs that send
+    X-Request-Timeout) return partial results when the time budget runs out.
+    """
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
+    enforce_quota(analyze_quota, current_user["_id"])
+    if ANALYSIS_QUEUE != "mongo":
+        # Fail fast instead of queueing behind a saturated pipeline
+        admit(inference_limiter, llm_limiter)
+    
+    deadline = request_deadline(x_request_timeout) if not job or x_request_timeout else None
+    
     try:
-        # Save uploaded file
         file_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1]
-        filename = f"{file_id}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
         content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
         
         # Combine user inputs
         user_description_parts = []
@@ -1021,71 +3355,109 @@ async def analyze_image(
             user_description_parts.append(f"Additional Info: {additional_info}")
         
         combined_description = "; ".join(user_description_parts) if user_description_parts else None
+        cache_key = analysis_cache_key(current_user["_id"], content, combined_description)
         
-        # Process with LangGraph agent
-        initial_state = {
-            "messages": [],
-            "image_path": file_path,
-            "user_description": combined_description,
-            "yolo_results": None,
-            "gpt_analysis": None,
-            "next_action": "process_image"
-        }
-        
-        result = await agent.ainvoke(initial_state)
-        
-        gpt_analysis = result.get("gpt_analysis", {})
-        
-        # Save analysis to database
-        analysis_doc = {
-            "_id": file_id,
-            "user_id": current_user["_id"],
-            "image_path": file_path,
-            "detection_path": result.get("yolo_results", {}).get("detection_path"),
-            "user_description": combined_description,
-            "detections": result.get("yolo_results", {}).get("detections", []),
-            "condition": gpt_analysis.get("condition", "Unknown"),
-            "severity": gpt_analysis.get("severity", "Unknown"),
-            "analysis": gpt_analysis.get("analysis", ""),
-            "recommendations": gpt_analysis.get("recommendations", ""),
-            "medical_advice": gpt_analysis.get("medical_advice", ""),
-            "risk_level": gpt_analysis.get("risk_level", "medium"),
-            "follow_up": gpt_analysis.get("follow_up", "3 days"),
-            "timestamp": datetime.utcnow()
-        }
-        
-        await db.analyses.insert_one(analysis_doc)
-        
-        # Create comparison image if previous images exist
-        comparison_path = await create_comparison_image(current_user["_id"], file_path)
-        
-        # Send email with results
-        asyncio.create_task(send_analysis_result_email(
-            current_user["email"],
-            current_user["full_name"],
-            gpt_analysis,
-            file_id
-        ))
+        if ANALYSIS_QUEUE == "mongo":
+            if db is None:
+                raise HTTPException(status_code=500, detail="Database not available")
+            job_doc = await enqueue_analysis(
+                current_user, file_id, content, file.filename, combined_description, cache_key, deadline
+            )
+            if not job:
+                # Never wait past the request's analysis budget
+                finished = await wait_for_queued_job(job_doc["_id"], min(JOB_WAIT_SECONDS, remaining_budget(deadline)))
+                if finished and finished["status"] == "completed":
+                    return JSONResponse(content=finished["result"])
+                if finished:
+                    error = finished.get("error") or {}
+                    raise HTTPException(status_code=error.get("status_code", 500), detail=error.get("detail", "Analysis failed"))
+                # Workers are backed up; hand the client the job to follow instead of timing out.
+                # Nobody is waiting on the deadline any more, so whatever its status the job
+                # (or its next attempt if it is already running) runs in full.
+                await db.analysis_queue.update_one(
+                    {"_id": job_doc["_id"]},
+                    {"$set": {"payload.deadline": None}}
+                )
+            return job_accepted_response(job_doc["_id"])
         
-        # Prepare response
-        response_data = {
-            "status": "success",
-            "analysis_id": file_id,
-            "yolo_detection": result.get("yolo_results", {}),
-            "gpt_analysis": gpt_analysis,
-            "user_description": combined_description,
-            "comparison_available": comparison_path is not None,
-            "message": "Analysis complete! Results have been sent to your email."
-        }
+        if job:
+            prune_analysis_jobs()
+            # A client retrying the same upload re-attaches to the running job
+            dedup_key = f"{current_user['_id']}:{cache_key}"
+            existing_job_id = active_analysis_jobs.get(dedup_key)
+            if existing_job_id in analysis_jobs:
+                analysis_job = analysis_jobs[existing_job_id]
+            else:
+                analysis_job = AnalysisJob(file_id, current_user["_id"], dedup_key)
+                analysis_jobs[file_id] = analysis_job
+                active_analysis_jobs[dedup_key] = file_id
+                task = asyncio.create_task(run_analysis_job(
+                    analysis_job, current_user, content, file.filename, combined_description, cache_key, deadline
+                ))
+                analysis_job_tasks.add(task)
+                task.add_done_callback(analysis_job_tasks.discard)
+            
+            return job_accepted_response(analysis_job.job_id)
         
+        response_data = await run_analysis(
+            current_user, file_id, content, file.filename, combined_description, cache_key, deadline=deadline
+        )
         return JSONResponse(content=response_data)
     
+    except HTTPException:
+        raise
+    except StageOverloaded as e:
+        raise overloaded_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+async def get_analysis_job(job_id: str, current_user: Dict[str, Any]):
+    """In-process AnalysisJob, or the queue document of a job run by a worker"""
+    analysis_job = analysis_jobs.get(job_id)
+    if analysis_job and analysis_job.user_id == current_user["_id"]:
+        return analysis_job
+    if db is not None:
+        job_doc = await db.analysis_queue.find_one({"_id": job_id, "user_id": current_user["_id"]}, {"events.data": 0})
+        if job_doc:
+            return job_doc
+    raise HTTPException(status_code=404, detail="Analysis job not found")
+
+@app.get("/analysis-jobs/{job_id}")
+async def get_analysis_job_status(job_id: str, current_user = Depends(get_current_user)):
+    """Get status and result of an analysis job"""
+    analysis_job = await get_analysis_job(job_id, current_user)
+    if isinstance(analysis_job, AnalysisJob):
+        return {"status": "success", "job": analysis_job.to_dict()}
+    return {"status": "success", "job": queued_job_to_dict(analysis_job)}
+
+@app.get("/analysis-jobs/{job_id}/events")
+async def stream_analysis_job_events(job_id: str, current_user = Depends(get_current_user)):
+    """Server-Sent Events stream of analysis stages (detection, gpt_analysis, saved, comparison, complete)"""
+    analysis_job = await get_analysis_job(job_id, current_user)
+    events = analysis_job.stream() if isinstance(analysis_job, AnalysisJob) else stream_queued_job(job_id)
+    
+    async def event_stream():
+        async for entry in events:
+            if entry is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {entry['event']}\ndata: {json.dumps(entry['data'], default=str)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/detection-result/{file_id}")
 async def get_detection_result(file_id: str, current_user = Depends(get_current_user)):
     """Get detection result image"""
+    # Cached analyses share the overlay of the original upload
+    if db is not None:
+        analysis = await db.analyses.find_one({"_id": file_id, "user_id": current_user["_id"]}, {"detection_path": 1})
+        if analysis and analysis.get("detection_path") and os.path.exists(analysis["detection_path"]):
+            return FileResponse(analysis["detection_path"], media_type="image/jpeg")
+    
     detection_files = [f for f in os.listdir(OUTPUT_DIR) if file_id in f]
     if not detection_files:
         raise HTTPException(status_code=404, detail="Detection result not found")
@@ -1093,21 +3465,55 @@ async def get_detection_result(file_id: str, current_user = Depends(get_current_
     file_path = os.path.join(OUTPUT_DIR, detection_files[0])
     return FileResponse(file_path, media_type="image/jpeg")
 
+COMPARISON_FIELDS = {"image_path": 1, "timestamp": 1}
+
+async def comparison_response(user_id: str, previous: Dict[str, Any], current: Dict[str, Any]) -> FileResponse:
+    try:
+        comparison_path = await get_comparison_image(user_id, previous, current)
+    except StageOverloaded as e:
+        raise overloaded_exception(e)
+    if not comparison_path:
+        raise HTTPException(status_code=404, detail="Analysis images are no longer available")
+    return FileResponse(comparison_path, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=86400"})
+
 @app.get("/comparison/{analysis_id}")
 async def get_comparison(analysis_id: str, current_user = Depends(get_current_user)):
-    """Get comparison image for an analysis"""
+    """Get comparison image of an analysis and the one before it"""
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not available")
+    
     # Verify analysis belongs to user
-    analysis = await db.analyses.find_one({"_id": analysis_id, "user_id": current_user["_id"]})
+    analysis = await db.analyses.find_one({"_id": analysis_id, "user_id": current_user["_id"]}, COMPARISON_FIELDS)
     if not analysis:
         raise HTTPException(status_code=404, detail="Analysis not found")
     
-    # Create comparison on demand
-    comparison_path = await create_comparison_image(current_user["_id"], analysis["image_path"])
-    
-    if not comparison_path:
+    previous = await db.analyses.find_one(
+        {"user_id": current_user["_id"], "timestamp": {"$lt": analysis["timestamp"]}},
+        COMPARISON_FIELDS,
+        sort=[("timestamp", -1)]
+    )
+    if not previous:
         raise HTTPException(status_code=404, detail="Not enough images for comparison")
     
-    return FileResponse(comparison_path, media_type="image/jpeg")
+    return await comparison_response(current_user["_id"], previous, analysis)
+
+@app.get("/comparison/{first_id}/{second_id}")
+async def compare_analyses(first_id: str, second_id: str, current_user = Depends(get_current_user)):
+    """Compare any two of the user's analyses, earlier one on the left"""
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not available")
+    if first_id == second_id:
+        raise HTTPException(status_code=400, detail="Choose two different analyses to compare")
+    
+    analyses = await db.analyses.find(
+        {"_id": {"$in": [first_id, second_id]}, "user_id": current_user["_id"]}, COMPARISON_FIELDS
+    ).to_list(length=2)
+    if len(analyses) != 2:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    # Either order maps to the same cached pair
+    previous, current = sorted(analyses, key=lambda a: (a["timestamp"], a["_id"]))
+    return await comparison_response(current_user["_id"], previous, current)
 
 @app.get("/history")
 async def get_analysis_history(
@@ -1180,114 +3586,441 @@ async def get_progress_dashboard(current_user = Depends(get_current_user)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
     
-    # Get all analyses
-    analyses = await db.analyses.find(
-        {"user_id": current_user["_id"]}
-    ).sort("timestamp", 1).to_list(length=100)
+    stats = await get_user_stats(current_user["_id"])
     
-    if not analyses:
+    if not stats["total_analyses"]:
         return {
             "status": "success",
             "message": "No analyses yet. Upload your first image to get started!",
             "total_analyses": 0
         }
     
-    # Calculate statistics
-    severity_counts = {"normal": 0, "mild": 0, "moderate": 0, "severe": 0}
-    conditions = {}
-    
-    for analysis in analyses:
-        severity = analysis.get("severity", "unknown").lower()
-        if severity in severity_counts:
-            severity_counts[severity] += 1
-        
-        condition = analysis.get("condition", "Unknown")
-        conditions[condition] = conditions.get(condition, 0) + 1
-    
-    # Get latest analysis
-    latest = analyses[-1]
-    
-    # Determine trend
-    if len(analyses) >= 2:
-        severity_map = {"normal": 0, "mild": 1, "moderate": 2, "severe": 3}
-        current_severity = severity_map.get(latest.get("severity", "mild").lower(), 1)
-        previous_severity = severity_map.get(analyses[-2].get("severity", "mild").lower(), 1)
-        
-        if current_severity < previous_severity:
-            trend = "improving"
-        elif current_severity > previous_severity:
-            trend = "worsening"
-        else:
-            trend = "stable"
-    else:
-        trend = "insufficient_data"
-    
-    # Generate progress chart
-    chart_path = await generate_progress_chart(current_user["_id"])
+    severity_counts = {severity: 0 for severity in SEVERITY_LEVELS}
+    severity_counts.update(stats["severity_counts"])
+    conditions = {entry["name"]: entry["count"] for entry in stats["conditions"].values() if entry["count"] > 0}
+    latest = stats["latest"]
+    next_checkup_date = latest.get("next_checkup_date")
     
     return {
         "status": "success",
-        "total_analyses": len(analyses),
+        "total_analyses": stats["total_analyses"],
         "severity_distribution": severity_counts,
         "conditions_detected": conditions,
         "latest_analysis": {
-            "id": latest["_id"],
+            "id": latest["id"],
             "timestamp": latest["timestamp"].isoformat(),
-            "condition": latest.get("condition", "Unknown"),
-            "severity": latest.get("severity", "Unknown"),
-            "risk_level": latest.get("risk_level", "medium")
+            "condition": latest["condition"],
+            "severity": latest["severity"],
+            "risk_level": latest["risk_level"]
         },
-        "trend": trend,
-        "chart_available": chart_path is not None,
-        "next_checkup": latest.get("follow_up", "3 days")
+        "trend": stats["trend"],
+        "chart_available": stats["total_analyses"] >= 2,
+        "next_checkup": latest["follow_up"],
+        "next_checkup_date": next_checkup_date.isoformat() if next_checkup_date else None
+    }
+
+@app.get("/progress-series")
+async def get_progress_series_data(current_user = Depends(get_current_user)):
+    """Get the severity series behind the progress chart"""
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not available")
+    
+    series = await get_progress_series(current_user["_id"])
+    return {
+        "status": "success",
+        "version": series["version"],
+        "points": [
+            {**point, "timestamp": point["timestamp"].isoformat()}
+            for point in series["points"]
+        ]
     }
 
 @app.get("/progress-chart")
 async def get_progress_chart(current_user = Depends(get_current_user)):
     """Get progress chart image"""
-    chart_path = await generate_progress_chart(current_user["_id"])
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not available")
+    
+    try:
+        chart_path = await generate_progress_chart(current_user["_id"])
+        if chart_path and not os.path.exists(chart_path):
+            # Removed by renders of newer versions in the meantime
+            chart_path = await generate_progress_chart(current_user["_id"])
+    except StageOverloaded as e:
+        raise overloaded_exception(e)
     
     if not chart_path:
         raise HTTPException(status_code=404, detail="Not enough data for chart")
     
     return FileResponse(chart_path, media_type="image/png")
 
+# Bump whenever the question prompt changes so cached answers are not reused
+QUESTION_PROMPT_VERSION = "1"
+
+question_cache = TTLCache(QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL_SECONDS)
+questions_in_flight: Dict[str, asyncio.Task] = {}  # question key -> task answering it upstream
+
+def normalize_question(question: str) -> str:
+    """Fold case, punctuation and whitespace so trivially different phrasings share an answer"""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def question_cache_key(question: str) -> str:
+    normalized = normalize_question(question)
+    # Answers written with FAQ context go stale when the corpus changes
+    index = get_faq_index()
+    faq_version = index.version if index else ""
+    return hashlib.sha256(f"{QUESTION_PROMPT_VERSION}|{faq_version}|{normalized}".encode('utf-8')).hexdigest()
+
+FAQ_VECTOR_DIM = 4096
+FAQ_STOPWORDS = frozenset(
+    "a an and are am be can could do does for how i if in is it me my of on or should "
+    "so that the there this to was what when where which who why will with would you your".split()
+)
+
+class FAQIndex:
+    """Hashed TF-IDF vectors of the curated FAQ questions, searched by cosine similarity"""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries = [entry for entry in entries if entry.get("questions") and entry.get("answer")]
+        self.version = hashlib.sha256(json.dumps(self.entries, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+        rows, offsets = [], []
+        for entry in self.entries:
+            offsets.append(len(rows))
+            rows.extend(self.features(question) for question in entry["questions"])
+
+        counts = np.zeros((len(rows), FAQ_VECTOR_DIM), dtype=np.float32)
+        for row, features in enumerate(rows):
+            for dim, weight in features.items():
+                counts[row, dim] += weight
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1 + len(rows)) / (1 + document_frequency)) + 1).astype(np.float32)
+        self.matrix = self.normalize(counts * self.idf)
+        self.offsets = np.array(offsets)
+
+    @staticmethod
+    def features(text: str) -> Dict[int, float]:
+        """Words and word pairs, plus character trigrams so inflections and typos still overlap"""
+        words = [word for word in normalize_question(text).split() if word not in FAQ_STOPWORDS]
+        terms = [(word, 1.0) for word in words]
+        terms += [(f"{a} {b}", 1.0) for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"#{word}#"
+            terms += [(padded[i:i + 3], 0.3) for i in range(len(padded) - 2)]
+
+        features = {}
+        for term, weight in terms:
+            dim = zlib.crc32(term.encode('utf-8')) % FAQ_VECTOR_DIM
+            features[dim] = features.get(dim, 0.0) + weight
+        return features
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def search(self, question: str, top_k: int = 3) -> List[Tuple[float, Dict[str, Any]]]:
+        """Best matching entries with their similarity, scoring each entry by its closest phrasing"""
+        if not self.entries:
+            return []
+        query = np.zeros(FAQ_VECTOR_DIM, dtype=np.float32)
+        for dim, weight in self.features(question).items():
+            query[dim] += weight
+        query = self.normalize(query * self.idf)
+
+        scores = np.maximum.reduceat(self.matrix @ query, self.offsets)
+        best = np.argsort(-scores)[:top_k]
+        return [(float(scores[i]), self.entries[i]) for i in best]
+
+faq_index = None
+faq_index_loaded = False
+
+def get_faq_index() -> Optional[FAQIndex]:
+    """Build the FAQ index on first use; None if the corpus is disabled or unreadable"""
+    global faq_index, faq_index_loaded
+    if not faq_index_loaded:
+        faq_index_loaded = True
+        if FAQ_PATH:
+            try:
+                with open(FAQ_PATH, encoding='utf-8') as f:
+                    faq_index = FAQIndex(json.load(f))
+                print(f"✅ FAQ index built from {len(faq_index.entries)} curated answers")
+            except Exception as e:
+                print(f"⚠️  FAQ index unavailable: {e}")
+    return faq_index
+
+def match_faq(question: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """The curated entry answering a question outright, or else the entries worth giving GPT-4o as context"""
+    index = get_faq_index()
+    if index is None:
+        return None, []
+    results = index.search(question, FAQ_CONTEXT_PASSAGES)
+    if results and results[0][0] >= FAQ_MATCH_THRESHOLD:
+        return results[0][1], []
+    return None, [entry for score, entry in results if score >= FAQ_CONTEXT_THRESHOLD]
+
+async def find_stored_answer(question_key: str) -> Optional[str]:
+    """Most recent answer to the same question saved in db.questions within the cache TTL"""
+    if db is None or not QUESTION_CACHE_PERSIST:
+        return None
+    cutoff = datetime.utcnow() - timedelta(seconds=QUESTION_CACHE_TTL_SECONDS)
+    doc = await db.questions.find_one(
+        {"question_key": question_key, "timestamp": {"$gte": cutoff}},
+        projection={"answer": 1},
+        sort=[("timestamp", -1)]
+    )
+    return doc["answer"] if doc else None
+
+async def lookup_stored_answer(question_key: str) -> Optional[str]:
+    try:
+        stored = await find_stored_answer(question_key)
+    except Exception as e:
+        print(f"Stored answer lookup failed: {e}")
+        return None
+    if stored:
+        question_cache.set(question_key, stored)
+    return stored
+
+async def fetch_answer(question_key: str, question: str, passages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Answer from the database layer, or from GPT-4o through the question graph"""
+    stored = await lookup_stored_answer(question_key)
+    if stored:
+        return {"answer": stored, "source": "database"}
+
+    result = await get_agent().ainvoke({
+        "messages": [{"role": "user", "content": question}],
+        "image_path": None,
+        "yolo_results": None,
+        "gpt_analysis": None,
+        "faq_passages": passages,
+        "next_action": "question_answer"
+    })
+    gpt_analysis = result.get("gpt_analysis") or {}
+    answer = gpt_analysis.get("analysis")
+    if not answer or gpt_analysis.get("error"):
+        # Apologies and missing answers are never cached
+        return {"answer": answer or "No response available", "source": None}
+    question_cache.set(question_key, answer)
+    return {"answer": answer, "source": "llm"}
+
+async def answer_question(question: str) -> Dict[str, Any]:
+    """Serve a question from the curated FAQ or the cache, or join the upstream call already answering it"""
+    question_key = question_cache_key(question)
+    faq_entry, passages = match_faq(question)
+    if faq_entry:
+        return {"answer": faq_entry["answer"], "source": "faq", "faq_id": faq_entry["id"], "question_key": question_key}
+    cached = question_cache.get(question_key)
+    if cached:
+        return {"answer": cached, "source": "cache", "question_key": question_key}
+
+    task = questions_in_flight.get(question_key)
+    coalesced = task is not None
+    if not coalesced:
+        admit(llm_limiter)
+        task = track_answer(question_key, asyncio.create_task(fetch_answer(question_key, question, passages)))
+
+    # Shielded so one client disconnecting does not cancel the answer for the others
+    return await settle_answer(question_key, task, coalesced)
+
+def track_answer(question_key: str, task: asyncio.Task, answer_stream: "AnswerStream" = None) -> asyncio.Task:
+    """Register an upstream answer so identical questions join it until it finishes"""
+    questions_in_flight[question_key] = task
+    if answer_stream is not None:
+        answer_streams[question_key] = answer_stream
+
+    def untrack(_):
+        questions_in_flight.pop(question_key, None)
+        answer_streams.pop(question_key, None)
+
+    task.add_done_callback(untrack)
+    return task
+
+async def settle_answer(question_key: str, task: asyncio.Task, coalesced: bool) -> Dict[str, Any]:
+    result = await asyncio.shield(task)
+    source = "coalesced" if coalesced and result["source"] else result["source"]
+    return {**result, "source": source, "question_key": question_key}
+
+class AnswerStream:
+    """Tokens of an answer streaming in from AIMLAPI, replayed to clients that join late"""
+
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self._subscribers = []
+
+    def publish(self, delta: str):
+        self.chunks.append(delta)
+        for subscriber in self._subscribers:
+            subscriber.put_nowait(delta)
+
+    def finish(self):
+        self.finished = True
+        for subscriber in self._subscribers:
+            subscriber.put_nowait(None)
+
+    async def stream(self):
+        subscriber = asyncio.Queue()
+        self._subscribers.append(subscriber)
+        try:
+            for delta in list(self.chunks):
+                yield delta
+            if self.finished:
+                return
+            while True:
+                delta = await subscriber.get()
+                if delta is None:
+                    return
+                yield delta
+        finally:
+            self._subscribers.remove(subscriber)
+
+answer_streams: Dict[str, AnswerStream] = {}  # question key -> tokens of the in-flight streamed answer
+question_save_tasks = set()
+
+async def stream_answer(question_key: str, question: str, answer_stream: AnswerStream,
+                        passages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Streaming counterpart of fetch_answer: publishes tokens as they arrive, returns the full answer"""
+    try:
+        stored = await lookup_stored_answer(question_key)
+        if stored:
+            answer_stream.publish(stored)
+            return {"answer": stored, "source": "database"}
+        if not get_ai_client():
+            return {"answer": "No response available", "source": None}
+
+        async for delta in stream_chat_completion(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": question_prompt(question, passages)}],
+            max_tokens=1000
+        ):
+            answer_stream.publish(delta)
+
+        answer = "".join(answer_stream.chunks)
+        if not answer:
+            return {"answer": "No response available", "source": None}
+        question_cache.set(question_key, answer)
+        return {"answer": answer, "source": "llm"}
+    except Exception as e:
+        print(f"Streaming answer failed: {e}")
+        return {"answer": QUESTION_UNAVAILABLE_ANSWER, "source": None, "error": str(e)}
+    finally:
+        answer_stream.finish()
+
+async def save_question(user_id: str, question: str, result: Dict[str, Any]):
+    """Save question to database"""
+    question_doc = {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "question": question,
+        "answer": result["answer"],
+        "timestamp": datetime.utcnow()
+    }
+    if result["source"] == "llm":
+        # Only fresh upstream answers seed the persistent cache layer
+        question_doc["question_key"] = result["question_key"]
+    if result.get("faq_id"):
+        question_doc["faq_id"] = result["faq_id"]
+    await db.questions.insert_one(question_doc)
+
 @app.post("/ask-question")
 async def ask_question(
     request: QuestionRequest,
     current_user = Depends(get_current_user)
 ):
     """Ask text-based questions about eye health"""
+    enforce_quota(question_quota, current_user["_id"])
+    
     try:
-        initial_state = {
-            "messages": [{"role": "user", "content": request.question}],
-            "image_path": None,
-            "yolo_results": None,
-            "gpt_analysis": None,
-            "next_action": "question_answer"
-        }
-        
-        result = await agent.ainvoke(initial_state)
-        
-        # Save question to database
-        question_doc = {
-            "_id": str(uuid.uuid4()),
-            "user_id": current_user["_id"],
-            "question": request.question,
-            "answer": result.get("gpt_analysis", {}).get("analysis", "No response"),
-            "timestamp": datetime.utcnow()
-        }
-        await db.questions.insert_one(question_doc)
+        result = await answer_question(request.question)
+        await save_question(current_user["_id"], request.question, result)
         
         return {
             "status": "success",
-            "answer": result.get("gpt_analysis", {}).get("analysis", "No response available"),
-            "question": request.question
+            "answer": result["answer"],
+            "question": request.question,
+            "source": result["source"],
+            "cached": result["source"] in ("faq", "cache", "database", "coalesced")
         }
     
+    except HTTPException:
+        raise
+    except StageOverloaded as e:
+        raise overloaded_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Question processing failed: {str(e)}")
 
+@app.post("/ask-question/stream")
+async def ask_question_stream(
+    request: QuestionRequest,
+    current_user = Depends(get_current_user)
+):
+    """Server-Sent Events variant of /ask-question: token events as GPT-4o writes the answer,
+    then done (or error) carrying the full answer"""
+    enforce_quota(question_quota, current_user["_id"])
+    
+    question_key = question_cache_key(request.question)
+    faq_entry, passages = match_faq(request.question)
+    if faq_entry:
+        settled = {"answer": faq_entry["answer"], "source": "faq", "faq_id": faq_entry["id"], "question_key": question_key}
+    else:
+        cached = question_cache.get(question_key)
+        settled = {"answer": cached, "source": "cache", "question_key": question_key} if cached else None
+    task, answer_stream, coalesced = None, None, False
+    if settled is None:
+        task = questions_in_flight.get(question_key)
+        answer_stream = answer_streams.get(question_key)
+        coalesced = task is not None
+        if not coalesced:
+            admit(llm_limiter)
+            answer_stream = AnswerStream()
+            task = track_answer(
+                question_key,
+                asyncio.create_task(stream_answer(question_key, request.question, answer_stream, passages)),
+                answer_stream
+            )
+    
+    async def settle():
+        if task is None:
+            result = settled
+        else:
+            result = await settle_answer(question_key, task, coalesced)
+        try:
+            await save_question(current_user["_id"], request.question, result)
+        except Exception as e:
+            print(f"Failed to save question: {e}")
+        return result
+    
+    # Runs on its own so the answer is saved even if the client disconnects mid-stream
+    saved = asyncio.create_task(settle())
+    question_save_tasks.add(saved)
+    saved.add_done_callback(question_save_tasks.discard)
+    
+    async def event_stream():
+        if answer_stream is not None:
+            async for delta in answer_stream.stream():
+                yield f"event: token\ndata: {json.dumps({'content': delta})}\n\n"
+        result = await asyncio.shield(saved)
+        if result["source"] is None:
+            yield f"event: error\ndata: {json.dumps({'detail': result['answer']})}\n\n"
+            return
+        if answer_stream is None:
+            # FAQ or cache hit, or joined a non-streaming request: the whole answer is one token
+            yield f"event: token\ndata: {json.dumps({'content': result['answer']})}\n\n"
+        yield "event: done\ndata: " + json.dumps({
+            "status": "success",
+            "answer": result["answer"],
+            "question": request.question,
+            "source": result["source"],
+            "cached": result["source"] in ("faq", "cache", "database", "coalesced")
+        }) + "\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/doctors")
 async def get_doctors(current_user = Depends(get_current_user)):
     """Get list of available approved doctors from the database"""
@@ -1401,9 +4134,9 @@ async def book_appointment(
             </body>
         </html>
         """
-        asyncio.create_task(send_email(current_user["email"], subject, body, html=True))
+        await enqueue_email(current_user["email"], subject, body, html=True, key=f"appointment-booked:{appointment_id}:patient")
 
-        # Send confirmation email to doctor
+        # Notify the doctor (batched into their next digest)
         doctor_subject = "New Appointment Booked - Eye Health AI"
         doctor_body = f"""
         <html>
@@ -1427,7 +4160,17 @@ async def book_appointment(
             </body>
         </html>
         """
-        asyncio.create_task(send_email(doctor["email"], doctor_subject, doctor_body, html=True))
+        await queue_notification(
+            doctor["email"], f"Dr. {doctor['full_name']}", "appointment_booked",
+            {
+                "appointment_id": appointment_id,
+                "patient_name": request.patient_name,
+                "date": request.preferred_date,
+                "time": request.preferred_time,
+                "status": appointment["status"]
+            },
+            key=f"appointment-booked:{appointment_id}:doctor", subject=doctor_subject, body=doctor_body
+        )
 
         return {
             "status": "success",
@@ -1599,7 +4342,9 @@ async def doctor_signup(
     await db.doctors.insert_one(doctor_doc)
 
     # Send welcome email
-    asyncio.create_task(send_doctor_welcome_email(email, full_name))
+    await send_doctor_welcome_email(email, full_name, key=f"doctor-welcome:{doctor_id}")
+    if ADMIN_NOTIFY_EMAIL:
+        await send_doctor_application_notification(doctor_id, full_name, specialty, email)
 
     # Create access token
     token = create_access_token(doctor_id, email)
@@ -1902,7 +4647,10 @@ async def update_appointment_status(
                     </body>
                 </html>
                 """
-                asyncio.create_task(send_email(patient["email"], subject, body, html=True))
+                await enqueue_email(
+                    patient["email"], subject, body, html=True,
+                    key=f"appointment-status:{appointment_id}:{status_update.status}"
+                )
 
         return {
             "status": "success",
@@ -2104,9 +4852,11 @@ async def update_doctor_status(
 
         # Send notification email
         if request.action == "approve":
-            asyncio.create_task(send_doctor_approval_email(doctor["email"], doctor["full_name"]))
+            await send_doctor_approval_email(doctor["email"], doctor["full_name"], key=f"doctor-approved:{doctor_id}")
         else:
-            asyncio.create_task(send_doctor_rejection_email(doctor["email"], doctor["full_name"], request.notes))
+            await send_doctor_rejection_email(
+                doctor["email"], doctor["full_name"], request.notes, key=f"doctor-rejected:{doctor_id}"
+            )
 
         return {
             "status": "success",
@@ -2217,10 +4967,25 @@ async def download_doctor_document(
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    queued_jobs = None
+    if ANALYSIS_QUEUE == "mongo" and db is not None:
+        queued_jobs = await db.analysis_queue.count_documents({"status": "queued"})
     return {
         "status": "healthy",
         "yolo_model_loaded": yolo_model is not None,
-        "ai_client_available": ai_client is not None,
+        "inference_backend": active_inference_backend,
+        "stages": {limiter.name: limiter.stats() for limiter in (inference_limiter, llm_limiter, render_limiter)},
+        "email": email_worker.stats(),
+        "outbox": await outbox_health(),
+        "comparisons": comparison_stats,
+        "progress_charts": progress_stats,
+        "analysis_cache": analysis_cache.stats(),
+        "question_cache": {**question_cache.stats(), "in_flight": len(questions_in_flight)},
+        "faq_entries": len(faq_index.entries) if faq_index else 0,
+        "analysis_queue": ANALYSIS_QUEUE,
+        "queued_jobs": queued_jobs,
+        "ai_client_available": get_ai_client() is not None,
+        "llm_circuit": llm_breaker.stats(),
         "database_connected": db is not None,
         "email_configured": EMAIL_ADDRESS is not None,
         "timestamp": datetime.utcnow().isoformat()
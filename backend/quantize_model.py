@@ -0,0 +1,143 @@
+"""Build an INT8 ONNX Runtime variant of the conjunctiva segmentation model.
+
+Calibrates static quantization on a local image directory, then reports
+per-class mask IoU and confidence drift against the FP32 PyTorch model:
+
+    python backend/quantize_model.py --images backend/uploads
+
+The report is written next to the INT8 model. With INFERENCE_BACKEND=onnxruntime_int8
+the server only loads the model if that report passes QUANTIZED_MIN_IOU and
+QUANTIZED_MAX_CONF_DRIFT.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+import onnxruntime
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+from ultralytics import YOLO
+
+from main import (
+    INFERENCE_IMGSZ, QUANTIZED_MAX_CONF_DRIFT, QUANTIZED_MAX_EXTRA_RATE, QUANTIZED_MAX_MISSED_RATE,
+    QUANTIZED_MIN_IOU, QUANTIZED_MIN_MATCHED, UPLOAD_DIR,
+    export_model, exported_model_path, file_sha256, load_inference_model, quantization_gate_failures,
+    quantization_report_path
+)
+from check_backend_parity import compare_models, load_images, print_report
+
+def letterbox(image: np.ndarray, imgsz: int) -> np.ndarray:
+    """Resize with unchanged aspect ratio and pad to imgsz x imgsz, as the YOLO predictor does"""
+    height, width = image.shape[:2]
+    scale = imgsz / max(height, width)
+    resized = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top = (imgsz - resized.shape[0]) // 2
+    left = (imgsz - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return canvas
+
+class ImageCalibrationReader(CalibrationDataReader):
+    """Feeds preprocessed calibration images to the ONNX Runtime quantizer"""
+
+    def __init__(self, images, input_name: str, imgsz: int):
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._images = iter(images)
+
+    def get_next(self):
+        item = next(self._images, None)
+        if item is None:
+            return None
+        _, image = item
+        tensor = letterbox(image, self.imgsz)[:, :, ::-1].transpose(2, 0, 1)
+        tensor = np.ascontiguousarray(tensor, dtype=np.float32)[None] / 255.0
+        return {self.input_name: tensor}
+
+def time_model(model, images, imgsz: int) -> float:
+    """Average single-image latency in milliseconds"""
+    model(images[0][1], imgsz=imgsz, verbose=False)  # warm-up
+    start = time.perf_counter()
+    for _, image in images:
+        model(image, imgsz=imgsz, verbose=False)
+    return (time.perf_counter() - start) / len(images) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and validate an INT8 segmentation model")
+    parser.add_argument("--images", default=UPLOAD_DIR, help="Calibration and evaluation image directory")
+    parser.add_argument("--calibration-size", type=int, default=100)
+    parser.add_argument("--min-iou", type=float, default=QUANTIZED_MIN_IOU)
+    parser.add_argument("--max-conf-drift", type=float, default=QUANTIZED_MAX_CONF_DRIFT)
+    parser.add_argument("--min-matched", type=int, default=QUANTIZED_MIN_MATCHED,
+                        help="Matched detections each class needs in the evaluation half")
+    parser.add_argument("--max-missed-rate", type=float, default=QUANTIZED_MAX_MISSED_RATE)
+    parser.add_argument("--max-extra-rate", type=float, default=QUANTIZED_MAX_EXTRA_RATE)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if len(images) < 2:
+        print(f"Need at least 2 images in {args.images} for calibration and evaluation")
+        sys.exit(1)
+
+    # Calibrate and evaluate on disjoint halves so the gate is not measured on calibration data
+    calibration_images = images[::2][:args.calibration_size]
+    evaluation_images = images[1::2]
+
+    fp32_path = export_model("onnxruntime")
+    int8_path = exported_model_path("onnxruntime_int8")
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    print(f"Calibrating on {len(calibration_images)} images from {args.images}...")
+    quantize_static(
+        fp32_path,
+        int8_path,
+        ImageCalibrationReader(calibration_images, input_name, INFERENCE_IMGSZ),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax
+    )
+    print(f"INT8 model saved to {int8_path}")
+
+    fp32_model = load_inference_model("torch")
+    int8_model = YOLO(int8_path, task="segment")
+    report = compare_models(fp32_model, int8_model, evaluation_images)
+    failures = quantization_gate_failures(
+        report, args.min_iou, args.max_conf_drift, args.min_matched, args.max_missed_rate, args.max_extra_rate
+    )
+    passed = not failures
+
+    fp32_ms = time_model(YOLO(fp32_path, task="segment"), evaluation_images, INFERENCE_IMGSZ)
+    int8_ms = time_model(int8_model, evaluation_images, INFERENCE_IMGSZ)
+
+    with open(quantization_report_path(int8_path), "w") as f:
+        json.dump({
+            "model_sha256": file_sha256(int8_path),
+            "created_at": datetime.utcnow().isoformat(),
+            "calibration_images": len(calibration_images),
+            "evaluation_images": len(evaluation_images),
+            "thresholds": {
+                "min_iou": args.min_iou,
+                "max_conf_drift": args.max_conf_drift,
+                "min_matched": args.min_matched,
+                "max_missed_rate": args.max_missed_rate,
+                "max_extra_rate": args.max_extra_rate
+            },
+            "failures": failures,
+            "passed": passed,
+            "latency_ms": {"onnxruntime_fp32": fp32_ms, "onnxruntime_int8": int8_ms},
+            "per_class": report
+        }, f, indent=2)
+
+    print_report(f"INT8 vs FP32 on {len(evaluation_images)} images: {'PASS' if passed else 'FAIL'}", report)
+    for failure in failures:
+        print(f"  ✗ {failure}")
+    print(f"\nLatency: FP32 ONNX {fp32_ms:.1f} ms, INT8 ONNX {int8_ms:.1f} ms ({fp32_ms / int8_ms:.2f}x)")
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Shared fixtures: main.py imported from the backend directory and an in-memory MongoDB.
+
+Run from the project root, like the server itself:
+
+    pip install -r backend/requirements-dev.txt
+    python -m pytest backend/tests
+"""
+import os
+import sys
+
+import pytest
+from mongomock_motor import AsyncCursor, AsyncMongoMockClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(autouse=True)
+def storage(tmp_path, monkeypatch):
+    """Keep uploads and rendered images written by a test in its own temporary directory"""
+    for name in ("UPLOAD_DIR", "OUTPUT_DIR", "COMPARISON_DIR"):
+        path = tmp_path / name.lower()
+        path.mkdir()
+        monkeypatch.setattr(main, name, str(path))
+    return tmp_path
+
+@pytest.fixture
+def db(monkeypatch):
+    """mongomock-motor database patched in as main.db"""
+    original_to_list = AsyncCursor.to_list
+
+    async def to_list(self, length=None):
+        # mongomock-motor ignores the length motor limits the result to
+        documents = await original_to_list(self)
+        return documents if length is None else documents[:length]
+
+    monkeypatch.setattr(AsyncCursor, "to_list", to_list)
+    database = AsyncMongoMockClient().visioncare_ai
+    monkeypatch.setattr(main, "db", database)
+    return database
+
+@pytest.fixture
+def user():
+    return {"_id": "user-1", "email": "patient@example.com", "full_name": "Test Patient"}
+
+@pytest.fixture
+def client(db, user, monkeypatch):
+    """TestClient signed in as `user`, without the startup hooks that connect to MongoDB and load models"""
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main.app.router, "on_startup", [])
+    monkeypatch.setattr(main.app.router, "on_shutdown", [])
+    main.app.dependency_overrides[main.get_current_user] = lambda: user
+    with TestClient(main.app) as test_client:
+        yield test_client
+    main.app.dependency_overrides.clear()
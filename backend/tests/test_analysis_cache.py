@@ -0,0 +1,39 @@
+import main
+
+def test_cache_key_is_scoped_to_user():
+    content = b"same photo bytes"
+    assert main.analysis_cache_key("user-1", content, None) == main.analysis_cache_key("user-1", content, None)
+    assert main.analysis_cache_key("user-1", content, None) != main.analysis_cache_key("user-2", content, None)
+    assert main.analysis_cache_key("user-1", content, None) != main.analysis_cache_key("user-1", content, "itchy")
+
+def test_same_upload_from_another_user_misses_cache(storage, monkeypatch):
+    monkeypatch.setattr(main, "analysis_cache", main.TTLCache(8, 60))
+    image_path = storage / "upload_dir" / "eye.jpg"
+    image_path.write_bytes(b"jpeg")
+    content = b"same photo bytes"
+    main.analysis_cache.set(main.analysis_cache_key("user-1", content, None), {
+        "image_path": str(image_path), "yolo_results": {"detection_path": None}, "gpt_analysis": {}
+    })
+
+    assert main.get_cached_analysis(main.analysis_cache_key("user-1", content, None)) is not None
+    assert main.get_cached_analysis(main.analysis_cache_key("user-2", content, None)) is None
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = main.TTLCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    cache = main.TTLCache(max_entries=2, ttl_seconds=10)
+    cache.set("a", 1)
+    now[0] += 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 1
@@ -0,0 +1,48 @@
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def graph(monkeypatch):
+    """The real workflow wiring with the model, LLM and rendering stages stubbed out"""
+    async def no_update(state):
+        return {}
+
+    for name in ("process_image_node", "render_overlay_node", "gpt_analysis_node", "compare_node"):
+        monkeypatch.setattr(main, name, no_update)
+    sent = []
+
+    async def record_email(email, name, analysis, analysis_id, key=None):
+        sent.append(analysis_id)
+
+    monkeypatch.setattr(main, "send_analysis_result_email", record_email)
+    monkeypatch.setattr(main, "agent", None)
+    return main.get_agent(), sent
+
+def initial_state(user):
+    return {"user": user, "image_path": "eye.jpg", "analysis_id": "a1", "messages": []}
+
+async def test_notify_runs_after_persist(graph, user, monkeypatch):
+    agent, sent = graph
+    saved = []
+
+    async def save(*args):
+        assert not sent, "email queued before the analysis was saved"
+        saved.append(args[1])
+
+    monkeypatch.setattr(main, "save_analysis", save)
+    await agent.ainvoke(initial_state(user))
+    assert saved == ["a1"] and sent == ["a1"]
+
+async def test_failed_save_sends_no_email(graph, user, monkeypatch):
+    agent, sent = graph
+
+    async def failing_save(*args):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(main, "save_analysis", failing_save)
+    with pytest.raises(RuntimeError):
+        await agent.ainvoke(initial_state(user))
+    assert sent == []
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import main
+
+@pytest.fixture
+def gpt_gate(monkeypatch):
+    """Pipeline with the model stubbed out and GPT-4o held until the gate is set"""
+    gate = threading.Event()
+
+    async def run_detection(image_path, image=None):
+        return [], None
+
+    async def analyze_with_gpt_vision(*args):
+        while not gate.is_set():
+            await asyncio.sleep(0.01)
+        return {"condition": "Healthy", "severity": "Normal"}
+
+    monkeypatch.setattr(main, "run_detection", run_detection)
+    monkeypatch.setattr(main, "save_detection_overlay", lambda *args: None)
+    monkeypatch.setattr(main, "analyze_with_gpt_vision", analyze_with_gpt_vision)
+    monkeypatch.setattr(main, "agent", None)
+    monkeypatch.setattr(main, "analysis_jobs", {})
+    monkeypatch.setattr(main, "active_analysis_jobs", {})
+    return gate
+
+def upload(client):
+    content = cv2.imencode(".jpg", np.full((40, 60, 3), 128, dtype=np.uint8))[1].tobytes()
+    return client.post("/analyze-image?job=true", files={"file": ("eye.jpg", content, "image/jpeg")})
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def sse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def test_job_streams_the_overlay_before_gpt_finishes(client, db, gpt_gate):
+    response = upload(client)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert response.json()["events_url"] == f"/analysis-jobs/{job_id}/events"
+
+    job = main.analysis_jobs[job_id]
+    wait_for(lambda: "detection" in [entry["event"] for entry in job.events])
+    assert [entry["event"] for entry in job.events if entry["event"] in ("gpt_analysis", "complete")] == []
+
+    # Re-uploading the photo while it runs re-attaches to the same job
+    duplicate = upload(client)
+    assert duplicate.status_code == 202 and duplicate.json()["job_id"] == job_id
+    assert len(main.analysis_jobs) == 1
+
+    gpt_gate.set()
+    wait_for(lambda: job.done)
+    assert main.active_analysis_jobs == {}
+
+    # A subscriber arriving after the job finished gets every event replayed in order
+    events = sse_events(client.get(f"/analysis-jobs/{job_id}/events").text)
+    names = [name for name, _ in events]
+    assert names[0] == "started" and names[-1] == "complete"
+    assert names.index("detection") < names.index("gpt_analysis") < names.index("complete")
+    assert events[-1][1]["analysis_id"] == job_id and events[-1][1]["gpt_analysis"]["condition"] == "Healthy"
+
+    status = client.get(f"/analysis-jobs/{job_id}").json()["job"]
+    assert status["status"] == "completed" and status["stages"] == names
+
+@pytest.mark.anyio
+async def test_subscriber_joining_mid_run_gets_past_and_live_events():
+    job = main.AnalysisJob("j1", "user-1", "user-1:key")
+    job.publish("started", {"job_id": "j1"})
+    job.publish("detection", {"detections": []})
+
+    received = []
+
+    async def follow():
+        async for entry in job.stream():
+            received.append(entry["event"])
+
+    follower = asyncio.create_task(follow())
+    await asyncio.sleep(0)
+    job.publish("gpt_analysis", {})
+    job.publish("complete", {})
+    await asyncio.wait_for(follower, 1)
+    assert received == ["started", "detection", "gpt_analysis", "complete"]
@@ -0,0 +1,25 @@
+import time
+
+import cv2
+import numpy as np
+
+import main
+
+def jpeg_bytes():
+    return cv2.imencode(".jpg", np.full((40, 60, 3), 128, dtype=np.uint8))[1].tobytes()
+
+def test_synchronous_queued_request_returns_job_at_deadline(client, db, monkeypatch):
+    monkeypatch.setattr(main, "ANALYSIS_QUEUE", "mongo")
+    monkeypatch.setattr(main, "ANALYSIS_DEADLINE_SECONDS", 0.3)
+    monkeypatch.setattr(main, "JOB_POLL_INTERVAL", 0.05)
+
+    start = time.monotonic()
+    response = client.post("/analyze-image", files={"file": ("eye.jpg", jpeg_bytes(), "image/jpeg")})
+    elapsed = time.monotonic() - start
+
+    assert response.status_code == 202
+    assert elapsed < main.JOB_WAIT_SECONDS / 10
+    job_id = response.json()["job_id"]
+    job_doc = client.portal.call(lambda: db.analysis_queue.find_one({"_id": job_id}))
+    assert job_doc["status"] == "queued"
+    assert job_doc["payload"]["deadline"] is None
@@ -0,0 +1,83 @@
+import pytest
+
+import main
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = main.CircuitBreaker(failure_threshold=3, slow_call_seconds=5, reset_seconds=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.short_circuit()
+
+def test_success_resets_failure_count(clock):
+    breaker = main.CircuitBreaker(failure_threshold=2, slow_call_seconds=5, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+def test_slow_success_counts_as_failure(clock):
+    breaker = main.CircuitBreaker(failure_threshold=1, slow_call_seconds=5, reset_seconds=30)
+    breaker.record_success(6)
+    assert breaker.state == "open"
+
+def test_half_open_allows_a_single_probe(clock):
+    breaker = main.CircuitBreaker(failure_threshold=1, slow_call_seconds=5, reset_seconds=30)
+    breaker.record_failure()
+    clock[0] += 31
+
+    assert not breaker.short_circuit()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert breaker.short_circuit()
+    assert not breaker.allow()
+
+    breaker.record_success(0.1)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+def test_failed_probe_reopens(clock):
+    breaker = main.CircuitBreaker(failure_threshold=1, slow_call_seconds=5, reset_seconds=30)
+    breaker.record_failure()
+    clock[0] += 31
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.short_circuit()
+
+def test_abandoned_probe_is_released(clock):
+    breaker = main.CircuitBreaker(failure_threshold=1, slow_call_seconds=5, reset_seconds=30)
+    breaker.record_failure()
+    clock[0] += 31
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+@pytest.mark.anyio
+async def test_open_circuit_fails_before_taking_an_llm_slot(monkeypatch):
+    breaker = main.CircuitBreaker(failure_threshold=1, slow_call_seconds=5, reset_seconds=30)
+    breaker.record_failure()
+    monkeypatch.setattr(main, "llm_breaker", breaker)
+    monkeypatch.setattr(main, "get_ai_client", lambda: object())
+
+    def no_slot():
+        raise AssertionError("queued for an LLM slot while the circuit is open")
+
+    monkeypatch.setattr(main.llm_limiter, "slot", no_slot)
+    with pytest.raises(main.CircuitOpen):
+        await main.create_chat_completion(model="gpt-4o", messages=[])
+    with pytest.raises(main.CircuitOpen):
+        async for _ in main.stream_chat_completion(model="gpt-4o", messages=[]):
+            pass
@@ -0,0 +1,64 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def analyses(db, user, monkeypatch):
+    monkeypatch.setattr(main, "comparison_stats", {"hits": 0, "renders": 0})
+    monkeypatch.setattr(main, "comparisons_in_flight", {})
+    docs = []
+    for index in range(2):
+        path = os.path.join(main.UPLOAD_DIR, f"eye{index}.jpg")
+        cv2.imwrite(path, np.full((40, 60, 3), 80 * index, dtype=np.uint8))
+        docs.append({"_id": f"a{index}", "image_path": path, "timestamp": datetime.utcnow() - timedelta(days=2 - index)})
+    return docs
+
+async def test_pair_is_rendered_once_and_then_served_from_the_index(db, user, analyses):
+    previous, current = analyses
+    first = await main.get_comparison_image(user["_id"], previous, current)
+    second = await main.get_comparison_image(user["_id"], previous, current)
+
+    assert first == second == main.comparison_image_path("a0", "a1")
+    assert cv2.imread(first).shape == (40, 120, 3)
+    assert main.comparison_stats == {"hits": 1, "renders": 1}
+    assert await db.comparisons.count_documents({"_id": "a0:a1", "user_id": user["_id"]}) == 1
+
+async def test_concurrent_requests_share_one_render(user, analyses):
+    previous, current = analyses
+    paths = await asyncio.gather(*[main.get_comparison_image(user["_id"], previous, current) for _ in range(3)])
+    assert len(set(paths)) == 1
+    assert main.comparison_stats["renders"] == 1
+    assert main.comparisons_in_flight == {}
+
+async def test_missing_file_is_rendered_again(user, analyses):
+    previous, current = analyses
+    os.remove(await main.get_comparison_image(user["_id"], previous, current))
+    assert os.path.exists(await main.get_comparison_image(user["_id"], previous, current))
+    assert main.comparison_stats["renders"] == 2
+
+async def test_index_is_scoped_to_the_user(user, analyses):
+    previous, current = analyses
+    await main.get_comparison_image(user["_id"], previous, current)
+    await main.get_comparison_image("someone-else", previous, current)
+    assert main.comparison_stats == {"hits": 0, "renders": 2}
+
+async def test_compare_any_two_accepts_either_order(client, db, user, analyses):
+    for doc in analyses:
+        await db.analyses.insert_one({**doc, "user_id": user["_id"]})
+
+    forward = client.get("/comparison/a0/a1")
+    backward = client.get("/comparison/a1/a0")
+    assert forward.status_code == backward.status_code == 200
+    assert forward.content == backward.content
+    assert main.comparison_stats["renders"] == 1
+
+    assert client.get("/comparison/a0/a0").status_code == 400
+    assert client.get("/comparison/a0/missing").status_code == 404
@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import main
+
+def jpeg_with_orientation(orientation):
+    """60x40 photo whose left third is red, stored with the given EXIF orientation"""
+    pixels = np.zeros((40, 60, 3), dtype=np.uint8)
+    pixels[:, :20] = (255, 0, 0)
+    exif = Image.Exif()
+    exif[main.EXIF_ORIENTATION_TAG] = orientation
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", exif=exif, quality=95)
+    return buffer.getvalue()
+
+def test_exif_orientation_is_applied():
+    image = main.decode_image(jpeg_with_orientation(6))
+    # Orientation 6 is displayed rotated 90° clockwise: the red left edge ends up on top (BGR)
+    assert image.shape == (60, 40, 3)
+    assert image[:20, :, 2].mean() > 200 and image[:20, :, 0].mean() < 50
+    assert image[-20:, :, 2].mean() < 50
+
+def test_upright_photo_is_unchanged():
+    assert main.decode_image(jpeg_with_orientation(1)).shape == (40, 60, 3)
+
+def test_undecodable_upload_is_rejected_with_400(client):
+    response = client.post("/analyze-image", files={"file": ("eye.jpg", b"not an image", "image/jpeg")})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Could not decode image"
+
+@pytest.mark.anyio
+async def test_one_decoded_array_is_shared_by_every_stage(db, user, monkeypatch):
+    seen = {}
+
+    async def run_detection(image_path, image=None):
+        seen["detection"] = image
+        return [], None
+
+    def save_detection_overlay(image_path, image=None, overlay=None):
+        seen["overlay"] = image
+        return None
+
+    def prepare_vision_payload(image, image_bytes, detections):
+        seen["payload"] = image
+        return image_bytes, "image/jpeg", None
+
+    async def analyze_with_gpt_vision(*args):
+        return {"condition": "Healthy", "severity": "Normal"}
+
+    async def create_comparison_image(user_id, analysis_id, image_path, current_img=None):
+        seen["comparison"] = current_img
+        return None
+
+    for name, stub in [("run_detection", run_detection), ("save_detection_overlay", save_detection_overlay),
+                       ("prepare_vision_payload", prepare_vision_payload),
+                       ("analyze_with_gpt_vision", analyze_with_gpt_vision),
+                       ("create_comparison_image", create_comparison_image)]:
+        monkeypatch.setattr(main, name, stub)
+    monkeypatch.setattr(main, "agent", None)
+
+    content = jpeg_with_orientation(6)
+    cache_key = main.analysis_cache_key(user["_id"], content, None)
+    await main.run_analysis(user, "a1", content, "eye.jpg", None, cache_key)
+
+    assert set(seen) == {"detection", "overlay", "payload", "comparison"}
+    image = seen["detection"]
+    assert isinstance(image, np.ndarray) and image.shape == (60, 40, 3)
+    assert all(value is image for value in seen.values())
@@ -0,0 +1,12 @@
+import main
+
+def test_process_workers_run_images_unbatched(monkeypatch):
+    monkeypatch.setattr(main, "MODEL_WARMUP", False)
+    monkeypatch.setattr(main.yolo_batcher, "max_batch_size", 8)
+    main.init_detection_process()
+    assert main.yolo_batcher.max_batch_size == 1
+
+    calls = []
+    batcher = main.InferenceBatcher(lambda images: calls.append(len(images)) or images, max_batch_size=1)
+    assert batcher.submit("image").result(1) == "image"
+    assert calls == [1] and batcher._thread is None
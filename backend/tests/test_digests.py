@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture(autouse=True)
+def digest_settings(monkeypatch):
+    monkeypatch.setattr(main, "DIGEST_WINDOW_SECONDS", 900)
+    monkeypatch.setattr(main, "DIGEST_MAX_ITEMS", 200)
+    monkeypatch.setattr(main, "digest_stats", {"digests": 0, "notifications": 0})
+
+async def booking(recipient, index, minutes_ago, name="Dr. Lee"):
+    key = f"booking:{recipient}:{index}"
+    await main.queue_notification(
+        recipient, name, "appointment_booked",
+        {"appointment_id": f"ap{index}", "patient_name": f"<Patient {index}>", "date": "2026-10-20",
+         "time": "10:00", "status": "pending"},
+        key=key, subject="New appointment", body="standalone"
+    )
+    await main.db.notifications.update_one(
+        {"_id": key}, {"$set": {"created_at": datetime.utcnow() - timedelta(minutes=minutes_ago)}}
+    )
+
+async def test_due_notifications_become_one_digest_per_recipient(db):
+    for index in range(3):
+        await booking("lee@example.com", index, minutes_ago=20 - index)
+    await booking("kim@example.com", 9, minutes_ago=1, name="Dr. Kim")
+
+    await main.flush_digests()
+
+    emails = await db.outbox.find({}).to_list(None)
+    assert len(emails) == 1
+    digest = emails[0]
+    assert digest["to"] == "lee@example.com"
+    assert digest["_id"] == "digest:booking:lee@example.com:0"
+    assert "3 new notifications" in digest["subject"]
+    assert "&lt;Patient 2&gt;" in digest["body"] and "<Patient 2>" not in digest["body"]
+
+    # Kim's window is not up yet
+    assert await db.notifications.count_documents({"recipient": "kim@example.com", "digest_id": None}) == 1
+    assert await db.notifications.count_documents({"recipient": "lee@example.com", "digest_id": None}) == 0
+    assert main.digest_stats == {"digests": 1, "notifications": 3}
+
+async def test_flush_is_idempotent(db):
+    await booking("lee@example.com", 0, minutes_ago=20)
+    await main.flush_digests()
+    await main.flush_digests()
+    assert await db.outbox.count_documents({}) == 1
+
+async def test_duplicate_notification_is_queued_once(db):
+    await booking("lee@example.com", 0, minutes_ago=20)
+    await booking("lee@example.com", 0, minutes_ago=20)
+    assert await db.notifications.count_documents({}) == 1
+
+async def test_urgent_events_skip_the_digest(db):
+    await main.queue_notification(
+        "lee@example.com", "Dr. Lee", "doctor_decision", {"decision": "approved"},
+        key="doctor-approved:d1", subject="Approved", body="standalone"
+    )
+    assert await db.notifications.count_documents({}) == 0
+    email = await db.outbox.find_one({"_id": "doctor-approved:d1"})
+    assert email["subject"] == "Approved"
+
+async def test_digest_is_capped(db, monkeypatch):
+    monkeypatch.setattr(main, "DIGEST_MAX_ITEMS", 2)
+    for index in range(3):
+        await booking("lee@example.com", index, minutes_ago=20 - index)
+
+    await main.flush_digests()
+    assert await db.notifications.count_documents({"digest_id": None}) == 1
+    await main.flush_digests()
+    assert await db.outbox.count_documents({}) == 2
@@ -0,0 +1,113 @@
+import time
+from email.mime.multipart import MIMEMultipart
+
+import pytest
+
+import main
+
+class FakeSMTP:
+    """Stand-in for smtplib.SMTP/SMTP_SSL that records connections and messages"""
+
+    connects = []  # ports in the order connections were attempted
+    refused_ports = set()
+    send_delay = 0.0
+
+    def __init__(self, host, port, timeout=None):
+        FakeSMTP.connects.append(port)
+        if port in FakeSMTP.refused_ports:
+            raise ConnectionRefusedError()
+        self.port = port
+        self.sent = []
+        self.closed = False
+        connections.append(self)
+
+    def set_debuglevel(self, level):
+        pass
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def send_message(self, msg):
+        time.sleep(FakeSMTP.send_delay)
+        self.sent.append(msg["To"])
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+connections = []
+
+@pytest.fixture(autouse=True)
+def fake_smtp(monkeypatch):
+    connections.clear()
+    FakeSMTP.connects = []
+    FakeSMTP.refused_ports = set()
+    FakeSMTP.send_delay = 0.0
+    monkeypatch.setattr(main.smtplib, "SMTP", FakeSMTP)
+    monkeypatch.setattr(main.smtplib, "SMTP_SSL", FakeSMTP)
+
+def message(to_email):
+    msg = MIMEMultipart("alternative")
+    msg["To"] = to_email
+    msg["Subject"] = "Hello"
+    return msg
+
+def send(worker, count):
+    futures = [worker.submit(message(f"p{index}@example.com"), f"p{index}@example.com") for index in range(count)]
+    return [future.result(5) for future in futures]
+
+def test_one_connection_carries_several_messages():
+    worker = main.EmailWorker(workers=1, queue_size=10)
+    try:
+        assert send(worker, 3) == [None, None, None]
+    finally:
+        worker.stop(5)
+    assert len(connections) == 1
+    assert connections[0].sent == ["p0@example.com", "p1@example.com", "p2@example.com"]
+    assert worker.stats()["sent"] == 3
+
+def test_failover_prefers_the_provider_that_worked():
+    FakeSMTP.refused_ports = {465}
+    worker = main.EmailWorker(workers=1, queue_size=10, idle_seconds=0.05)
+    try:
+        assert send(worker, 1) == [None]
+        assert main.SMTP_PROVIDERS[worker.preferred]["name"] == "Gmail TLS"
+
+        # After the idle connection is dropped, the next email goes straight to the working provider
+        time.sleep(0.2)
+        assert send(worker, 1) == [None]
+    finally:
+        worker.stop(5)
+    assert FakeSMTP.connects == [465, 587, 587]
+
+def test_all_providers_down_reports_why():
+    FakeSMTP.refused_ports = {465, 587}
+    worker = main.EmailWorker(workers=1, queue_size=10)
+    try:
+        [error] = send(worker, 1)
+    finally:
+        worker.stop(5)
+    assert error.startswith("All SMTP providers failed")
+    assert "Gmail SSL: connection refused" in error and "Outlook TLS: connection refused" in error
+    assert worker.stats()["failed"] == 1
+
+def test_stop_drains_queued_messages_before_closing():
+    FakeSMTP.send_delay = 0.02
+    worker = main.EmailWorker(workers=2, queue_size=10)
+    futures = [worker.submit(message(f"p{index}@example.com"), f"p{index}@example.com") for index in range(6)]
+    worker.stop(5)
+
+    assert all(future.done() and future.result() is None for future in futures)
+    assert sorted(to for connection in connections for to in connection.sent) == sorted(
+        f"p{index}@example.com" for index in range(6)
+    )
+    assert connections and all(connection.closed for connection in connections)
+    assert worker.submit(message("late@example.com"), "late@example.com") is None
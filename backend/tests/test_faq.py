@@ -0,0 +1,34 @@
+import json
+import os
+
+import pytest
+
+import main
+
+@pytest.fixture(scope="module")
+def faq_entries():
+    with open(main.FAQ_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+@pytest.fixture(scope="module")
+def index(faq_entries):
+    return main.FAQIndex(faq_entries)
+
+def test_default_path_is_next_to_main():
+    assert os.path.dirname(main.FAQ_PATH) == os.path.dirname(os.path.abspath(main.__file__))
+
+def test_every_curated_question_finds_its_own_entry(index, faq_entries):
+    for entry in faq_entries:
+        for question in entry["questions"]:
+            score, best = index.search(question, 1)[0]
+            assert best["id"] == entry["id"], question
+            assert score >= main.FAQ_MATCH_THRESHOLD
+
+def test_unrelated_question_does_not_match(index):
+    results = index.search("How do I reset my password for the billing portal?", 3)
+    assert not results or results[0][0] < main.FAQ_MATCH_THRESHOLD
+
+def test_version_changes_with_the_corpus(faq_entries):
+    edited = [dict(entry) for entry in faq_entries]
+    edited[0]["answer"] += " Updated."
+    assert main.FAQIndex(edited).version != main.FAQIndex(faq_entries).version
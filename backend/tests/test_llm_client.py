@@ -0,0 +1,117 @@
+import asyncio
+import socket
+import threading
+import time
+
+import openai
+import pytest
+import uvicorn
+
+import aimlapi_stub
+import main
+
+pytestmark = pytest.mark.anyio
+
+class InFlight:
+    """ASGI wrapper around the stub that records the peak number of requests being answered at once"""
+
+    def __init__(self, app):
+        self.app = app
+        self.current = 0
+        self.peak = 0
+        self.requests = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        self.current += 1
+        self.requests += 1
+        self.peak = max(self.peak, self.current)
+        answered = False
+
+        async def counted_send(message):
+            nonlocal answered
+            if message["type"] == "http.response.start" and not answered:
+                # The client may start its next call as soon as it has this response
+                answered = True
+                self.current -= 1
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counted_send)
+        finally:
+            if not answered:
+                self.current -= 1
+
+@pytest.fixture(scope="module")
+def stub_server():
+    """aimlapi_stub served over real HTTP, so client timeouts and connection pooling apply"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    app = InFlight(aimlapi_stub.app)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield app, f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(5)
+
+@pytest.fixture
+async def stub(stub_server, monkeypatch):
+    app, base_url = stub_server
+    deadline = time.monotonic() + 5
+    while app.current and time.monotonic() < deadline:
+        time.sleep(0.05)  # a request abandoned by an earlier test is still being answered
+    app.peak = app.requests = 0
+    monkeypatch.setattr(aimlapi_stub, "STUB_LATENCY_MS", 0)
+    monkeypatch.setattr(aimlapi_stub, "STUB_LATENCY_JITTER_MS", 0)
+    monkeypatch.setattr(aimlapi_stub, "STUB_FAILURE_RATE", 0.0)
+    client = openai.AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0)
+    monkeypatch.setattr(main, "ai_client", client)
+    monkeypatch.setattr(main, "LLM_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(main, "llm_breaker", main.CircuitBreaker(5, 20, 30))
+    monkeypatch.setattr(main, "llm_limiter", main.StageLimiter("llm", 8, 32))
+    yield app
+    await client.close()  # its pooled connections belong to this test's event loop
+
+def failures(monkeypatch, count):
+    """Make the stub answer the next `count` requests with 503"""
+    rolls = iter([0.0] * count)
+    monkeypatch.setattr(aimlapi_stub, "STUB_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(aimlapi_stub.random, "random", lambda: next(rolls, 1.0))
+
+async def ask():
+    response = await main.create_chat_completion(model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+    return response.choices[0].message.content
+
+async def test_503_is_retried_then_succeeds(stub, monkeypatch):
+    failures(monkeypatch, 2)
+    assert await ask() == aimlapi_stub.TEXT_ANSWER
+    assert stub.requests == 3
+
+async def test_retries_are_bounded(stub, monkeypatch):
+    monkeypatch.setattr(main, "LLM_MAX_RETRIES", 1)
+    failures(monkeypatch, 5)
+    with pytest.raises(openai.InternalServerError):
+        await ask()
+    assert stub.requests == 2
+
+async def test_slow_call_times_out_within_the_timeout(stub, monkeypatch):
+    monkeypatch.setattr(main, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(aimlapi_stub, "STUB_LATENCY_MS", 1500)
+    start = time.monotonic()
+    with pytest.raises(openai.APITimeoutError):
+        await main.create_chat_completion(
+            timeout=0.3, model="gpt-4o", messages=[{"role": "user", "content": "hi"}]
+        )
+    assert time.monotonic() - start < 1.0
+
+async def test_calls_over_the_cap_wait_for_a_slot(stub, monkeypatch):
+    monkeypatch.setattr(main, "llm_limiter", main.StageLimiter("llm", 2, 32))
+    monkeypatch.setattr(aimlapi_stub, "STUB_LATENCY_MS", 100)
+    answers = await asyncio.gather(*(ask() for _ in range(6)))
+    assert answers == [aimlapi_stub.TEXT_ANSWER] * 6
+    assert stub.requests == 6 and stub.peak == 2
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def outbox_db(db, monkeypatch):
+    """mongomock's bulk_write does not accept current pymongo UpdateOne objects; apply them one by one"""
+    collection_class = type(db.outbox)
+
+    async def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            await self.update_one(request._filter, request._doc)
+
+    monkeypatch.setattr(collection_class, "bulk_write", bulk_write)
+    monkeypatch.setattr(main, "outbox_stats", {"batches": 0, "sent": 0, "retried": 0, "dead": 0, "deferred": 0, "last_batch_ms": None})
+    return db
+
+async def test_enqueue_is_idempotent_per_key(outbox_db):
+    await main.enqueue_email("a@example.com", "Welcome", "Hi", key="welcome:user-1")
+    await main.enqueue_email("a@example.com", "Welcome", "Hi", key="welcome:user-1")
+    assert await outbox_db.outbox.count_documents({}) == 1
+
+async def test_claim_leases_due_emails_in_order(outbox_db, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_BATCH_SIZE", 2)
+    for index in range(3):
+        await main.enqueue_email("a@example.com", f"Email {index}", "body", key=f"email-{index}")
+        await outbox_db.outbox.update_one(
+            {"_id": f"email-{index}"}, {"$set": {"available_at": datetime.utcnow() - timedelta(minutes=3 - index)}}
+        )
+    await main.enqueue_email("a@example.com", "Later", "body", key="later")
+    await outbox_db.outbox.update_one({"_id": "later"}, {"$set": {"available_at": datetime.utcnow() + timedelta(hours=1)}})
+
+    batch = await main.claim_outbox_batch("sender-1")
+    assert [doc["_id"] for doc in batch] == ["email-0", "email-1"]
+    assert all(doc["status"] == "sending" and doc["lease_owner"] == "sender-1" and doc["attempts"] == 1 for doc in batch)
+
+    assert [doc["_id"] for doc in await main.claim_outbox_batch("sender-2")] == ["email-2"]
+    assert await main.claim_outbox_batch("sender-3") == []
+
+async def test_expired_send_lease_is_reclaimed(outbox_db):
+    await main.enqueue_email("a@example.com", "Hi", "body", key="k")
+    await main.claim_outbox_batch("sender-1")
+    assert await main.claim_outbox_batch("sender-2") == []
+
+    await outbox_db.outbox.update_one({"_id": "k"}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    batch = await main.claim_outbox_batch("sender-2")
+    assert batch[0]["lease_owner"] == "sender-2" and batch[0]["attempts"] == 2
+
+async def test_delivery_outcomes(outbox_db, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_MAX_ATTEMPTS", 2)
+    for key in ("ok", "retry", "dead"):
+        await main.enqueue_email(f"{key}@example.com", key, "body", key=key)
+    await outbox_db.outbox.update_one({"_id": "dead"}, {"$set": {"attempts": 1}})
+
+    async def deliver_email(to_email, subject, body, html=False):
+        if to_email == "ok@example.com":
+            return None
+        return f"Recipient refused by Gmail: {to_email}"
+
+    monkeypatch.setattr(main, "deliver_email", deliver_email)
+    await main.deliver_outbox_batch(await main.claim_outbox_batch("sender-1"), "sender-1")
+
+    docs = {doc["_id"]: doc async for doc in outbox_db.outbox.find({})}
+    assert docs["ok"]["status"] == "sent" and docs["ok"]["sent_at"] is not None
+    assert docs["retry"]["status"] == "pending" and docs["retry"]["available_at"] > datetime.utcnow()
+    assert docs["retry"]["last_error"] == "Recipient refused by Gmail: retry@example.com"
+    assert docs["dead"]["status"] == "dead" and docs["dead"]["last_error"].startswith("Recipient refused")
+    assert all("lease_owner" not in doc for doc in docs.values())
+    assert main.outbox_stats["sent"] == 1 and main.outbox_stats["retried"] == 1 and main.outbox_stats["dead"] == 1
+
+async def test_full_smtp_queue_does_not_use_up_an_attempt(outbox_db, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(main, "EMAIL_ADDRESS", "clinic@example.com")
+    monkeypatch.setattr(main, "EMAIL_PASSWORD", "secret")
+    monkeypatch.setattr(main.email_worker, "submit", lambda msg, to_email: None)
+    await main.enqueue_email("a@example.com", "Hi", "body", key="k")
+
+    await main.deliver_outbox_batch(await main.claim_outbox_batch("sender-1"), "sender-1")
+
+    doc = await outbox_db.outbox.find_one({"_id": "k"})
+    assert doc["status"] == "pending" and doc["attempts"] == 0
+    assert "lease_owner" not in doc and "last_error" not in doc
+    assert main.outbox_stats["deferred"] == 1 and main.outbox_stats["dead"] == 0
@@ -0,0 +1,85 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture(autouse=True)
+def progress_state(monkeypatch):
+    monkeypatch.setattr(main, "progress_stats", {"hits": 0, "renders": 0})
+    monkeypatch.setattr(main, "progress_charts_in_flight", {})
+
+def days_ago(days):
+    return datetime.utcnow() - timedelta(days=days)
+
+async def test_series_is_built_from_past_analyses(db, user):
+    await db.analyses.insert_many([
+        {"_id": "a1", "user_id": user["_id"], "timestamp": days_ago(1), "severity": "Severe"},
+        {"_id": "a0", "user_id": user["_id"], "timestamp": days_ago(3), "severity": "Mild"},
+        {"_id": "other", "user_id": "user-2", "timestamp": days_ago(2), "severity": "Normal"},
+    ])
+    series = await main.get_progress_series(user["_id"])
+    assert [p["analysis_id"] for p in series["points"]] == ["a0", "a1"]
+    assert [p["level"] for p in series["points"]] == [1, 3]
+    assert series["version"] == 1
+
+async def test_recorded_points_stay_in_time_order(db, user):
+    await main.get_progress_series(user["_id"])
+    await main.record_progress_point(user["_id"], "late", days_ago(1), "Moderate")
+    await main.record_progress_point(user["_id"], "early", days_ago(5), "Normal")
+
+    series = await main.get_progress_series(user["_id"])
+    assert [p["analysis_id"] for p in series["points"]] == ["early", "late"]
+    assert series["version"] == 3
+
+async def test_retried_save_updates_its_point(db, user):
+    await main.get_progress_series(user["_id"])
+    await main.record_progress_point(user["_id"], "a0", days_ago(1), "Mild")
+    await main.record_progress_point(user["_id"], "a0", days_ago(1), "Severe")
+
+    series = await main.get_progress_series(user["_id"])
+    assert [(p["analysis_id"], p["severity"]) for p in series["points"]] == [("a0", "severe")]
+
+async def test_chart_is_rendered_only_when_the_series_changes(db, user):
+    await main.get_progress_series(user["_id"])
+    await main.record_progress_point(user["_id"], "a0", days_ago(2), "Mild")
+    assert await main.generate_progress_chart(user["_id"]) is None  # one point is not a trend
+
+    await main.record_progress_point(user["_id"], "a1", days_ago(1), "Moderate")
+    first = await main.generate_progress_chart(user["_id"])
+    assert await main.generate_progress_chart(user["_id"]) == first
+    assert main.progress_stats == {"hits": 1, "renders": 1}
+
+    await main.record_progress_point(user["_id"], "a2", days_ago(0), "Normal")
+    second = await main.generate_progress_chart(user["_id"])
+    assert second != first
+    assert main.progress_stats["renders"] == 2
+
+async def test_only_charts_older_than_the_previous_version_are_removed(db, user):
+    await main.get_progress_series(user["_id"])
+    charts = []
+    for index in range(4):
+        await main.record_progress_point(user["_id"], f"a{index}", days_ago(5 - index), "Mild")
+        if index:
+            charts.append(await main.generate_progress_chart(user["_id"]))
+
+    # The previous version is still there for requests that were just handed its path
+    assert [os.path.exists(path) for path in charts] == [False, True, True]
+
+    # A slow render of an old version never removes newer charts
+    main.remove_stale_progress_charts(user["_id"], 2)
+    assert all(os.path.exists(path) for path in charts[1:])
+
+def test_chart_endpoint_renders_again_when_the_file_is_gone(client, db, user):
+    client.portal.call(main.get_progress_series, user["_id"])
+    for index in range(2):
+        client.portal.call(main.record_progress_point, user["_id"], f"a{index}", days_ago(2 - index), "Mild")
+    chart_path = client.portal.call(main.generate_progress_chart, user["_id"])
+    os.remove(chart_path)
+
+    response = client.get("/progress-chart")
+    assert response.status_code == 200 and response.headers["content-type"] == "image/png"
+    assert main.progress_stats["renders"] == 2
@@ -0,0 +1,53 @@
+import json
+
+import main
+
+def class_report(matched=20, missed=0, extra=0, mean_iou=0.95, mean_conf_drift=0.01):
+    return {"matched": matched, "missed": missed, "extra": extra,
+            "mean_iou": mean_iou, "mean_conf_drift": mean_conf_drift, "max_conf_drift": mean_conf_drift}
+
+def passing_report():
+    return {name: class_report() for name in main.CLASS_NAMES}
+
+def test_passing_report_has_no_failures():
+    assert main.quantization_gate_failures(passing_report()) == []
+
+def test_class_without_matches_fails():
+    report = passing_report()
+    report[main.CLASS_NAMES[0]] = class_report(matched=0, mean_iou=None, mean_conf_drift=None)
+    assert main.quantization_gate_failures(report)
+
+    report = {name: class_report(matched=0, mean_iou=None, mean_conf_drift=None) for name in main.CLASS_NAMES}
+    assert len(main.quantization_gate_failures(report)) == len(main.CLASS_NAMES)
+
+def test_missing_class_fails():
+    report = passing_report()
+    del report[main.CLASS_NAMES[-1]]
+    assert main.quantization_gate_failures(report)
+
+def test_too_few_matches_fails():
+    report = passing_report()
+    report[main.CLASS_NAMES[0]] = class_report(matched=main.QUANTIZED_MIN_MATCHED - 1)
+    assert main.quantization_gate_failures(report)
+
+def test_missed_and_extra_detections_are_limited():
+    report = passing_report()
+    report[main.CLASS_NAMES[0]] = class_report(matched=20, missed=5)
+    assert any("missed" in failure for failure in main.quantization_gate_failures(report))
+
+    report = passing_report()
+    report[main.CLASS_NAMES[0]] = class_report(matched=20, extra=5)
+    assert any("extra" in failure for failure in main.quantization_gate_failures(report))
+
+def write_model_and_report(tmp_path, per_class):
+    model_path = tmp_path / "model_int8.onnx"
+    model_path.write_bytes(b"int8 weights")
+    with open(main.quantization_report_path(str(model_path)), "w") as f:
+        json.dump({"model_sha256": main.file_sha256(str(model_path)), "per_class": per_class}, f)
+    return str(model_path)
+
+def test_quantized_model_accepted_uses_gate(tmp_path):
+    assert main.quantized_model_accepted(write_model_and_report(tmp_path, passing_report()))
+
+    empty = {name: class_report(matched=0, mean_iou=None, mean_conf_drift=None) for name in main.CLASS_NAMES}
+    assert not main.quantized_model_accepted(write_model_and_report(tmp_path, empty))
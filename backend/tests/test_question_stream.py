@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+
+QUESTION = "What causes pink eye?"
+
+@pytest.fixture
+def upstream(db, monkeypatch):
+    """AIMLAPI stand-in streaming the given tokens; each waits for its gate when one is set"""
+    tokens = ["Pink eye ", "is usually ", "an infection."]
+    gates = {}
+
+    async def stream_chat_completion(timeout=None, **kwargs):
+        for index, token in enumerate(tokens):
+            if index in gates:
+                await gates[index].wait()
+            yield token
+
+    monkeypatch.setattr(main, "stream_chat_completion", stream_chat_completion)
+    monkeypatch.setattr(main, "get_ai_client", lambda: object())
+    monkeypatch.setattr(main, "match_faq", lambda question: (None, []))
+    monkeypatch.setattr(main, "question_cache", main.TTLCache(16, 60))
+    monkeypatch.setattr(main, "questions_in_flight", {})
+    monkeypatch.setattr(main, "answer_streams", {})
+    return tokens, gates
+
+def sse_events(chunks):
+    events = []
+    for block in "".join(chunks).strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+async def ask(user):
+    return await main.ask_question_stream(main.QuestionRequest(question=QUESTION), current_user=user)
+
+def test_tokens_are_forwarded_in_order(client, upstream):
+    tokens, _ = upstream
+    response = client.post("/ask-question/stream", json={"question": QUESTION})
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = sse_events([response.text])
+    assert events[:-1] == [("token", {"content": token}) for token in tokens]
+    name, done = events[-1]
+    assert name == "done" and done["answer"] == "".join(tokens) and done["source"] == "llm"
+
+@pytest.mark.anyio
+async def test_subscriber_joining_mid_stream_gets_earlier_chunks(user, upstream):
+    tokens, gates = upstream
+    gates[1] = asyncio.Event()
+
+    first = (await ask(user)).body_iterator
+    assert sse_events([await first.__anext__()]) == [("token", {"content": tokens[0]})]
+
+    second = await ask(user)
+    gates[1].set()
+    joined = sse_events([chunk async for chunk in second.body_iterator])
+    assert [data["content"] for name, data in joined if name == "token"] == tokens
+    assert joined[-1][0] == "done" and joined[-1][1]["source"] == "coalesced"
+
+    assert [name for name, _ in sse_events([chunk async for chunk in first])][-1] == "done"
+
+@pytest.mark.anyio
+async def test_answer_is_saved_when_the_client_disconnects(db, user, upstream):
+    tokens, gates = upstream
+    gates[1] = asyncio.Event()
+
+    body = (await ask(user)).body_iterator
+    await body.__anext__()
+    await body.aclose()  # the client went away after the first token
+
+    gates[1].set()
+    await asyncio.gather(*main.question_save_tasks)
+    saved = await db.questions.find_one({"user_id": user["_id"]})
+    assert saved["answer"] == "".join(tokens)
+    assert saved["question_key"] == main.question_cache_key(QUESTION)
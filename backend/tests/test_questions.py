@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def no_faq(monkeypatch):
+    monkeypatch.setattr(main, "match_faq", lambda question: (None, []))
+    monkeypatch.setattr(main, "question_cache", main.TTLCache(16, 60))
+    monkeypatch.setattr(main, "questions_in_flight", {})
+
+def test_trivially_different_phrasings_share_a_key():
+    assert main.normalize_question("  What causes PINK eye?! ") == "what causes pink eye"
+    assert main.question_cache_key("What causes pink eye?") == main.question_cache_key("what causes  pink eye")
+    assert main.question_cache_key("What causes pink eye?") != main.question_cache_key("What causes dry eye?")
+
+async def test_identical_questions_in_flight_share_one_upstream_call(no_faq, monkeypatch):
+    calls = []
+    release = asyncio.Event()
+
+    async def fetch_answer(question_key, question, passages):
+        calls.append(question)
+        await release.wait()
+        return {"answer": "An infection or allergy.", "source": "llm"}
+
+    monkeypatch.setattr(main, "fetch_answer", fetch_answer)
+    pending = [asyncio.create_task(main.answer_question(q)) for q in ("What causes pink eye?", "what causes pink eye")]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*pending)
+
+    assert len(calls) == 1
+    assert sorted(result["source"] for result in results) == ["coalesced", "llm"]
+    assert all(result["answer"] == "An infection or allergy." for result in results)
+    assert main.questions_in_flight == {}
+
+async def test_cached_answer_is_served_without_upstream_call(no_faq, monkeypatch):
+    async def fetch_answer(*args):
+        raise AssertionError("called upstream for a cached answer")
+
+    monkeypatch.setattr(main, "fetch_answer", fetch_answer)
+    main.question_cache.set(main.question_cache_key("What causes pink eye?"), "Cached answer")
+    result = await main.answer_question("what causes pink eye")
+    assert result["source"] == "cache" and result["answer"] == "Cached answer"
+
+async def test_stored_answer_is_read_within_ttl(db, monkeypatch):
+    monkeypatch.setattr(main, "QUESTION_CACHE_PERSIST", True)
+    key = main.question_cache_key("What causes pink eye?")
+    await db.questions.insert_many([
+        {"question_key": key, "answer": "old", "timestamp": datetime.utcnow() - timedelta(seconds=main.QUESTION_CACHE_TTL_SECONDS + 60)},
+        {"question_key": key, "answer": "fresh", "timestamp": datetime.utcnow() - timedelta(minutes=1)},
+    ])
+    assert await main.find_stored_answer(key) == "fresh"
+
+    await db.questions.delete_many({"answer": "fresh"})
+    assert await main.find_stored_answer(key) is None
+
+async def test_faq_match_skips_the_cache_and_llm(monkeypatch):
+    entry = {"id": "pink-eye", "questions": ["What causes pink eye?"], "answer": "Curated answer."}
+    monkeypatch.setattr(main, "match_faq", lambda question: (entry, []))
+    result = await main.answer_question("What causes pink eye?")
+    assert result["source"] == "faq" and result["faq_id"] == "pink-eye"
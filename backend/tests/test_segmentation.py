@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+
+import main
+
+class FakeTensor:
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+class FakeResults:
+    """Just the parts of an ultralytics Results object that extract_segmentation reads"""
+
+    def __init__(self, masks, classes, confidences):
+        self.masks = type("Masks", (), {"data": FakeTensor(masks)})()
+        self.boxes = type("Boxes", (), {"cls": FakeTensor(classes), "conf": FakeTensor(confidences)})()
+
+def letterboxed_result(image_shape, input_shape, box):
+    """Result with one mask covering box (x1, y1, x2, y2 in image pixels), letterboxed like ultralytics does"""
+    height, width = image_shape
+    input_height, input_width = input_shape
+    gain = min(input_height / height, input_width / width)
+    pad_x = (input_width - width * gain) / 2
+    pad_y = (input_height - height * gain) / 2
+    x1, y1, x2, y2 = box
+    mask = np.zeros((1, input_height, input_width), dtype=np.float32)
+    mask[0, round(y1 * gain + pad_y):round(y2 * gain + pad_y), round(x1 * gain + pad_x):round(x2 * gain + pad_x)] = 1
+    return FakeResults(mask, [0], [0.9])
+
+def test_overlay_matches_whether_batched_or_alone():
+    image_shape = (300, 640, 3)
+    box = (100, 60, 260, 200)
+    # Alone the input is only padded to the stride; in a mixed-shape batch it is padded to a square
+    alone = letterboxed_result(image_shape[:2], (320, 640), box)
+    batched = letterboxed_result(image_shape[:2], (640, 640), box)
+
+    alone_info, alone_overlay = main.extract_segmentation(image_shape, alone)
+    batched_info, batched_overlay = main.extract_segmentation(image_shape, batched)
+
+    assert alone_info[0]["bbox"] == batched_info[0]["bbox"] == list(box)
+    assert alone_info[0]["area"] == batched_info[0]["area"]
+    assert alone_overlay["labels"] == batched_overlay["labels"]
+    assert alone_overlay["class_map"].shape == batched_overlay["class_map"].shape == image_shape[:2]
+
+def test_downscaled_input_maps_back_to_image():
+    image_shape = (1200, 1600, 3)
+    box = (400, 300, 800, 900)
+    info, overlay = main.extract_segmentation(image_shape, letterboxed_result(image_shape[:2], (480, 640), box))
+    assert np.allclose(info[0]["bbox"], box, atol=3)
+    cx, cy = overlay["labels"][0][:2]
+    assert abs(cx - 600) <= 3 and abs(cy - 600) <= 3
+
+def test_batcher_groups_images_by_shape():
+    calls = []
+    release = threading.Event()
+
+    def predict(images):
+        release.wait(5)
+        calls.append([image.shape for image in images])
+        return [image.shape for image in images]
+
+    batcher = main.InferenceBatcher(predict, max_batch_size=8, window_ms=200)
+    try:
+        images = [np.zeros(shape, dtype=np.uint8) for shape in [(4, 6, 3), (6, 4, 3), (4, 6, 3), (6, 4, 3)]]
+        futures = [batcher.submit(image) for image in images]
+        release.set()
+        assert [future.result(5) for future in futures] == [image.shape for image in images]
+    finally:
+        batcher.stop()
+
+    assert all(len(set(shapes)) == 1 for shapes in calls)
+    assert sorted(len(shapes) for shapes in calls) == [2, 2]
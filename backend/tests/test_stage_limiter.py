@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+async def test_rejects_once_slots_and_queue_are_full():
+    limiter = main.StageLimiter("test", limit=1, queue_size=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.slot():
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    assert limiter.active == 1 and limiter.waiting == 1
+    assert limiter.saturated
+
+    with pytest.raises(main.StageOverloaded) as overloaded:
+        async with limiter.slot():
+            pass
+    assert overloaded.value.retry_after >= 1
+    assert limiter.rejected == 1
+
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert limiter.active == 0 and limiter.waiting == 0 and not limiter.saturated
+
+async def test_slot_is_released_when_the_stage_fails():
+    limiter = main.StageLimiter("test", limit=1, queue_size=0)
+    with pytest.raises(RuntimeError):
+        async with limiter.slot():
+            raise RuntimeError("stage failed")
+    async with limiter.slot():
+        assert limiter.active == 1
+
+def test_admit_turns_away_saturated_stage():
+    limiter = main.StageLimiter("test", limit=1, queue_size=0)
+    limiter.active = 1
+    with pytest.raises(main.HTTPException) as rejected:
+        main.admit(limiter)
+    assert rejected.value.status_code == 503
+    assert rejected.value.headers["Retry-After"] == "1"
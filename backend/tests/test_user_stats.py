@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 1, 1)
+
+def analysis(analysis_id, day, severity, condition="Conjunctivitis", user_id="user-1"):
+    return {
+        "_id": analysis_id,
+        "user_id": user_id,
+        "image_path": f"{analysis_id}.jpg",
+        "timestamp": START + timedelta(days=day),
+        "severity": severity,
+        "condition": condition,
+        "risk_level": "medium",
+        "follow_up": "1 week"
+    }
+
+async def save(db, doc):
+    """What save_analysis does, with a chosen timestamp"""
+    replaced = await db.analyses.find_one_and_replace(
+        {"_id": doc["_id"]}, doc, projection={"severity": 1, "condition": 1}, upsert=True
+    )
+    await main.update_user_stats(doc, replaced)
+
+async def test_counts_latest_and_trend(db):
+    await save(db, analysis("a1", 0, "Severe"))
+    await save(db, analysis("a2", 1, "Mild", condition="Dry eye"))
+    stats = await main.get_user_stats("user-1")
+
+    assert stats["total_analyses"] == 2
+    assert stats["severity_counts"]["severe"] == 1 and stats["severity_counts"]["mild"] == 1
+    assert sorted((c["name"], c["count"]) for c in stats["conditions"].values()) == [("Conjunctivitis", 1), ("Dry eye", 1)]
+    assert stats["latest"]["id"] == "a2"
+    assert stats["trend"] == "improving"
+    assert stats["latest"]["next_checkup_date"] == START + timedelta(days=8)
+
+async def test_out_of_order_save_does_not_move_latest_back(db):
+    await save(db, analysis("a1", 0, "Normal"))
+    await save(db, analysis("a3", 2, "Moderate"))
+    # a2 was taken before a3 but its save finished later
+    await save(db, analysis("a2", 1, "Severe"))
+    stats = await main.get_user_stats("user-1")
+
+    assert stats["total_analyses"] == 3
+    assert stats["latest"]["id"] == "a3"
+    assert stats["previous_severity"] == "Severe"
+    assert stats["trend"] == "improving"
+
+async def test_analysis_older_than_previous_leaves_trend_alone(db):
+    await save(db, analysis("a2", 1, "Mild"))
+    await save(db, analysis("a3", 2, "Severe"))
+    await save(db, analysis("a1", 0, "Normal"))
+    stats = await main.get_user_stats("user-1")
+
+    assert stats["latest"]["id"] == "a3"
+    assert stats["previous_severity"] == "Mild"
+    assert stats["trend"] == "worsening"
+
+async def test_resave_replaces_earlier_counts(db):
+    await save(db, analysis("a1", 0, "Mild"))
+    await save(db, analysis("a2", 1, "Normal"))
+    await save(db, analysis("a2", 1, "Severe", condition="Dry eye"))
+    stats = await main.get_user_stats("user-1")
+
+    assert stats["total_analyses"] == 2
+    assert stats["severity_counts"]["normal"] == 0 and stats["severity_counts"]["severe"] == 1
+    counts = {c["name"]: c["count"] for c in stats["conditions"].values()}
+    assert counts == {"Conjunctivitis": 1, "Dry eye": 1}
+    assert stats["latest"]["severity"] == "Severe"
+    assert stats["trend"] == "worsening"
+
+async def test_stats_are_backfilled_from_existing_analyses(db):
+    await db.analyses.insert_many([analysis("a1", 0, "Moderate"), analysis("a2", 1, "Moderate")])
+    stats = await main.get_user_stats("user-1")
+
+    assert stats["total_analyses"] == 2
+    assert stats["latest"]["id"] == "a2"
+    assert stats["trend"] == "stable"
+
+    await save(db, analysis("a3", 2, "Normal"))
+    stats = await main.get_user_stats("user-1")
+    assert stats["total_analyses"] == 3
+    assert stats["trend"] == "improving"
+
+async def test_dashboard_reads_materialized_stats(client, db):
+    await save(db, analysis("a1", 0, "Mild"))
+    await save(db, analysis("a2", 1, "Severe"))
+    dashboard = client.get("/progress-dashboard").json()
+
+    assert dashboard["total_analyses"] == 2
+    assert dashboard["latest_analysis"]["id"] == "a2"
+    assert dashboard["trend"] == "worsening"
+    assert dashboard["chart_available"] is True
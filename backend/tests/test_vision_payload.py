@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+
+import main
+
+@pytest.fixture
+def photo():
+    """300x200 noisy photo and its PNG encoding (large, so re-encoding always saves bytes)"""
+    image = np.random.default_rng(0).integers(0, 256, (200, 300, 3), dtype=np.uint8)
+    return image, cv2.imencode(".png", image)[1].tobytes()
+
+def detection(x1, y1, x2, y2):
+    return {"class": "conjunctiva", "confidence": 0.9, "bbox": [x1, y1, x2, y2]}
+
+def test_crop_is_the_union_of_the_masks_plus_the_margin(photo, monkeypatch):
+    monkeypatch.setattr(main, "VISION_CROP_MARGIN", 0.25)
+    image, content = photo
+    payload, mime, stats = main.prepare_vision_payload(
+        image, content, [detection(50, 40, 100, 80), detection(120, 60, 180, 100)]
+    )
+    # Union [50, 40, 180, 100], margins int(130 * 0.25) and int(60 * 0.25)
+    assert stats["crop"] == [18, 25, 212, 115]
+    assert stats["payload_size"] == [194, 90]
+    assert cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR).shape == (90, 194, 3)
+
+def test_crop_is_clamped_to_the_image(photo, monkeypatch):
+    monkeypatch.setattr(main, "VISION_CROP_MARGIN", 0.25)
+    image, content = photo
+    _, _, stats = main.prepare_vision_payload(image, content, [detection(5, 5, 295, 195)])
+    assert stats["crop"] == [0, 0, 300, 200]
+
+def test_longest_edge_is_capped(photo, monkeypatch):
+    monkeypatch.setattr(main, "VISION_MAX_EDGE", 64)
+    image, content = photo
+    payload, _, stats = main.prepare_vision_payload(image, content, [])
+    assert max(stats["payload_size"]) == 64
+    assert cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (43, 64)
+
+def test_mime_type_matches_the_bytes_sent(photo):
+    image, content = photo
+    payload, mime, _ = main.prepare_vision_payload(image, content, [detection(50, 40, 100, 80)])
+    assert mime == "image/jpeg" and payload.startswith(b"\xff\xd8")
+    assert main.sniff_image_mime(content) == "image/png"
+
+def test_no_detections_sends_the_full_frame(photo):
+    image, content = photo
+    _, _, stats = main.prepare_vision_payload(image, content, [])
+    assert stats["crop"] == [0, 0, 300, 200]
+
+def test_original_is_sent_when_re_encoding_does_not_help():
+    image = np.full((40, 60, 3), 128, dtype=np.uint8)
+    content = cv2.imencode(".png", image)[1].tobytes()  # a flat PNG is smaller than any JPEG of it
+    payload, mime, stats = main.prepare_vision_payload(image, content, [])
+    assert payload == content and mime == "image/png" and stats is None
+
+def test_reported_savings(photo):
+    image = cv2.resize(photo[0], (4032, 3024), interpolation=cv2.INTER_NEAREST)
+    content = cv2.imencode(".png", image)[1].tobytes()
+    payload, _, stats = main.prepare_vision_payload(image, content, [detection(1000, 1000, 1400, 1300)])
+
+    assert stats["original_bytes"] == len(content)
+    assert stats["payload_bytes"] == len(payload) < len(content)
+    assert stats["payload_size"] == [520, 390]
+    # The full photo is scaled to 1024x768 by the API (2x2 tiles); the 520x390 crop needs 2x1
+    assert stats["original_tokens"] == 170 * 4 + 85
+    assert stats["payload_tokens"] == 170 * 2 + 85
+
+def test_image_token_estimate():
+    assert main.estimate_image_tokens(512, 384) == 170 + 85
+    assert main.estimate_image_tokens(4032, 3024) == 170 * 4 + 85
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+import pytest
+
+import main
+import worker
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def queue_indexes(db):
+    async def create():
+        await main.ensure_indexes()
+    return create
+
+async def enqueue(user, content=b"jpeg bytes"):
+    cache_key = main.analysis_cache_key(user["_id"], content, None)
+    return await main.enqueue_analysis(user, str(uuid.uuid4()), content, "eye.jpg", None, cache_key)
+
+async def test_duplicate_upload_returns_the_active_job(db, user, queue_indexes):
+    await queue_indexes()
+    first = await enqueue(user)
+    second = await enqueue(user)
+    other = await enqueue(user, content=b"another photo")
+
+    assert second["_id"] == first["_id"]
+    assert other["_id"] != first["_id"]
+    assert await db.analysis_queue.count_documents({}) == 2
+
+async def test_concurrent_duplicate_hits_the_unique_index(db, user, queue_indexes, monkeypatch):
+    await queue_indexes()
+    first = await enqueue(user)
+
+    # Both requests passed the find_one check before either inserted
+    collection_class = type(db.analysis_queue)
+    original_find_one = collection_class.find_one
+    calls = []
+
+    async def find_one_missing_first(self, *args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            return None
+        return await original_find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_class, "find_one", find_one_missing_first)
+    second = await enqueue(user)
+
+    assert len(calls) == 2
+    assert second["_id"] == first["_id"]
+    assert await db.analysis_queue.count_documents({}) == 1
+    assert len(os.listdir(main.UPLOAD_DIR)) == 1  # the losing request's upload is removed
+
+async def test_finished_job_does_not_block_a_new_one(db, user, queue_indexes):
+    await queue_indexes()
+    first = await enqueue(user)
+    job = await worker.claim_job("w1")
+    await worker.finish_job(job, "w1", "completed", "complete", {"ok": True})
+
+    second = await enqueue(user)
+    assert second["_id"] != first["_id"]
+
+async def test_claim_leases_oldest_due_job(db, user):
+    first = await enqueue(user, b"one")
+    await enqueue(user, b"two")
+
+    job = await worker.claim_job("w1")
+    assert job["_id"] == first["_id"]
+    assert job["status"] == "running" and job["lease_owner"] == "w1" and job["attempts"] == 1
+
+    second = await worker.claim_job("w2")
+    assert second["_id"] != first["_id"]
+    assert await worker.claim_job("w3") is None
+
+async def test_expired_lease_is_reclaimed(db, user):
+    queued = await enqueue(user)
+    await worker.claim_job("w1")
+    assert await worker.claim_job("w2") is None
+
+    await db.analysis_queue.update_one(
+        {"_id": queued["_id"]}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+    job = await worker.claim_job("w2")
+    assert job["_id"] == queued["_id"] and job["lease_owner"] == "w2" and job["attempts"] == 2
+
+    # The old owner can no longer renew or finish the job
+    assert not await worker.renew_lease(queued["_id"], "w1")
+    assert await worker.renew_lease(queued["_id"], "w2")
+
+async def test_failure_is_retried_with_backoff_then_dead_lettered(db, user, monkeypatch):
+    monkeypatch.setattr(worker, "JOB_RETRY_BASE_DELAY", 10)
+    queued = await enqueue(user)
+    await db.analysis_queue.update_one({"_id": queued["_id"]}, {"$set": {"max_attempts": 2}})
+    error = {"status_code": 500, "detail": "boom"}
+
+    job = await worker.claim_job("w1")
+    await worker.retry_or_dead_letter(job, "w1", error)
+    retried = await db.analysis_queue.find_one({"_id": queued["_id"]})
+    assert retried["status"] == "queued" and retried["lease_owner"] is None
+    assert retried["available_at"] > datetime.utcnow() + timedelta(seconds=4)
+    assert retried["events"][-1]["event"] == "retrying"
+    assert await worker.claim_job("w1") is None  # not due yet
+
+    await db.analysis_queue.update_one({"_id": queued["_id"]}, {"$set": {"available_at": datetime.utcnow()}})
+    job = await worker.claim_job("w1")
+    await worker.retry_or_dead_letter(job, "w1", error)
+    dead = await db.analysis_queue.find_one({"_id": queued["_id"]})
+    assert dead["status"] == "dead" and dead["error"] == error
+    assert "active" not in dead
+    assert await worker.claim_job("w1") is None
+
+async def test_client_error_fails_without_retry(db, user, monkeypatch):
+    queued = await enqueue(user)
+    job = await worker.claim_job("w1")
+
+    async def bad_upload(*args, **kwargs):
+        raise main.HTTPException(status_code=400, detail="Could not decode image")
+
+    monkeypatch.setattr(main, "run_analysis", bad_upload)
+    await worker.process_job(job, "w1")
+    failed = await db.analysis_queue.find_one({"_id": queued["_id"]})
+    assert failed["status"] == "failed" and failed["attempts"] == 1
+
+async def test_retry_after_the_deadline_runs_gpt_in_full(db, user, monkeypatch):
+    await db.users.insert_one(dict(user))
+
+    async def no_update(state):
+        return {}
+
+    for name in ("process_image_node", "render_overlay_node", "compare_node"):
+        monkeypatch.setattr(main, name, no_update)
+    monkeypatch.setattr(main, "agent", None)
+
+    async def analyze_with_gpt_vision(*args):
+        await asyncio.sleep(0.01)
+        return {"condition": "Healthy", "severity": "Normal"}
+
+    monkeypatch.setattr(main, "analyze_with_gpt_vision", analyze_with_gpt_vision)
+    content = cv2.imencode(".jpg", np.full((40, 60, 3), 128, dtype=np.uint8))[1].tobytes()
+    cache_key = main.analysis_cache_key(user["_id"], content, None)
+    queued = await main.enqueue_analysis(user, str(uuid.uuid4()), content, "eye.jpg", None, cache_key, time.time() + 30)
+
+    # The first attempt fails with a server error and the deadline passes during the backoff
+    job = await worker.claim_job("w1")
+    await worker.retry_or_dead_letter(job, "w1", {"status_code": 503, "detail": "busy"})
+    await db.analysis_queue.update_one(
+        {"_id": queued["_id"]}, {"$set": {"available_at": datetime.utcnow(), "payload.deadline": time.time() - 10}}
+    )
+    await worker.process_job(await worker.claim_job("w1"), "w1")
+
+    finished = await db.analysis_queue.find_one({"_id": queued["_id"]})
+    saved = await db.analyses.find_one({"_id": queued["_id"]})
+    assert finished["status"] == "completed"
+    assert saved["partial"] is False and saved["condition"] == "Healthy"
+
+async def test_retry_clears_the_deadline(db, user):
+    content = b"jpeg bytes"
+    cache_key = main.analysis_cache_key(user["_id"], content, None)
+    queued = await main.enqueue_analysis(user, str(uuid.uuid4()), content, "eye.jpg", None, cache_key, time.time() + 30)
+    job = await worker.claim_job("w1")
+    await worker.retry_or_dead_letter(job, "w1", {"status_code": 500, "detail": "boom"})
+    retried = await db.analysis_queue.find_one({"_id": queued["_id"]})
+    assert retried["payload"]["deadline"] is None
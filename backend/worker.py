@@ -0,0 +1,268 @@
+"""Analysis queue worker.
+
+Consumes the analysis jobs API replicas enqueue in MongoDB when ANALYSIS_QUEUE=mongo,
+so inference can be scaled independently of the API:
+
+    ANALYSIS_QUEUE=mongo python backend/worker.py --concurrency 2
+
+A claimed job is leased for JOB_LEASE_SECONDS and the lease is renewed every
+JOB_HEARTBEAT_SECONDS while the pipeline runs. If a worker dies its lease expires and
+another worker picks the job up. Failed jobs are retried with exponential backoff up to
+JOB_MAX_ATTEMPTS and then dead-lettered with status "dead".
+SIGTERM stops claiming new jobs and lets the running ones finish.
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+import main
+from main import (
+    JOB_HEARTBEAT_SECONDS, JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, JOB_RETRY_BASE_DELAY, MODEL_WARMUP,
+    StageOverloaded
+)
+
+async def claim_job(worker_id: str) -> Optional[Dict[str, Any]]:
+    """Lease the oldest runnable job: queued and due, or running with an expired lease"""
+    now = datetime.utcnow()
+    return await main.db.analysis_queue.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "available_at": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "lease_owner": worker_id,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "heartbeat_at": now,
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        projection={"events": 0},
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def renew_lease(job_id: str, worker_id: str) -> bool:
+    now = datetime.utcnow()
+    result = await main.db.analysis_queue.update_one(
+        {"_id": job_id, "status": "running", "lease_owner": worker_id},
+        {"$set": {
+            "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+            "heartbeat_at": now,
+            "updated_at": now
+        }}
+    )
+    return result.matched_count == 1
+
+async def keep_lease(job_id: str, worker_id: str, pipeline: asyncio.Task):
+    """Heartbeat until cancelled; abandon the pipeline if another worker took the job over"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        if not await renew_lease(job_id, worker_id):
+            print(f"⚠️  Lost lease on analysis job {job_id}, abandoning it")
+            pipeline.cancel()
+            return
+
+def event_entry(event: str, data: Any) -> Dict[str, Any]:
+    return {"event": event, "data": data, "timestamp": datetime.utcnow().isoformat()}
+
+class JobEvents:
+    """Appends stage events to the job document in the order they are published"""
+
+    def __init__(self, job_id: str, worker_id: str):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+
+    def publish(self, event: str, data: Any):
+        self._pending.append(event_entry(event, data))
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            entries, self._pending = self._pending, []
+            await main.db.analysis_queue.update_one(
+                {"_id": self.job_id, "lease_owner": self.worker_id},
+                {"$push": {"events": {"$each": entries}}, "$set": {"updated_at": datetime.utcnow()}}
+            )
+
+async def finish_job(job_doc: Dict[str, Any], worker_id: str, status: str, event: str, data: Any):
+    """Move the job to a terminal status and publish its final event in the same update"""
+    now = datetime.utcnow()
+    await main.db.analysis_queue.update_one(
+        {"_id": job_doc["_id"], "lease_owner": worker_id},
+        {
+            "$set": {
+                "status": status,
+                "result": data if status == "completed" else None,
+                "error": None if status == "completed" else data,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "finished_at": now,
+                "updated_at": now
+            },
+            "$unset": {"active": ""},
+            "$push": {"events": event_entry(event, data)}
+        }
+    )
+
+async def retry_or_dead_letter(job_doc: Dict[str, Any], worker_id: str, error: Dict[str, Any]):
+    attempts = job_doc["attempts"]
+    if attempts >= job_doc["max_attempts"]:
+        print(f"❌ Analysis job {job_doc['_id']} dead-lettered after {attempts} attempts: {error['detail']}")
+        await finish_job(job_doc, worker_id, "dead", "error", error)
+        return
+
+    delay = JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+    now = datetime.utcnow()
+    await main.db.analysis_queue.update_one(
+        {"_id": job_doc["_id"], "lease_owner": worker_id},
+        {
+            "$set": {
+                "status": "queued",
+                "available_at": now + timedelta(seconds=delay),
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "error": error,
+                "payload.deadline": None,  # the waiting request has long gone; retries run in full
+                "updated_at": now
+            },
+            "$push": {"events": event_entry("retrying", {
+                "attempt": attempts,
+                "retry_in_seconds": round(delay, 1),
+                "detail": error["detail"]
+            })}
+        }
+    )
+
+def read_upload(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def process_job(job_doc: Dict[str, Any], worker_id: str):
+    job_id = job_doc["_id"]
+    payload = job_doc["payload"]
+
+    if job_doc["attempts"] > job_doc["max_attempts"]:
+        # Every previous attempt lost its lease, e.g. the job keeps crashing its worker
+        await finish_job(job_doc, worker_id, "dead", "error", {
+            "status_code": 500, "detail": "Analysis job exceeded its retry limit"
+        })
+        return
+
+    # A deadline that has passed (e.g. a reclaimed lease) would only cut GPT-4o off at once
+    deadline = payload.get("deadline")
+    if deadline is not None and deadline <= time.time():
+        deadline = None
+
+    events = JobEvents(job_id, worker_id)
+    try:
+        current_user = await main.db.users.find_one({"_id": job_doc["user_id"]})
+        if current_user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        try:
+            content = await asyncio.get_running_loop().run_in_executor(None, read_upload, payload["image_path"])
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Uploaded image is missing")
+
+        events.publish("started", {"job_id": job_id, "attempt": job_doc["attempts"]})
+        pipeline = asyncio.create_task(main.run_analysis(
+            current_user, job_id, content, payload["filename"], payload["user_description"],
+            payload["cache_key"], events.publish, upload_saved=True, deadline=deadline
+        ))
+        lease = asyncio.create_task(keep_lease(job_id, worker_id, pipeline))
+        try:
+            result = await pipeline
+        except asyncio.CancelledError:
+            if lease.done():
+                return
+            raise
+        finally:
+            lease.cancel()
+
+        await events.flush()
+        await finish_job(job_doc, worker_id, "completed", "complete", result)
+    except HTTPException as e:
+        await events.flush()
+        error = {"status_code": e.status_code, "detail": e.detail}
+        if e.status_code < 500:
+            # Retrying will not fix a bad upload
+            await finish_job(job_doc, worker_id, "failed", "error", error)
+        else:
+            await retry_or_dead_letter(job_doc, worker_id, error)
+    except StageOverloaded:
+        await events.flush()
+        await retry_or_dead_letter(job_doc, worker_id, {
+            "status_code": 503, "detail": "Server is busy, please try again shortly"
+        })
+    except Exception as e:
+        await events.flush()
+        await retry_or_dead_letter(job_doc, worker_id, {"status_code": 500, "detail": f"Analysis failed: {str(e)}"})
+
+async def worker_loop(worker_id: str, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            job_doc = await claim_job(worker_id)
+        except Exception as e:
+            print(f"Failed to claim analysis job: {e}")
+            job_doc = None
+
+        if job_doc is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        print(f"▶️  {worker_id} processing analysis job {job_doc['_id']} (attempt {job_doc['attempts']})")
+        await process_job(job_doc, worker_id)
+
+async def run(concurrency: int):
+    await main.startup_db_client()
+    if main.db is None:
+        raise SystemExit("MongoDB is required to run the analysis worker")
+
+    main.get_agent()
+    main.get_ai_client()
+    if MODEL_WARMUP:
+        await main.warm_up_inference()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    print(f"✅ Analysis worker {worker_id} started with {concurrency} slot(s)")
+    try:
+        await asyncio.gather(*(worker_loop(f"{worker_id}/{slot}", stop) for slot in range(concurrency)))
+    finally:
+        await main.shutdown_db_client()
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Consume analysis jobs from the MongoDB queue")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", 2)),
+                        help="Jobs processed concurrently by this worker (detections still share one model)")
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency))
+
+if __name__ == "__main__":
+    main_cli()